@@ -0,0 +1,58 @@
+#bench_agent_setup.py
+"""Per-request agent setup cost: building the Agent on every message vs. reusing the shared one.
+
+No LLM or MCP server is contacted; only the work done before Runner.run is timed.
+The old code also awaited GOOGLE_MAPS_MCP.connect() per message, which spawned a new
+npx process each time and is not included here.
+
+    python benchmarks/bench_agent_setup.py [--iterations 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Dummy settings so linebot_agent can be imported offline
+os.environ.setdefault("OPENAI_COMPATIBLE_API_BASE_URL", "http://127.0.0.1:9/v1")
+os.environ.setdefault("OPENAI_COMPATIBLE_API_KEY", "bench")
+os.environ.setdefault("OPENAI_COMPATIBLE_API_MODEL_NAME", "bench-model")
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "bench")
+
+import linebot_agent  # noqa: E402
+from linebot_tools import UserInfo  # noqa: E402
+
+
+def per_request_build():
+    # What generate_text_with_agent did for every message before
+    user_info = UserInfo(name="demo", uid="token")
+    return linebot_agent.build_agent([linebot_agent.GOOGLE_MAPS_MCP]), user_info
+
+
+def shared_agent():
+    user_info = UserInfo(name="demo", uid="token")
+    return linebot_agent.agent, user_info
+
+
+def measure(fn, iterations):
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--iterations", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    before = measure(per_request_build, args.iterations)
+    after = measure(shared_agent, args.iterations)
+    print(f"build agent per request: {before:8.2f} us/request")
+    print(f"shared agent:            {after:8.2f} us/request ({before / after:.0f}x less)")
+
+
+if __name__ == "__main__":
+    main()
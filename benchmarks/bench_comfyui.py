@@ -0,0 +1,134 @@
+#bench_comfyui.py
+"""ComfyUIClient against the local fake ComfyUI server.
+
+Checks the paths the bot depends on (success, node error, timeout, cancellation,
+a dropped progress stream), then runs concurrent generations while measuring how
+late a 10 ms ticker on the same event loop gets.
+
+    python benchmarks/bench_comfyui.py [--port 8199] [--concurrency 4] [--steps 5] [--step-delay 0.1]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_comfyui_server import serve  # noqa: E402
+from linebot_comfyui import ComfyUIClient, ComfyUIError, ComfyUITimeout  # noqa: E402
+
+
+def workflow(text):
+    return {"6": {"inputs": {"text": text}}, "10": {"inputs": {"noise_seed": 1}}, "11": {"inputs": {"noise_seed": 2}}}
+
+
+async def check(name, coro):
+    started = time.perf_counter()
+    try:
+        outcome = await coro
+    except Exception as e:
+        outcome = f"{type(e).__name__}: {e}"
+    print(f"{name:<22} {time.perf_counter() - started:6.2f}s  {outcome}")
+
+
+async def scenarios(base_url, fake, args):
+    async with ComfyUIClient(base_url, timeout=30) as client:
+        async def success():
+            images = await client.generate(workflow("a cat"))
+            async with client._get_session().get(client.view_url(images[0])) as response:
+                body = await response.read()
+            assert body.startswith(b"\x89PNG"), "view did not return a PNG"
+            return f"{images[0]['filename']} ({len(body)} bytes)"
+
+        async def node_error():
+            try:
+                await client.generate(workflow("FAIL please"))
+            except ComfyUITimeout:
+                raise
+            except ComfyUIError as e:
+                return f"raised: {e}"
+            raise AssertionError("expected ComfyUIError")
+
+        async def timeout():
+            interrupts = fake.interrupts
+            try:
+                await client.generate(workflow("slow"), timeout=args.step_delay * 1.5)
+            except ComfyUITimeout as e:
+                await asyncio.sleep(args.step_delay * 2)
+                assert fake.interrupts == interrupts + 1, "running prompt was not interrupted"
+                return f"raised and interrupted: {e}"
+            raise AssertionError("expected ComfyUITimeout")
+
+        async def cancel_queued():
+            # The first prompt occupies the fake GPU, the second is still queued when cancelled
+            running = asyncio.create_task(client.generate(workflow("first")))
+            queued = asyncio.create_task(client.generate(workflow("second")))
+            await asyncio.sleep(args.step_delay)
+            deleted = fake.deleted
+            queued.cancel()
+            await asyncio.gather(queued, return_exceptions=True)
+            assert fake.deleted == deleted + 1, "queued prompt was not removed"
+            await running
+            return "queued prompt removed, first one finished"
+
+        await check("success", success())
+        await check("node error", node_error())
+        await check("timeout", timeout())
+        await check("cancel while queued", cancel_queued())
+        print(f"client stats: {client.stats()}")
+
+
+async def dropped_stream(args):
+    fake, runner = await serve(port=args.port + 1, steps=args.steps, step_delay=args.step_delay, drop_ws_at_step=2)
+    try:
+        async with ComfyUIClient(f"http://127.0.0.1:{args.port + 1}", timeout=30, reconnect_delay=0.05) as client:
+            await check("dropped ws", client.generate(workflow("reconnect")))
+            assert client.ws_reconnects == 1
+    finally:
+        await runner.cleanup()
+
+
+async def loop_lag(base_url, args):
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    async with ComfyUIClient(base_url, timeout=60) as client:
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(client.generate(workflow(f"image {i}")) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick
+    lags.sort()
+    print(f"{args.concurrency} generations in {elapsed:.2f}s; "
+          f"loop lag p50 {lags[len(lags) // 2] * 1000:.1f} ms, max {lags[-1] * 1000:.1f} ms over {len(lags)} ticks")
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--port", type=int, default=8199)
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--steps", type=int, default=5)
+    arg_parser.add_argument("--step-delay", type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    fake, runner = await serve(port=args.port, steps=args.steps, step_delay=args.step_delay)
+    try:
+        await scenarios(base_url, fake, args)
+        await loop_lag(base_url, args)
+    finally:
+        await runner.cleanup()
+    await dropped_stream(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
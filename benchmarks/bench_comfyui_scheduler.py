@@ -0,0 +1,94 @@
+#bench_comfyui_scheduler.py
+"""ComfyUIScheduler against several local fake ComfyUI servers.
+
+One server already has a backlog from another client. A heavy user asks for many
+images at once, then two light users ask for a couple each. Compares sending
+everything to the first server with scheduling over all of them, and shows
+identical prompts sharing one render.
+
+    python benchmarks/bench_comfyui_scheduler.py [--servers 3] [--backlog 10] [--heavy 8] [--step-delay 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_comfyui_server import serve  # noqa: E402
+from linebot_comfyui import ComfyUIClient, ComfyUIScheduler  # noqa: E402
+
+BASE_PORT = 8210
+
+
+def workflow(text):
+    return {"6": {"inputs": {"text": text}}, "10": {"inputs": {"noise_seed": 1}}, "11": {"inputs": {"noise_seed": 2}}}
+
+
+async def run(scheduler, args):
+    """Submit the heavy burst, then the light users; returns latency per user."""
+    latencies = {}
+
+    async def one(user_id, i):
+        started = time.perf_counter()
+        await scheduler.generate(workflow(f"{user_id} {i}"), user_id=user_id)
+        latencies.setdefault(user_id, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    jobs = [asyncio.create_task(one("heavy", i)) for i in range(args.heavy)]
+    await asyncio.sleep(0.01)
+    jobs += [asyncio.create_task(one(user_id, i)) for user_id in ("light-1", "light-2") for i in range(2)]
+    await asyncio.gather(*jobs)
+    return time.perf_counter() - started, latencies
+
+
+async def backlog(url, count):
+    async with ComfyUIClient(url) as other:
+        for i in range(count):
+            await other.submit(workflow(f"someone else {i}"))
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--servers", type=int, default=3)
+    arg_parser.add_argument("--backlog", type=int, default=10)
+    arg_parser.add_argument("--heavy", type=int, default=8)
+    arg_parser.add_argument("--steps", type=int, default=4)
+    arg_parser.add_argument("--step-delay", type=float, default=0.05)
+    args = arg_parser.parse_args()
+
+    for label, servers, quota in (("first server only", 1, 1), (f"{args.servers} servers, no quota", args.servers, 10 ** 6),
+                                  (f"{args.servers} servers, quota 1", args.servers, 1)):
+        runners, urls = [], []
+        for i in range(args.servers):
+            _, runner = await serve(port=BASE_PORT + i, steps=args.steps, step_delay=args.step_delay)
+            runners.append(runner)
+            urls.append(f"http://127.0.0.1:{BASE_PORT + i}")
+        scheduler = ComfyUIScheduler(urls[:servers], slots_per_backend=1, user_quota=quota)
+        try:
+            await backlog(urls[0], args.backlog)
+            elapsed, latencies = await run(scheduler, args)
+            light = latencies["light-1"] + latencies["light-2"]
+            print(f"{label:<22} all done in {elapsed:5.2f}s  heavy avg {sum(latencies['heavy']) / len(latencies['heavy']):5.2f}s  "
+                  f"light avg {sum(light) / len(light):5.2f}s  per server {[b.submitted for b in scheduler.backends]}")
+        finally:
+            await scheduler.close()
+            for runner in runners:
+                await runner.cleanup()
+
+    _, runner = await serve(port=BASE_PORT, steps=args.steps, step_delay=args.step_delay)
+    scheduler = ComfyUIScheduler([f"http://127.0.0.1:{BASE_PORT}"])
+    try:
+        prompt = workflow("a red bicycle")
+        results = await asyncio.gather(*(scheduler.generate(prompt, key="a red bicycle", user_id=f"user-{i}") for i in range(5)))
+        print(f"5 identical prompts: {scheduler.backends[0].submitted} render(s), "
+              f"{scheduler.coalesced} coalesced, same image: {len({r[0]['filename'] for r in results}) == 1}")
+    finally:
+        await scheduler.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+#bench_image_cache.py
+"""Repeated image prompts with and without IMAGE_CACHE_ENABLED.
+
+Drives linebot_tools.render_image against the fake ComfyUI server and a local
+moto S3 server (pip install "moto[server]"). A workload of --requests prompts
+drawn from --distinct different ones is rendered with random seeds (every request
+renders) and then with the content-addressed cache (each prompt renders once).
+Finally the cache is swept with a small size limit to check that evicted images
+are deleted from the bucket.
+
+    python benchmarks/bench_image_cache.py [--requests 40] [--distinct 8]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+S3_PORT = 8240
+COMFYUI_PORT = 8241
+
+# linebot_tools reads its configuration at import time
+os.environ.update({
+    "IMAGE_CACHE_ENABLED": "true",
+    "COMFYUI_WS_ENDPOINT": f"http://127.0.0.1:{COMFYUI_PORT}",
+    "MINIO_URL_API": f"http://127.0.0.1:{S3_PORT}",
+    "MINIO_BUCKET": "image",
+    "MINIO_ACCESS_KEY": "bench",
+    "MINIO_SECRET_KEY": "bench",
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import boto3  # noqa: E402
+import requests  # noqa: E402
+from fake_comfyui_server import serve  # noqa: E402
+import linebot_tools  # noqa: E402
+from linebot_imagecache import InMemoryImageCacheIndex  # noqa: E402
+
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+
+async def run(label, prompts):
+    comfyui = linebot_tools.comfyui
+    started = time.perf_counter()
+    urls = [await linebot_tools.render_image(prompt, "bench") for prompt in prompts]
+    elapsed = time.perf_counter() - started
+    renders = sum(backend.stats()["completed"] for backend in comfyui.backends)
+    print(f"{label:<16} {elapsed:6.2f} s for {len(prompts)} requests, "
+          f"{renders} renders on the GPU")
+    return urls
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--requests", type=int, default=40)
+    arg_parser.add_argument("--distinct", type=int, default=8)
+    args = arg_parser.parse_args()
+    rng = random.Random(0)
+    prompts = [f"a watercolor fox, variant {rng.randrange(args.distinct)}" for _ in range(args.requests)]
+
+    s3 = subprocess.Popen([sys.executable, "-m", "moto.server", "-p", str(S3_PORT)],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    endpoint = os.environ["MINIO_URL_API"]
+    for _ in range(100):
+        try:
+            requests.get(endpoint, timeout=1)
+            break
+        except requests.ConnectionError:
+            await asyncio.sleep(0.1)
+    fake, runner = await serve(port=COMFYUI_PORT, steps=5, step_delay=0.02)
+    try:
+        linebot_tools.workflows.load()
+        await linebot_tools.storage.start()
+        cache = linebot_tools.image_cache
+
+        linebot_tools.image_cache = None
+        await run("random seeds", prompts)
+        for backend in linebot_tools.comfyui.backends:
+            backend.completed = 0
+
+        linebot_tools.image_cache = cache
+        cache.start(InMemoryImageCacheIndex())
+        urls = await run("cached", prompts)
+        assert len(set(urls)) == len(set(prompts)), "one object per distinct prompt"
+        print(f"cache stats: {cache.stats()}")
+
+        client = boto3.client("s3", endpoint_url=endpoint, aws_access_key_id="bench",
+                              aws_secret_access_key="bench", region_name="us-east-1")
+        cache.max_entries = 2
+        evicted = await cache.sweep()
+        left = client.list_objects_v2(Bucket="image", Prefix="cache/").get("KeyCount", 0)
+        assert left == len(set(prompts)) - evicted == 2, f"{left} cached objects left"
+        print(f"sweep with max_entries=2 evicted {evicted} entries; {left} cached objects left in the bucket")
+        await cache.close()
+    finally:
+        await linebot_tools.comfyui.close()
+        await linebot_tools.storage.close()
+        await runner.cleanup()
+        s3.terminate()
+        s3.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+#bench_llm_pool.py
+"""Chat completion latency and errors through linebot_llm.LLMPool, against local fake LLM servers.
+
+Scenarios, each sending --requests completions with --concurrency in flight:
+- "one server down": two servers, one refusing connections. A single client on
+  the first URL (the old setup) is compared with the pool, which fails over.
+- "tail latency": two healthy servers, where --slow-fraction of the answers take
+  --slow-factor times longer. The pool without and with hedging (LLM_HEDGE)
+  is compared; hedging starts after a warm-up that fills the p95 window.
+
+    python benchmarks/bench_llm_pool.py [--requests 400] [--concurrency 16] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from openai import AsyncOpenAI  # noqa: E402
+from fake_services import FakeChatCompletions, start_app  # noqa: E402
+from linebot_llm import LLMPool  # noqa: E402
+
+PORTS = (8310, 8311)
+DEAD_URL = "http://127.0.0.1:8319/v1"  # nothing listens here
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class TailLatencyLLM(FakeChatCompletions):
+    """Answers after `latency`, or `slow_factor` times that for `slow_fraction` of requests."""
+
+    def __init__(self, latency, slow_fraction, slow_factor):
+        super().__init__(latency)
+        self.base_latency = latency
+        self.slow_fraction = slow_fraction
+        self.slow_factor = slow_factor
+
+    @property
+    def latency(self):
+        if random.random() < self.slow_fraction:
+            return self.base_latency * self.slow_factor
+        return self.base_latency
+
+    @latency.setter
+    def latency(self, value):
+        pass
+
+
+async def drive(complete, requests, concurrency):
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await complete()
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def report(name, latencies, errors, elapsed, extra=""):
+    ordered = sorted(latencies) or [0.0]
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000
+
+    print(f"{name:<26} ok {len(latencies):4d}  errors {errors:4d}  p50 {pct(50):7.1f}  p95 {pct(95):7.1f}  "
+          f"p99 {pct(99):7.1f}  max {ordered[-1] * 1000:7.1f} ms  {elapsed:5.1f}s {extra}")
+
+
+async def main(args):
+    servers = [TailLatencyLLM(args.latency, args.slow_fraction, args.slow_factor) for _ in PORTS]
+    runners = [await start_app(server.app(), port) for server, port in zip(servers, PORTS)]
+    urls = [f"http://127.0.0.1:{port}/v1" for port in PORTS]
+    try:
+        print(f"one server down ({args.requests} requests, {args.concurrency} concurrent)")
+        for server in servers:
+            server.slow_fraction = 0.0
+        client = AsyncOpenAI(base_url=DEAD_URL, api_key="bench", max_retries=0)
+        report("single client on it", *await drive(
+            lambda: client.chat.completions.create(model="fake", messages=MESSAGES),
+            args.requests, args.concurrency))
+        await client.close()
+        pool = LLMPool([DEAD_URL, urls[0]], "bench", "fake", concurrency=args.concurrency)
+        report("pool with failover", *await drive(lambda: pool.complete(messages=MESSAGES),
+                                                   args.requests, args.concurrency),
+               f"failovers {pool.failovers}")
+        await pool.close()
+
+        print(f"\ntail latency ({args.slow_fraction:.0%} of answers {args.slow_factor:g}x slower)")
+        for server in servers:
+            server.slow_fraction = args.slow_fraction
+        for hedge in (False, True):
+            pool = LLMPool(urls, "bench", "fake", concurrency=args.concurrency, hedge=hedge)
+            await drive(lambda: pool.complete(messages=MESSAGES), args.concurrency * 10, args.concurrency)  # warm-up
+            pool.hedged = pool.hedge_wins = 0
+            sent = sum(server.requests for server in servers)
+            latencies, errors, elapsed = await drive(lambda: pool.complete(messages=MESSAGES),
+                                                     args.requests, args.concurrency)
+            extra = f"server requests {sum(server.requests for server in servers) - sent}"
+            if hedge:
+                extra += f", hedged {pool.hedged}, hedge wins {pool.hedge_wins}"
+            report("pool, hedging " + ("on" if hedge else "off"), latencies, errors, elapsed, extra)
+            await pool.close()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="normal answer time in seconds")
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--slow-factor", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
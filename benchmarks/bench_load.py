@@ -0,0 +1,338 @@
+#bench_load.py
+"""Offline end-to-end load test of the FastAPI app with local stand-ins for every service.
+
+Starts main.app under uvicorn, in this process, against:
+- fake LINE, LLM and OpenWeatherMap servers (fake_services.py)
+- the fake ComfyUI server
+- the stub MCP server (stub_mcp_server.py) as the Google Maps MCP server
+- a moto S3 server as MinIO (pip install "moto[server]"; without it no images are requested)
+- fakeredis as Redis (pip install fakeredis; without it CONVERSATION_STORE=memory)
+
+The stand-ins run on their own event loop thread, so the app's loop only carries
+the app and the load generator. --users simulated users each send --messages
+signed webhooks, waiting for the reply and then a random think time. The mix is
+chat, weather questions (a get_weather tool call) and drawing requests (an image
+job whose picture is pushed later).
+
+Reported:
+- throughput
+- webhook ACK latency and reply latency (webhook sent to reply received by "LINE"),
+  at p50/p95/p99
+- image push latency
+- event-loop lag of the app's loop
+
+tiktoken must already have its cl100k_base encoding cached (TIKTOKEN_CACHE_DIR)
+or be able to download it; the test stops at once if it can't. Nothing else
+leaves the machine.
+
+    python benchmarks/bench_load.py [--users 50] [--messages 5] [--llm-latency 0.5] [--stream]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+APP_PORT = 8300
+LINE_PORT = 8301
+LLM_PORT = 8302
+WEATHER_PORT = 8303
+COMFYUI_PORT = 8304
+S3_PORT = 8305
+CHANNEL_SECRET = "bench-channel-secret"
+
+CHAT = [
+    "Can you recommend a good book about history?",
+    "請介紹一下台北的夜市",
+    "How do I make a cup of pour-over coffee?",
+    "什麼是機器學習？",
+    "Give me three ideas for a weekend trip.",
+]
+WEATHER = ["What's the weather in Taipei today?", "台北今天天氣如何？"]
+DRAW = ["Please draw a lighthouse at dawn", "幫我畫一座燈塔"]
+
+
+def percentiles(samples):
+    if not samples:
+        return "n/a"
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000  # noqa: E731
+    return f"p50 {pick(0.50):7.1f}  p95 {pick(0.95):7.1f}  p99 {pick(0.99):7.1f}  max {ordered[-1] * 1000:7.1f} ms"
+
+
+def signed_webhook(user_id, text, reply_token):
+    """Webhook body and X-Line-Signature for one text message, as LINE sends them."""
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        "message": {"type": "text", "id": str(random.randrange(10 ** 17)), "quoteToken": "q", "text": text},
+    }
+    body = json.dumps({"destination": "Ubench", "events": [event]}, ensure_ascii=False).encode()
+    signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return body, signature
+
+
+def configure(args, with_s3):
+    """Environment for main.py; it reads its configuration at import time."""
+    os.environ.update({
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+        "LINE_API_ENDPOINT": f"http://127.0.0.1:{LINE_PORT}",
+        "OPENAI_COMPATIBLE_API_BASE_URL": f"http://127.0.0.1:{LLM_PORT}/v1",
+        "OPENAI_COMPATIBLE_API_KEY": "bench",
+        "OPENAI_COMPATIBLE_API_MODEL_NAME": "fake-model",
+        "LLM_STREAMING": "true" if args.stream else "false",
+        "WEATHERMAP_API_KEY": "bench",
+        "OPENWEATHERMAP_API_URL": f"http://127.0.0.1:{WEATHER_PORT}",
+        "COMFYUI_WS_ENDPOINT": f"http://127.0.0.1:{COMFYUI_PORT}",
+        "GOOGLE_MAPS_API_KEY": "bench",
+        "GOOGLE_MAPS_MCP_COMMAND": shlex.join([sys.executable, os.path.join(HERE, "stub_mcp_server.py")]),
+        "MCP_POOL_SIZE": "1",
+        "LOG_LEVEL": "WARNING",
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": "6379",
+    })
+    if with_s3:
+        os.environ.update({
+            "MINIO_URL_API": f"http://127.0.0.1:{S3_PORT}",
+            "MINIO_BUCKET": "image",
+            "MINIO_ACCESS_KEY": "bench",
+            "MINIO_SECRET_KEY": "bench",
+        })
+
+
+class StandIns:
+    """The fake services, on an event loop in a background thread."""
+
+    def __init__(self, args, on_message):
+        self.args = args
+        self.on_message = on_message
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runners = []
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(30)
+
+    async def _start(self):
+        from fake_comfyui_server import serve
+        from fake_services import FakeLINE, FakeChatCompletions, FakeWeather, start_app
+        self.line = FakeLINE(self.on_message)
+        self.llm = FakeChatCompletions(self.args.llm_latency, self.args.tokens_per_second)
+        self.weather = FakeWeather()
+        self.runners.append(await start_app(self.line.app(), LINE_PORT))
+        self.runners.append(await start_app(self.llm.app(), LLM_PORT))
+        self.runners.append(await start_app(self.weather.app(), WEATHER_PORT))
+        self.comfyui, runner = await serve(port=COMFYUI_PORT, steps=4, step_delay=0.1)
+        self.runners.append(runner)
+
+    def stop(self):
+        async def cleanup():
+            for runner in self.runners:
+                await runner.cleanup()
+        asyncio.run_coroutine_threadsafe(cleanup(), self.loop).result(30)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+def start_s3():
+    try:
+        import moto.server  # noqa: F401
+    except ImportError:
+        return None
+    import requests
+    process = subprocess.Popen([sys.executable, "-m", "moto.server", "-p", str(S3_PORT)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{S3_PORT}", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    return None
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def run_load(args, results, replies, pushes, image_share):
+    import aiohttp
+    url = f"http://127.0.0.1:{APP_PORT}/webhook"
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+
+    async def user(session, n):
+        user_id = f"U{n:032x}"
+        await asyncio.sleep(rng.uniform(0, args.ramp))
+        for _ in range(args.messages):
+            roll = rng.random()
+            kind = "draw" if roll < image_share else "weather" if roll < image_share + args.weather_share else "chat"
+            text = rng.choice({"draw": DRAW, "weather": WEATHER, "chat": CHAT}[kind])
+            reply_token = uuid.uuid4().hex
+            replies[reply_token] = loop.create_future()
+            if kind == "draw":
+                pushed = loop.create_future()
+                pushes[user_id].append(pushed)
+            body, signature = signed_webhook(user_id, text, reply_token)
+            sent = time.perf_counter()
+            async with session.post(url, data=body, headers={"X-Line-Signature": signature,
+                                                             "Content-Type": "application/json"}) as response:
+                await response.read()
+                results["ack"].append(time.perf_counter() - sent)
+                if response.status != 200:
+                    results["errors"] += 1
+                    continue
+            try:
+                results["reply"].append(await asyncio.wait_for(replies[reply_token], args.timeout) - sent)
+                results["done"] += 1
+                if kind == "draw":
+                    results["image"].append(await asyncio.wait_for(pushed, args.timeout) - sent)
+            except asyncio.TimeoutError:
+                results["timeouts"] += 1
+            await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await asyncio.gather(*(user(session, n) for n in range(args.users)))
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--users", type=int, default=50)
+    arg_parser.add_argument("--messages", type=int, default=5, help="messages per user")
+    arg_parser.add_argument("--think", type=float, default=1.0, help="mean seconds between a reply and the next message")
+    arg_parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which users start")
+    arg_parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before each completion starts")
+    arg_parser.add_argument("--tokens-per-second", type=float, default=100)
+    arg_parser.add_argument("--stream", action="store_true", help="LLM_STREAMING=true")
+    arg_parser.add_argument("--weather-share", type=float, default=0.2)
+    arg_parser.add_argument("--image-share", type=float, default=0.05)
+    arg_parser.add_argument("--timeout", type=float, default=60)
+    arg_parser.add_argument("--seed", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    # Every message is counted in tokens; without the encoding each one would fail
+    import tiktoken
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        sys.exit(f"tiktoken cannot load cl100k_base ({e!r}). Run once with network access, "
+                 f"or point TIKTOKEN_CACHE_DIR at a directory holding the cached encoding.")
+
+    s3 = start_s3()
+    image_share = args.image_share if s3 else 0.0
+    if not s3:
+        print("moto is not installed: no drawing requests")
+    configure(args, with_s3=s3 is not None)
+    try:
+        import fakeredis
+    except ImportError:
+        fakeredis = None
+        os.environ["CONVERSATION_STORE"] = "memory"
+        print("fakeredis is not installed: CONVERSATION_STORE=memory")
+
+    loop = asyncio.get_running_loop()
+    replies = {}  # reply token -> future of when LINE got the reply
+    pushes = defaultdict(deque)  # user id -> futures of expected image pushes
+
+    def on_message(kind, key, at):
+        def resolve():
+            if kind == "reply" and key in replies and not replies[key].done():
+                replies[key].set_result(at)
+            elif kind == "push" and pushes[key]:
+                pushes[key].popleft().set_result(at)
+        loop.call_soon_threadsafe(resolve)
+
+    stand_ins = StandIns(args, on_message)
+    stand_ins.start()
+
+    import aiohttp
+    import uvicorn
+    import main as bot  # imported after configure(): its settings are read at import
+    if fakeredis is not None:
+        create_store = bot.create_conversation_store
+
+        def create_fake_store():
+            # Built at startup like the real one, on a fake server
+            store = create_store()
+            store.redis = fakeredis.FakeAsyncRedis()
+            return store
+
+        bot.create_conversation_store = create_fake_store
+    server = uvicorn.Server(uvicorn.Config(bot.app, host="127.0.0.1", port=APP_PORT, log_level="warning",
+                                           lifespan="on"))
+    launched = time.perf_counter()
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    # Traffic starts once the app reports ready, as behind a load balancer
+    async with aiohttp.ClientSession() as session:
+        while True:
+            async with session.get(f"http://127.0.0.1:{APP_PORT}/ready") as response:
+                if response.status == 200:
+                    break
+            await asyncio.sleep(0.05)
+    print(f"ready {time.perf_counter() - launched:.2f}s after launch")
+    # /ready does not wait for MCP; the load should run with the map tools available
+    while not bot.GOOGLE_MAPS_MCP.connected and time.perf_counter() - launched < 30:
+        await asyncio.sleep(0.05)
+    print(f"MCP {'connected' if bot.GOOGLE_MAPS_MCP.connected else 'not connected'} "
+          f"{time.perf_counter() - launched:.2f}s after launch")
+
+    results = {"ack": [], "reply": [], "image": [], "errors": 0, "timeouts": 0, "done": 0}
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    started = time.perf_counter()
+    try:
+        await run_load(args, results, replies, pushes, image_share)
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        await tick
+        server.should_exit = True
+        await serving
+        stand_ins.stop()
+        if s3:
+            s3.terminate()
+            s3.wait()
+
+    sent = args.users * args.messages
+    print(f"{args.users} users x {args.messages} messages, LLM latency {args.llm_latency:g}s, "
+          f"streaming {'on' if args.stream else 'off'}, {image_share:.0%} drawing, {args.weather_share:.0%} weather")
+    print(f"completed {results['done']}/{sent} in {elapsed:.1f}s: {results['done'] / elapsed:.1f} replies/s; "
+          f"{results['errors']} rejected, {results['timeouts']} timed out")
+    print(f"webhook ACK   {percentiles(results['ack'])}")
+    print(f"reply         {percentiles(results['reply'])}")
+    print(f"image push    {percentiles(results['image'])}")
+    print(f"loop lag      {percentiles(lags)}")
+    print(f"LLM requests {stand_ins.llm.requests} (tool calls {stand_ins.llm.tool_calls}), "
+          f"weather requests {stand_ins.weather.requests}, ComfyUI prompts {stand_ins.comfyui.prompts}, "
+          f"LINE replies {stand_ins.line.replies} / pushes {stand_ins.line.pushes}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
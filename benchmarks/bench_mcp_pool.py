@@ -0,0 +1,79 @@
+#bench_mcp_pool.py
+"""Concurrent MCP tool calls through MCPServerPool against the local stub MCP server.
+
+Compares pool sizes, then makes the stub children crash to show they are restarted.
+
+    python benchmarks/bench_mcp_pool.py [--calls 16] [--delay 0.5] [--sizes 1,4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from agents.mcp import MCPServerStdio  # noqa: E402
+from linebot_mcp import MCPServerPool  # noqa: E402
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_mcp_server.py")
+
+
+def stub_pool(size, delay, crash_after=0, **kwargs):
+    env = dict(os.environ, STUB_MCP_DELAY=str(delay), STUB_MCP_CRASH_AFTER=str(crash_after))
+    return MCPServerPool(
+        lambda i: MCPServerStdio(
+            name=f"stub-{i}",
+            params={"command": sys.executable, "args": [STUB], "env": env},
+            cache_tools_list=True,
+        ),
+        size=size,
+        name="stub-maps",
+        **kwargs,
+    )
+
+
+async def fan_out(pool, calls):
+    async def one(i):
+        try:
+            await pool.call_tool("maps_geocode", {"address": f"Taipei {i}"})
+            return True
+        except Exception:
+            return False
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(calls)))
+    return time.perf_counter() - started, sum(results)
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--calls", type=int, default=16)
+    arg_parser.add_argument("--delay", type=float, default=0.5)
+    arg_parser.add_argument("--sizes", default="1,4")
+    args = arg_parser.parse_args()
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        pool = stub_pool(size, args.delay)
+        started = time.perf_counter()
+        await pool.connect(wait_timeout=30)
+        warm = time.perf_counter() - started
+        elapsed, ok = await fan_out(pool, args.calls)
+        stats = pool.stats()
+        print(f"size={size}: pre-warm {warm:.2f}s, {ok}/{args.calls} calls in {elapsed:.2f}s, "
+              f"avg checkout wait {stats['avg_checkout_wait_ms']} ms")
+        await pool.cleanup()
+
+    # Children exit after 3 calls each; the supervisors restart them
+    pool = stub_pool(2, 0.05, crash_after=3, health_interval=0.5, retry_delay=0.2)
+    await pool.connect(wait_timeout=30)
+    ok = 0
+    for _ in range(4):
+        ok += (await fan_out(pool, 6))[1]
+        await asyncio.sleep(1.5)
+    print(f"crash test: {ok}/24 calls succeeded, stats {pool.stats()}")
+    await pool.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
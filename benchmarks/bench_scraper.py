@@ -0,0 +1,125 @@
+#bench_scraper.py
+"""Scraping a multi-MB page: requests + BeautifulSoup versus the streaming WebScraper.
+
+A local server returns an HTML page of --size-mb (navigation, then article
+paragraphs, then a long comment section), streamed in 64 KiB writes and served
+with an ETag. The old tool downloads and parses all of it and keeps 2000
+characters; WebScraper stops reading once it has them. Reports time and peak
+Python memory per scrape (both timed under tracemalloc, which slows
+bs4 down most), then a repeat scrape that revalidates with a 304.
+
+    python benchmarks/bench_scraper.py [--size-mb 4] [--runs 2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests  # noqa: E402
+from aiohttp import web  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+from linebot_scraper import WebScraper  # noqa: E402
+
+PORT = 8260
+ETAG = '"bench-page-1"'
+
+
+def build_page(size):
+    nav = "<nav><ul>" + "".join(f'<li><a href="/s/{i}">Section {i}</a></li>' for i in range(200)) + "</ul></nav>"
+    paragraph = ("<p>The quick brown fox jumps over the lazy dog while the benchmark streams another "
+                 "paragraph of article text to the scraper. </p>\n")
+    comments = "<div class=comment><a href=/u>user</a> nice article, thanks for sharing!</div>\n"
+    head = f"<html><head><title>Bench</title><style>{'p{}' * 2000}</style></head><body>{nav}<article>"
+    body = paragraph * 60 + "</article><section>"
+    page = head + body
+    page += comments * ((size - len(page)) // len(comments))
+    return (page + "</section></body></html>").encode()
+
+
+def old_scrape(url):
+    """The previous web_scrape_tool body."""
+    response = requests.get(url)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    return {"status": 200, "content": soup.get_text(strip=True)[:2000]}
+
+
+async def serve(page):
+    async def get_page(request):
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304, headers={"ETag": ETAG})
+        response = web.StreamResponse(headers={"Content-Type": "text/html; charset=utf-8", "ETag": ETAG})
+        response.content_length = len(page)
+        await response.prepare(request)
+        view = memoryview(page)
+        try:
+            for i in range(0, len(page), 64 * 1024):
+                await response.write(view[i:i + 64 * 1024])
+        except ConnectionError:
+            pass  # the scraper stopped reading
+        return response
+
+    async def robots(request):
+        return web.Response(text="User-agent: *\nDisallow: /private\n")
+
+    app = web.Application()
+    app.router.add_get("/page", get_page)
+    app.router.add_get("/robots.txt", robots)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+def report(label, elapsed, peak, runs, content):
+    print(f"{label:<22} {elapsed / runs * 1000:8.1f} ms/scrape  peak {peak / 2 ** 20:6.1f} MiB  "
+          f"text {content[:60]!r}")
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--size-mb", type=float, default=4)
+    arg_parser.add_argument("--runs", type=int, default=2)
+    args = arg_parser.parse_args()
+    page = build_page(int(args.size_mb * 2 ** 20))
+    runner = await serve(page)
+    url = f"http://127.0.0.1:{PORT}/page"
+    print(f"page: {len(page) / 2 ** 20:.1f} MiB")
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            result = await asyncio.to_thread(old_scrape, url)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report("requests + bs4", elapsed, peak, args.runs, result["content"])
+
+        scraper = WebScraper(cache_fresh=0)
+        await scraper.scrape(f"http://127.0.0.1:{PORT}/private")  # fetches robots.txt once
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            scraper.cache = type(scraper.cache)(maxsize=1)
+            result = await scraper.scrape(url)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report("WebScraper streaming", elapsed, peak, args.runs, result["content"])
+
+        started = time.perf_counter()
+        again = await scraper.scrape(url)
+        assert again == result
+        print(f"{'revalidated (304)':<22} {(time.perf_counter() - started) * 1000:8.1f} ms")
+        print(f"scraper stats: {scraper.stats()}")
+        await scraper.close()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
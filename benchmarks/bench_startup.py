@@ -0,0 +1,87 @@
+#bench_startup.py
+"""Startup time of the app: `import main`, then its lifespan until the app serves and until /ready.
+
+Each run is a fresh Python process (imports are cached within one), with
+CONVERSATION_STORE=memory, dummy credentials and LLM/S3 endpoints that refuse
+connections, so nothing leaves the machine. Reported per phase, as the median and
+max over --runs:
+- import: `import main`
+- serving: the lifespan's startup, after which uvicorn accepts requests
+- ready: until the background warm-ups /ready waits for are done
+- threads: threads running right after the import (none should be started by it)
+
+--repo points at another checkout (e.g. a git worktree of an older commit) to
+compare. tiktoken must already have its cl100k_base encoding cached
+(TIKTOKEN_CACHE_DIR) or be able to download it.
+
+    python benchmarks/bench_startup.py [--runs 5] [--repo PATH]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ENV = {
+    "LINE_CHANNEL_SECRET": "bench-channel-secret",
+    "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+    "CONVERSATION_STORE": "memory",
+    "OPENAI_COMPATIBLE_API_BASE_URL": "http://127.0.0.1:9/v1",
+    "OPENAI_COMPATIBLE_API_KEY": "bench",
+    "OPENAI_COMPATIBLE_API_MODEL_NAME": "bench",
+    "GOOGLE_MAPS_API_KEY": "bench",
+    "MINIO_URL_API": "http://127.0.0.1:9",
+    "COMFYUI_API_URL": "http://127.0.0.1:9",
+}
+
+# Runs in the child process, in the checked-out tree
+CHILD = """
+import asyncio, json, threading, time
+
+async def run():
+    # Imported inside the loop, as uvicorn does
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    threads = threading.active_count()
+    async with main.lifespan(main.app):
+        serving = time.perf_counter()
+        resources = getattr(main, "resources", None)  # older trees have no /ready
+        while resources is not None and not resources.ready:
+            await asyncio.sleep(0.005)
+        ready = time.perf_counter()
+        print(json.dumps({"import": imported - started, "serving": serving - imported,
+                          "ready": ready - imported, "threads": threads}))
+
+asyncio.run(run())
+"""
+
+
+def run_once(repo):
+    env = dict(os.environ, **ENV)
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=repo, env=env, capture_output=True, text=True,
+                            timeout=120)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"Startup failed:\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def main(args):
+    repo = os.path.abspath(args.repo)
+    runs = [run_once(repo) for _ in range(args.runs)]
+    print(f"{repo}, {args.runs} runs")
+    for phase in ("import", "serving", "ready"):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<8} median {statistics.median(values):8.1f}  max {max(values):8.1f} ms")
+    print(f"threads after import: {max(run['threads'] for run in runs)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--repo", default=os.path.join(HERE, ".."), help="checkout to start main from")
+    main(parser.parse_args())
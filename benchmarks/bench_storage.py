@@ -0,0 +1,118 @@
+#bench_storage.py
+"""Uploading ComfyUI output to S3: the old per-image path versus ImageStorage.
+
+Runs against a local moto S3 server (pip install "moto[server]") and the fake
+ComfyUI server. The old path builds a boto3 client, checks the bucket, rewrites
+its policy and buffers the whole image for every upload; ImageStorage sets up once
+and streams /view into the bucket. Reports time per upload and peak Python memory.
+
+    python benchmarks/bench_storage.py [--uploads 10] [--size-mb 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import boto3  # noqa: E402
+import requests  # noqa: E402
+from fake_comfyui_server import serve  # noqa: E402
+from linebot_storage import ImageStorage  # noqa: E402
+
+S3_PORT = 8230
+COMFYUI_PORT = 8231
+CREDENTIALS = {"aws_access_key_id": "bench", "aws_secret_access_key": "bench", "region_name": "us-east-1"}
+
+
+def old_upload(image_url, bucket, key, endpoint):
+    """The previous upload_image_to_s3, minus its error printing."""
+    response = requests.get(image_url)
+    response.raise_for_status()
+    client = boto3.client("s3", endpoint_url=endpoint, config=boto3.session.Config(signature_version="s3v4"),
+                          **CREDENTIALS)
+    try:
+        client.head_bucket(Bucket=bucket)
+    except client.exceptions.ClientError:
+        client.create_bucket(Bucket=bucket)
+    client.upload_fileobj(BytesIO(response.content), bucket, key)
+    client.put_bucket_policy(Bucket=bucket, Policy=json.dumps({
+        "Version": "2012-10-17",
+        "Statement": [{"Effect": "Allow", "Principal": "*", "Action": "*", "Resource": f"arn:aws:s3:::{bucket}/*"}],
+    }))
+    return f"{endpoint}/{bucket}/{key}"
+
+
+def measure(label, run, uploads, size):
+    tracemalloc.start()
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} {elapsed / uploads * 1000:8.1f} ms/upload  peak {peak / 2 ** 20:6.1f} MiB "
+          f"({size / 2 ** 20:.0f} MiB images)")
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--uploads", type=int, default=10)
+    arg_parser.add_argument("--size-mb", type=float, default=20)
+    args = arg_parser.parse_args()
+    size = int(args.size_mb * 2 ** 20)
+
+    # moto keeps objects in memory, so it runs in its own process to keep it out of the numbers
+    s3 = subprocess.Popen([sys.executable, "-m", "moto.server", "-p", str(S3_PORT)],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    endpoint = f"http://127.0.0.1:{S3_PORT}"
+    for _ in range(100):
+        try:
+            requests.get(endpoint, timeout=1)
+            break
+        except requests.ConnectionError:
+            await asyncio.sleep(0.1)
+    fake, runner = await serve(port=COMFYUI_PORT, view_size=size)
+    image_url = f"http://127.0.0.1:{COMFYUI_PORT}/view?filename=x.png&subfolder=&type=output"
+    try:
+        await asyncio.to_thread(measure, "per-upload client", lambda: [
+            old_upload(image_url, "old", f"{i}.png", endpoint) for i in range(args.uploads)
+        ], args.uploads, size)
+
+        storage = ImageStorage(endpoint, "image", "bench", "bench")
+        started = time.perf_counter()
+        await storage.start()
+        print(f"ImageStorage.start()     {(time.perf_counter() - started) * 1000:8.1f} ms once")
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        for i in range(args.uploads):
+            url = await storage.upload_from_url(image_url, f"{i}.png")
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{'ImageStorage streaming':<24} {elapsed / args.uploads * 1000:8.1f} ms/upload  "
+              f"peak {peak / 2 ** 20:6.1f} MiB ({size / 2 ** 20:.0f} MiB images)")
+
+        client = boto3.client("s3", endpoint_url=endpoint, **CREDENTIALS)
+        head = client.head_object(Bucket="image", Key=f"{args.uploads - 1}.png")
+        policy = json.loads(client.get_bucket_policy(Bucket="image")["Policy"])
+        assert head["ContentLength"] == size, f"uploaded {head['ContentLength']} of {size} bytes"
+        assert head["ContentType"] == "image/png"
+        assert policy["Statement"][0]["Resource"] == ["arn:aws:s3:::image/*"]
+        print(f"verified {url}: {head['ContentLength']} bytes, public read on arn:aws:s3:::image/*")
+        print(f"storage stats: {storage.stats()}")
+        await storage.close()
+    finally:
+        await runner.cleanup()
+        s3.terminate()
+        s3.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+#bench_summary.py
+"""Prompt size and reply latency over a scripted 100-turn chat, with and without rolling summaries.
+
+Runs offline: the chat model is a stand-in whose latency grows with the prompt size,
+and the history lives in InMemoryConversationStore.
+
+    python benchmarks/bench_summary.py [--turns 100] [--ms-per-1k-tokens 40]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from linebot_history import (  # noqa: E402
+    ConversationSummarizer, build_prompt, count_tokens, get_tokenizer, trim_to_budget,
+    LINE_CHAT_HISTORY_TOKENS, LINE_CHAT_SUMMARY_WINDOW_TOKENS,
+)
+from linebot_store import InMemoryConversationStore  # noqa: E402
+
+SYSTEM_PROMPT = "You are a helpful assistant that responds in Traditional Chinese (zh-TW) or english."
+TOPICS = ["台北的天氣", "a trip to Kyoto", "learning Python asyncio", "日本料理", "running a marathon",
+          "the history of Taiwan", "how Redis lists work", "buying a used car", "photography tips", "韓國首爾"]
+
+
+def scripted_turn(i):
+    topic = TOPICS[i % len(TOPICS)]
+    user = f"Turn {i}: tell me more about {topic}, and compare it with what we discussed before."
+    reply = f"Here is more about {topic}. " + " ".join(
+        f"Point {n}: some detail about {topic} that the user may refer back to later." for n in range(1, 6)
+    )
+    return user, reply
+
+
+def count_prompt_tokens(messages):
+    return sum(count_tokens(message["content"]) for message in messages)
+
+
+async def fake_model(prompt_tokens, ms_per_1k_tokens, base_ms):
+    # Prefill dominates for chat models, so latency grows with the prompt
+    await asyncio.sleep((base_ms + prompt_tokens / 1000 * ms_per_1k_tokens) / 1000)
+
+
+async def fake_summarize(summary, messages):
+    await asyncio.sleep(0.2)
+    topics = sorted({message["content"].split("about ")[-1].split(",")[0][:40] for message in messages})
+    return ((summary + " ") if summary else "") + "Discussed: " + "; ".join(topics) + "."
+
+
+async def run(turns, summary_mode, ms_per_1k_tokens, base_ms):
+    store = InMemoryConversationStore(max_length=1000)
+    summarizer = ConversationSummarizer(store, fake_summarize) if summary_mode else None
+    prompt_tokens, latencies = [], []
+
+    for i in range(turns):
+        user_text, reply_text = scripted_turn(i)
+        started = time.perf_counter()
+
+        history, summary = await store.load("bench-user")
+        user_message = {"role": "user", "content": user_text, "tokens": count_tokens(user_text)}
+        if summarizer:
+            overflow, window = summarizer.split(history)
+            summarizer.schedule("bench-user", summary, overflow)
+        else:
+            window, summary = trim_to_budget(history), None
+        messages = build_prompt(SYSTEM_PROMPT, window, user_message, summary)
+        tokens = count_prompt_tokens(messages)
+        await fake_model(tokens, ms_per_1k_tokens, base_ms)
+        await store.append("bench-user", [
+            user_message,
+            {"role": "assistant", "content": reply_text, "tokens": count_tokens(reply_text)},
+        ])
+
+        latencies.append(time.perf_counter() - started)
+        prompt_tokens.append(tokens)
+
+    if summarizer:
+        await summarizer.close()
+    return prompt_tokens, latencies
+
+
+def report(name, prompt_tokens, latencies):
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+    print(
+        f"{name:<12} prompt tokens total={sum(prompt_tokens):>7} mean={statistics.mean(prompt_tokens):>7.0f} "
+        f"max={max(prompt_tokens):>5} | reply latency mean={statistics.mean(latencies_ms):>6.1f} ms p95={p95:>6.1f} ms"
+    )
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--turns", type=int, default=100)
+    arg_parser.add_argument("--ms-per-1k-tokens", type=float, default=40.0)
+    arg_parser.add_argument("--base-ms", type=float, default=20.0)
+    args = arg_parser.parse_args()
+
+    get_tokenizer()
+    print(f"{args.turns} turns, history budget {LINE_CHAT_HISTORY_TOKENS} tokens, "
+          f"summary window {LINE_CHAT_SUMMARY_WINDOW_TOKENS} tokens")
+    report("summary off", *await run(args.turns, False, args.ms_per_1k_tokens, args.base_ms))
+    report("summary on", *await run(args.turns, True, args.ms_per_1k_tokens, args.base_ms))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
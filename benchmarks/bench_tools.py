@@ -0,0 +1,86 @@
+#bench_tools.py
+"""Event-loop responsiveness while slow sync tools run.
+
+Sixteen concurrent calls of a tool that blocks for --block seconds (like a
+requests.get), invoked the way the agent runner invokes tools. "inline" calls the
+sync function on the event loop, as agents SDK versions before thread offloading
+did; "limited_tool" goes through linebot_tools' bounded executor with a
+concurrency cap of 4 and a timeout. A 10 ms ticker measures loop lag meanwhile.
+
+    python benchmarks/bench_tools.py [--calls 16] [--block 0.3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from agents import function_tool  # noqa: E402
+from agents.tool_context import ToolContext  # noqa: E402
+from linebot_tools import limited_tool, tool_stats  # noqa: E402
+
+BLOCK = 0.3
+
+
+def slow_lookup(query: str):
+    """Look something up slowly."""
+    time.sleep(BLOCK)
+    return f"result for {query}"
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def measure(label, invoke, calls):
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(invoke(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    lags.sort()
+    print(f"{label:<14} {elapsed:6.2f} s for {calls} calls  loop lag p50 {lags[len(lags) // 2] * 1000:7.1f} ms  "
+          f"max {lags[-1] * 1000:7.1f} ms  ({len(lags)} ticks)")
+    return results
+
+
+async def main():
+    global BLOCK
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--calls", type=int, default=16)
+    arg_parser.add_argument("--block", type=float, default=0.3)
+    args = arg_parser.parse_args()
+    BLOCK = args.block
+
+    async def inline(i):
+        return slow_lookup(f"q{i}")
+
+    await measure("inline", inline, args.calls)
+
+    limited = function_tool(limited_tool(slow_lookup, timeout=BLOCK * args.calls, concurrency=4))
+
+    async def through_tool(i):
+        arguments = json.dumps({"query": f"q{i}"})
+        context = ToolContext(context=None, tool_name=limited.name, tool_call_id=str(i), tool_arguments=arguments)
+        return await limited.on_invoke_tool(context, arguments)
+
+    results = await measure("limited_tool", through_tool, args.calls)
+    assert results[0] == "result for q0", results[0]
+
+    hung = function_tool(limited_tool(slow_lookup, timeout=BLOCK / 3, concurrency=4))
+    arguments = json.dumps({"query": "hung"})
+    context = ToolContext(context=None, tool_name=hung.name, tool_call_id="t", tool_arguments=arguments)
+    print(f"timeout: {await hung.on_invoke_tool(context, arguments)!r}")
+    print(f"tool stats: {tool_stats()['slow_lookup']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+#bench_workflow.py
+"""Per-request cost of building the ComfyUI payload.
+
+Compares reading and parsing the workflow file on every request (as before) with
+rendering from the cached WorkflowTemplate, checks that rendering leaves the
+template untouched, and that an edited file is picked up.
+
+    python benchmarks/bench_workflow.py [--path data/COMFYUI_WORKFLOW.json] [--requests 2000]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from linebot_workflow import WorkflowLibrary, DEFAULT_WORKFLOW  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def load_every_time(path, prompt):
+    """What the tool did before: read, parse, shallow copy, mutate."""
+    with open(os.path.abspath(path), "r", encoding="utf-8") as f:
+        workflow = json.load(f).copy()
+    workflow["6"]["inputs"]["text"] = prompt
+    workflow["10"]["inputs"]["noise_seed"] = random.randint(1, 49999)
+    workflow["11"]["inputs"]["noise_seed"] = random.randint(50000, 99999)
+    return workflow
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--path", default=os.path.join(ROOT, "data", "COMFYUI_WORKFLOW.json"))
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    library = WorkflowLibrary({DEFAULT_WORKFLOW: args.path})
+    assert not library.load(), "template failed to validate"
+    template = library.get()
+    before = json.dumps(template.workflow, sort_keys=True)
+
+    started = time.perf_counter()
+    for i in range(args.requests):
+        load_every_time(args.path, f"a cat {i}")
+    reload_ms = (time.perf_counter() - started) / args.requests * 1000
+
+    started = time.perf_counter()
+    for i in range(args.requests):
+        payload = library.render(prompt=f"a cat {i}", seed=i, refiner_seed=i + 50000, width=768, height=768)
+    render_ms = (time.perf_counter() - started) / args.requests * 1000
+
+    assert json.dumps(template.workflow, sort_keys=True) == before, "rendering modified the template"
+    assert payload["6"]["inputs"]["text"] == f"a cat {args.requests - 1}" and payload["5"]["inputs"]["width"] == 768
+    shared = sum(payload[node_id] is template.workflow[node_id] for node_id in payload)
+    print(f"load + parse per request: {reload_ms:.3f} ms")
+    print(f"cached template render:  {render_ms:.4f} ms ({reload_ms / render_ms:.0f}x faster), "
+          f"{shared}/{len(payload)} nodes shared with the template")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "workflow.json")
+        shutil.copy(args.path, path)
+        library = WorkflowLibrary({DEFAULT_WORKFLOW: path}, reload_interval=0)
+        library.load()
+        with open(path, encoding="utf-8") as f:
+            workflow = json.load(f)
+        workflow["10"]["inputs"]["steps"] = 30
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(workflow, f)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+        assert library.get().workflow["10"]["inputs"]["steps"] == 30, "edit was not picked up"
+        del workflow["6"]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(workflow, f)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 2_000_000))
+        assert "6" in library.get().workflow, "broken edit replaced the working template"
+        print(f"hot reload: {library.stats()}")
+
+
+if __name__ == "__main__":
+    main()
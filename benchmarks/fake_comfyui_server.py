@@ -0,0 +1,222 @@
+#fake_comfyui_server.py
+"""Local stand-in for a ComfyUI server, for exercising the bot without a GPU.
+
+Implements the parts of the ComfyUI API the bot uses: POST/GET /prompt, GET/POST
+/queue, POST /interrupt, GET /history/{id}, GET /view and the /ws?clientId=
+progress stream. Prompts run one at a time, `steps` steps of `step_delay` seconds
+each. A prompt whose node "6" text contains FAIL ends with an execution_error.
+
+    python benchmarks/fake_comfyui_server.py [--port 8188] [--steps 5] [--step-delay 0.2]
+"""
+import argparse
+import asyncio
+import struct
+import uuid
+import zlib
+from collections import defaultdict
+from aiohttp import web
+
+
+def _png(width=64, height=64):
+    """A plain grey RGB PNG of the given size."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\x00" + b"\x80" * (3 * width) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+PNG = _png()
+
+
+class FakeComfyUI:
+    def __init__(self, steps=5, step_delay=0.2, drop_ws_at_step=None, view_size=0):
+        self.steps = steps
+        self.view_size = view_size  # pad /view images to this many bytes, streamed in 64 KiB chunks
+        self.step_delay = step_delay
+        self.drop_ws_at_step = drop_ws_at_step  # close every websocket once, mid-prompt
+        self.sockets = defaultdict(set)  # client_id -> websockets
+        self.pending = []  # [(prompt_id, workflow, client_id)]
+        self.history = {}
+        self.running = None
+        self.interrupted = set()
+        self.prompts = 0
+        self.interrupts = 0
+        self.deleted = 0
+        self._work = asyncio.Event()
+        self._worker = None
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/prompt", self.post_prompt)
+        app.router.add_get("/prompt", self.get_prompt)
+        app.router.add_get("/queue", self.get_queue)
+        app.router.add_post("/queue", self.post_queue)
+        app.router.add_post("/interrupt", self.post_interrupt)
+        app.router.add_get("/history/{prompt_id}", self.get_history)
+        app.router.add_get("/view", self.get_view)
+        app.router.add_get("/ws", self.ws)
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+    async def _start(self, app):
+        self._worker = asyncio.create_task(self._run())
+
+    async def _stop(self, app):
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        for sockets in self.sockets.values():
+            for ws in list(sockets):
+                await ws.close()
+
+    @property
+    def queue_remaining(self):
+        return len(self.pending) + (self.running is not None)
+
+    async def post_prompt(self, request):
+        body = await request.json()
+        workflow = body.get("prompt")
+        if not isinstance(workflow, dict) or not workflow:
+            return web.json_response({"error": "invalid prompt", "node_errors": {}}, status=400)
+        prompt_id = str(uuid.uuid4())
+        self.pending.append((prompt_id, workflow, body.get("client_id")))
+        self.prompts += 1
+        self._work.set()
+        return web.json_response({"prompt_id": prompt_id, "number": self.prompts, "node_errors": {}})
+
+    async def get_prompt(self, request):
+        return web.json_response({"exec_info": {"queue_remaining": self.queue_remaining}})
+
+    async def get_queue(self, request):
+        running = [[0, self.running[0], self.running[1], {}, []]] if self.running else []
+        pending = [[i + 1, prompt_id, workflow, {}, []] for i, (prompt_id, workflow, _) in enumerate(self.pending)]
+        return web.json_response({"queue_running": running, "queue_pending": pending})
+
+    async def post_queue(self, request):
+        body = await request.json()
+        delete = set(body.get("delete") or [])
+        before = len(self.pending)
+        self.pending = [item for item in self.pending if item[0] not in delete]
+        self.deleted += before - len(self.pending)
+        return web.json_response({})
+
+    async def post_interrupt(self, request):
+        body = await request.json() if request.can_read_body else {}
+        prompt_id = body.get("prompt_id")
+        if self.running and (prompt_id is None or prompt_id == self.running[0]):
+            self.interrupted.add(self.running[0])
+            self.interrupts += 1
+        return web.json_response({})
+
+    async def get_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        return web.json_response({prompt_id: self.history[prompt_id]} if prompt_id in self.history else {})
+
+    async def get_view(self, request):
+        if len(PNG) >= self.view_size:
+            return web.Response(body=PNG, content_type="image/png")
+        response = web.StreamResponse(headers={"Content-Type": "image/png"})
+        response.content_length = self.view_size
+        await response.prepare(request)
+        await response.write(PNG)
+        remaining = self.view_size - len(PNG)
+        chunk = b"\x00" * 65536
+        while remaining > 0:
+            await response.write(chunk[:remaining])
+            remaining -= len(chunk)
+        await response.write_eof()
+        return response
+
+    async def ws(self, request):
+        client_id = request.query.get("clientId") or str(uuid.uuid4())
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self.sockets[client_id].add(ws)
+        await ws.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": self.queue_remaining}}, "sid": client_id}})
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self.sockets[client_id].discard(ws)
+        return ws
+
+    async def _send(self, client_id, kind, data):
+        for ws in list(self.sockets.get(client_id, ())):
+            try:
+                await ws.send_json({"type": kind, "data": data})
+            except ConnectionError:
+                pass
+
+    async def _run(self):
+        dropped = False
+        while True:
+            await self._work.wait()
+            if not self.pending:
+                self._work.clear()
+                continue
+            prompt_id, workflow, client_id = self.pending.pop(0)
+            self.running = (prompt_id, workflow)
+            text = str(workflow.get("6", {}).get("inputs", {}).get("text", ""))
+            await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+            status = "success"
+            for step in range(1, self.steps + 1):
+                await asyncio.sleep(self.step_delay)
+                if prompt_id in self.interrupted:
+                    status = "interrupted"
+                    break
+                if self.drop_ws_at_step == step and not dropped:
+                    dropped = True
+                    for ws in list(self.sockets.get(client_id, ())):
+                        await ws.close()
+                await self._send(client_id, "progress", {"value": step, "max": self.steps, "prompt_id": prompt_id, "node": "3"})
+                # Binary latent preview frames are interleaved with the JSON messages
+                for ws in list(self.sockets.get(client_id, ())):
+                    try:
+                        await ws.send_bytes(b"\x00\x00\x00\x01" + PNG)
+                    except ConnectionError:
+                        pass
+            if status == "success" and "FAIL" in text:
+                status = "error"
+            self.running = None
+            if status == "interrupted":
+                self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False}}
+                await self._send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": "3"})
+            elif status == "error":
+                self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False}}
+                await self._send(client_id, "execution_error", {
+                    "prompt_id": prompt_id, "node_id": "3", "exception_message": "fake sampler failure",
+                })
+            else:
+                filename = f"ComfyUI_{prompt_id[:8]}.png"
+                self.history[prompt_id] = {
+                    "outputs": {"9": {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}},
+                    "status": {"status_str": "success", "completed": True},
+                }
+                await self._send(client_id, "executed", {"node": "9", "prompt_id": prompt_id,
+                                                         "output": self.history[prompt_id]["outputs"]["9"]})
+                await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+                await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+
+async def serve(port=8188, host="127.0.0.1", **kwargs):
+    """Start a FakeComfyUI on host:port; returns (fake, runner). Stop with runner.cleanup()."""
+    fake = FakeComfyUI(**kwargs)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return fake, runner
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8188)
+    arg_parser.add_argument("--steps", type=int, default=5)
+    arg_parser.add_argument("--step-delay", type=float, default=0.2)
+    args = arg_parser.parse_args()
+    web.run_app(FakeComfyUI(steps=args.steps, step_delay=args.step_delay).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#fake_services.py
+"""Local stand-ins for the LINE Messaging API, an OpenAI-compatible LLM and OpenWeatherMap.
+
+Used by bench_load.py; each class builds an aiohttp app.
+
+- FakeLINE accepts replies, pushes and loading animations, and calls `on_message`
+  with ("reply", reply_token) or ("push", user_id) and the time it arrived.
+- FakeChatCompletions answers /v1/chat/completions, streamed or not, after
+  `latency` seconds, emitting `tokens_per_second`. A user message mentioning the
+  weather gets a get_weather tool call first, one asking to draw gets a
+  generate_image_and_get_url call; the answer after a tool result is plain text.
+- FakeWeather answers /data/2.5/weather and /data/2.5/forecast.
+"""
+import asyncio
+import json
+import time
+import uuid
+from aiohttp import web
+
+ANSWER = ("Here is a short answer from the fake model. It is long enough to look like a normal reply "
+          "in a chat, spans a couple of sentences, and ends here.")
+
+
+class FakeLINE:
+    def __init__(self, on_message=None):
+        self.on_message = on_message
+        self.replies = 0
+        self.pushes = 0
+        self.loading = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v2/bot/message/reply", self.reply)
+        app.router.add_post("/v2/bot/message/push", self.push)
+        app.router.add_post("/v2/bot/chat/loading/start", self.loading_start)
+        return app
+
+    async def reply(self, request):
+        body = await request.json()
+        self.replies += 1
+        if self.on_message:
+            self.on_message("reply", body["replyToken"], time.perf_counter())
+        return web.json_response({})
+
+    async def push(self, request):
+        body = await request.json()
+        self.pushes += 1
+        if self.on_message:
+            self.on_message("push", body["to"], time.perf_counter())
+        return web.json_response({})
+
+    async def loading_start(self, request):
+        self.loading += 1
+        return web.json_response({}, status=202)
+
+
+class FakeChatCompletions:
+    def __init__(self, latency=0.5, tokens_per_second=50):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests = 0
+        self.tool_calls = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        return app
+
+    def _decide(self, messages):
+        """(tool name, arguments) to call, or None to answer with text."""
+        last = messages[-1]
+        if last["role"] != "user":
+            return None
+        text = str(last.get("content", "")).lower()
+        if "weather" in text or "天氣" in text:
+            return "get_weather", {"city": "Taipei"}
+        if "draw" in text or "畫" in text:
+            return "generate_image_and_get_url", {"prompt": "a lighthouse at dawn", "workflow": ""}
+        return None
+
+    async def completions(self, request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        call = self._decide(body["messages"])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        base = {"id": completion_id, "created": int(time.time()), "model": body.get("model", "fake")}
+        usage = {"prompt_tokens": 100, "completion_tokens": 40, "total_tokens": 140}
+        if call:
+            self.tool_calls += 1
+            tool_call = {"id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                         "function": {"name": call[0], "arguments": json.dumps(call[1])}}
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": None if call else ANSWER}
+            if call:
+                message["tool_calls"] = [tool_call]
+            return web.json_response({
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if call else "stop"}],
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None, **extra):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send({"role": "assistant", "content": ""})
+        if call:
+            await send({"tool_calls": [{"index": 0, **tool_call}]})
+            await send({}, "tool_calls")
+        else:
+            for word in ANSWER.split(" "):
+                await send({"content": word + " "})
+                await asyncio.sleep(1 / self.tokens_per_second)
+            await send({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+class FakeWeather:
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.requests = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self.current)
+        app.router.add_get("/data/2.5/forecast", self.forecast)
+        return app
+
+    async def current(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response({"weather": [{"description": "clear sky"}], "main": {"temp": 26.0},
+                                  "timezone": 28800})
+
+    async def forecast(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        start = int(time.time()) // 10800 * 10800
+        items = [{"dt": start + i * 10800, "main": {"temp": 22 + i % 8},
+                  "weather": [{"description": "few clouds"}]} for i in range(40)]
+        return web.json_response({"list": items, "city": {"timezone": 28800}})
+
+
+async def start_app(app, port, host="127.0.0.1"):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
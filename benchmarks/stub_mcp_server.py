@@ -0,0 +1,45 @@
+#stub_mcp_server.py
+"""Local stand-in for @modelcontextprotocol/server-google-maps, speaking MCP over stdio.
+
+    STUB_MCP_DELAY=0.5        seconds each tool call takes
+    STUB_MCP_CRASH_AFTER=3    exit the process after this many calls (0 = never)
+"""
+import asyncio
+import os
+
+try:
+    from mcp.server.mcpserver import MCPServer as FastMCP  # mcp >= 2
+except ImportError:
+    from mcp.server.fastmcp import FastMCP
+
+DELAY = float(os.getenv("STUB_MCP_DELAY") or "0.5")
+CRASH_AFTER = int(os.getenv("STUB_MCP_CRASH_AFTER") or "0")
+
+server = FastMCP("stub-google-maps")
+calls = 0
+
+
+async def _slow_call():
+    global calls
+    calls += 1
+    await asyncio.sleep(DELAY)
+    if CRASH_AFTER and calls >= CRASH_AFTER:
+        os._exit(1)
+
+
+@server.tool()
+async def maps_geocode(address: str) -> str:
+    """Convert an address into geographic coordinates."""
+    await _slow_call()
+    return f'{{"address": "{address}", "location": {{"lat": 25.0330, "lng": 121.5654}}, "pid": {os.getpid()}}}'
+
+
+@server.tool()
+async def maps_search_places(query: str) -> str:
+    """Search for places using a text query."""
+    await _slow_call()
+    return f'{{"query": "{query}", "places": [{{"name": "Taipei 101"}}], "pid": {os.getpid()}}}'
+
+
+if __name__ == "__main__":
+    server.run()
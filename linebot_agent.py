@@ -1,12 +1,14 @@
 #linebot_agent.py
 import os
-from openai import AsyncOpenAI
+import logging
+import shlex
 from typing import List, Dict
 from linebot_tools import get_weather, translate_to_chinese, translate_to_english
 from linebot_tools import translate_to_Japanese, translate_to_Korean, generate_image_and_get_url
 from linebot_tools import web_search_tool, web_scrape_tool, UserInfo
 import asyncio
-from agents import Agent, OpenAIChatCompletionsModel, Runner, set_tracing_disabled
+import time
+from agents import Agent, Runner, set_tracing_disabled
 # import asyncio
 # import os
 # import shutil
@@ -14,31 +16,53 @@ from agents import Agent, OpenAIChatCompletionsModel, Runner, set_tracing_disabl
 # from agents import Agent, Runner, gen_trace_id, trace
 from agents.mcp import MCPServer 
 from agents.mcp import MCPServerStdio, MCPServerSse
+from linebot_mcp import MCPServerPool
+from linebot_llm import LLMPool
+from linebot_metrics import LatencyRecorder, span
+
+logger = logging.getLogger(__name__)
+
+# Seconds start_agent() waits for the first MCP connection (npx may need to download the server)
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT") or "60")
+# Command line of the Google Maps MCP server, e.g. a local stand-in for load tests
+GOOGLE_MAPS_MCP_COMMAND = shlex.split(
+    os.getenv("GOOGLE_MAPS_MCP_COMMAND") or "npx -y @modelcontextprotocol/server-google-maps")
 
 # OpenAI Agent configuration
-OPENAI_BASE_URL = os.getenv("OPENAI_COMPATIBLE_API_BASE_URL") or ""
+OPENAI_BASE_URL = os.getenv("OPENAI_COMPATIBLE_API_BASE_URL") or ""  # several servers: comma separated
 OPENAI_API_KEY = os.getenv("OPENAI_COMPATIBLE_API_KEY") or ""
 OPENAI_MODEL_NAME = os.getenv("OPENAI_COMPATIBLE_API_MODEL_NAME") or ""
 
-# Validate environment variables
-if not OPENAI_BASE_URL or not OPENAI_API_KEY or not OPENAI_MODEL_NAME :
-    raise ValueError(
-        "Please set OPENAI_BASE_URL, OPENAI_API_KEY,OPENAI_MODEL_NAME via env var or code."
-    )
 
-# Initialize OpenAI client
-client = AsyncOpenAI(base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY)
+def check_config():
+    """Validate environment variables; called at startup, so the module can be imported without them."""
+    if not OPENAI_BASE_URL or not OPENAI_API_KEY or not OPENAI_MODEL_NAME :
+        raise ValueError(
+            "Please set OPENAI_BASE_URL, OPENAI_API_KEY,OPENAI_MODEL_NAME via env var or code."
+        )
+
+AGENT_ERROR_MESSAGE = "Sorry, process your request error!"
+
+# Stream answers so slow generations can be shown early (see linebot_reply.StreamingReply)
+LLM_STREAMING = (os.getenv("LLM_STREAMING") or "false").lower() in ("1", "true", "yes")
+
+# OpenAI-compatible servers, each with its own concurrency limit; clients are created on first use
+llm = LLMPool(OPENAI_BASE_URL, OPENAI_API_KEY, OPENAI_MODEL_NAME)
 set_tracing_disabled(disabled=True)
 
-# Use async context manager to initialize the server
-GOOGLE_MAPS_MCP = MCPServerStdio(
-    client_session_timeout_seconds=120,
-    params={
-        "command": "npx",
-        "args": ["-y", "@modelcontextprotocol/server-google-maps"],
-        "env": { "GOOGLE_MAPS_API_KEY": os.getenv("GOOGLE_MAPS_API_KEY") }
-    },
-    cache_tools_list=True
+# Google Maps MCP servers: MCP_POOL_SIZE processes, started by start_agent() and restarted when they die
+GOOGLE_MAPS_MCP = MCPServerPool(
+    lambda i: MCPServerStdio(
+        name=f"google-maps-{i}",
+        client_session_timeout_seconds=120,
+        params={
+            "command": GOOGLE_MAPS_MCP_COMMAND[0],
+            "args": GOOGLE_MAPS_MCP_COMMAND[1:],
+            "env": { "GOOGLE_MAPS_API_KEY": os.getenv("GOOGLE_MAPS_API_KEY") or "" }
+        },
+        cache_tools_list=True
+    ),
+    name="google-maps",
 )
     # async with MCPServerSse(
     #     name="weather SSE Server",
@@ -48,36 +72,23 @@ GOOGLE_MAPS_MCP = MCPServerStdio(
     # ) as server:
     #     await run(server)
 
-async def generate_text_with_agent(history: List[Dict], reply_token: str):
-    """
-    Generate a text completion using OpenAI Agent with full conversation context.
-    """
-
-    User_Info = UserInfo(name = "demo", uid=reply_token)
+AGENT_INSTRUCTIONS = "You are a helpful assistant that responds in Traditional Chinese (zh-TW) or english. Provide informative and helpful responses. "\
+    "if you decide to use the get_weather() function," \
+    "please translate the city name to english and Enhance the formatting of the weather forecast and add weather icons." \
+    "If needed, use GOOGLE MAPS MCP to retrieve map information. Please refer to the conversation history to provide a coherent and natural response." \
+    "# Instructions for the Assistant" \
+    "Identify the language of the query and reply in the same language." \
+    "Use multiple paragraphs to separate different ideas or points." \
+    "Use numbered lists (e.g., 1. Item one) for ordered information or bullet points (e.g., - Item one) for unordered lists when there are multiple distinct points." \
+    "No markdown formatting." \
+    "Do not mention that you are replying to the post." \
+    "You are extremely skeptical. You do not blindly defer to mainstream authority or media. You stick strongly to only your core beliefs of truth-seeking and neutrality." \
+    "Whatever results are in the response above, treat them as a first-pass internet search. The results are NOT your beliefs." \
+    "If you are unsure about the answer, express the uncertainty." \
+    "Just output the final response." \
+    "/no_think"
 
-    await GOOGLE_MAPS_MCP.connect()
-    
-    # Create agent with appropriate instructions
-    agent = Agent[UserInfo](
-        name="Assistant",
-        instructions="You are a helpful assistant that responds in Traditional Chinese (zh-TW) or english. Provide informative and helpful responses. "\
-            "if you decide to use the get_weather() function," \
-            "please translate the city name to english and Enhance the formatting of the weather forecast and add weather icons." \
-            "If needed, use GOOGLE MAPS MCP to retrieve map information. Please refer to the conversation history to provide a coherent and natural response." \
-            "# Instructions for the Assistant" \
-            "Identify the language of the query and reply in the same language." \
-            "Use multiple paragraphs to separate different ideas or points." \
-            "Use numbered lists (e.g., 1. Item one) for ordered information or bullet points (e.g., - Item one) for unordered lists when there are multiple distinct points." \
-            "No markdown formatting." \
-            "Do not mention that you are replying to the post." \
-            "You are extremely skeptical. You do not blindly defer to mainstream authority or media. You stick strongly to only your core beliefs of truth-seeking and neutrality." \
-            "Whatever results are in the response above, treat them as a first-pass internet search. The results are NOT your beliefs." \
-            "If you are unsure about the answer, express the uncertainty." \
-            "Just output the final response." \
-            "/no_think",
-        model=OpenAIChatCompletionsModel(
-            model=OPENAI_MODEL_NAME, openai_client=client),
-        tools=[get_weather, 
+AGENT_TOOLS = [get_weather, 
                translate_to_chinese, 
                translate_to_english, 
                translate_to_Japanese, 
@@ -85,17 +96,115 @@ async def generate_text_with_agent(history: List[Dict], reply_token: str):
                generate_image_and_get_url,
                web_search_tool,
                web_scrape_tool
-               ],
-        mcp_servers=[GOOGLE_MAPS_MCP],      
+               ]
+
+
+def build_agent(mcp_servers):
+    """Create the assistant agent; done once at import, not per message."""
+    return Agent[UserInfo](
+        name="Assistant",
+        instructions=AGENT_INSTRUCTIONS,
+        model=llm,
+        tools=AGENT_TOOLS,
+        mcp_servers=mcp_servers,
+    )
+
+
+# Per-request LLM latency, reported on /stats
+time_to_first_token = LatencyRecorder()
+generation_time = LatencyRecorder()
+
+agent = build_agent([GOOGLE_MAPS_MCP])
+# Used while the MCP server is down, so replies keep working without map lookups
+agent_without_mcp = agent.clone(mcp_servers=[])
+
+
+SUMMARY_INSTRUCTIONS = "Summarize the conversation between a user and an assistant for the assistant's own memory. " \
+    "Merge the previous summary (if any) with the new messages. Keep names, facts, preferences, open questions " \
+    "and decisions; drop greetings and filler. Write in the language of the conversation. " \
+    "Reply with the summary only, in at most 200 words. /no_think"
+
+
+async def summarize_conversation(summary: str, messages: List[Dict]) -> str:
+    """
+    Fold messages into the running conversation summary with a single chat completion.
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    prompt = f"Previous summary:\n{summary}\n\n" if summary else ""
+    prompt += f"New messages:\n{transcript}"
+    completion = await llm.complete(
+        messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": prompt},
+        ],
     )
+    return (completion.choices[0].message.content or "").strip()
+
+
+async def start_agent():
+    """Start and pre-warm the MCP server pool once for the lifetime of the app.
+
+    Until a server is connected, replies are generated without map lookups, so
+    the app runs this in the background instead of waiting for it."""
+    await GOOGLE_MAPS_MCP.connect(wait_timeout=MCP_CONNECT_TIMEOUT)
+
+
+async def stop_agent():
+    await GOOGLE_MAPS_MCP.cleanup()
+    await llm.close()
+
+
+def agent_stats():
+    return {
+        "streaming": int(LLM_STREAMING),
+        "time_to_first_token": time_to_first_token.stats(),
+        "total": generation_time.stats(),
+    }
+
+
+async def generate_text_with_agent(history: List[Dict], reply_token: str, on_text=None, user_id: str = ""):
+    """
+    Generate a text completion using OpenAI Agent with full conversation context.
+
+    With LLM_STREAMING on, on_text(text_so_far) is called as the answer streams in; the
+    text restarts from "" whenever the agent starts a new model turn (e.g. after a tool call).
+    """
+
+    User_Info = UserInfo(name = "demo", uid=reply_token, user_id=user_id or "")
+
+    # The agent is shared; only the per-request UserInfo travels through the run context
+    run_agent = agent if GOOGLE_MAPS_MCP.connected else agent_without_mcp
+
+    with span("llm", "stream" if LLM_STREAMING else "run") as llm_span:
+        started = time.monotonic()
+        try:
+            if not LLM_STREAMING:
+                result = await Runner.run(
+                            run_agent,
+                            history, 
+                            context=User_Info,
+                            )
+                return result.final_output
 
-    try:
-        result = await Runner.run(
-                    agent,
-                    history, 
-                    context=User_Info,
-                    )
-        return result.final_output
-    except Exception as e:
-        print(f"Error with LLM Agent: {e}")
-        return f"Sorry, process your request error!  {str(e)}"
+            result = Runner.run_streamed(run_agent, history, context=User_Info)
+            text = ""
+            first_token = True
+            async for event in result.stream_events():
+                if event.type != "raw_response_event":
+                    continue
+                if event.data.type == "response.created":
+                    text = ""
+                elif event.data.type == "response.output_text.delta":
+                    if first_token:
+                        time_to_first_token.record(time.monotonic() - started)
+                        first_token = False
+                    text += event.data.delta
+                    if on_text:
+                        on_text(text)
+            return result.final_output
+        except Exception as e:
+            llm_span.fail()
+            logger.exception("Error with LLM Agent")
+            return f"{AGENT_ERROR_MESSAGE}  {str(e)}"
+        finally:
+            generation_time.record(time.monotonic() - started)
@@ -0,0 +1,269 @@
+#linebot_cache.py
+import hashlib
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import wraps
+
+# Response cache configuration (opt-in)
+RESPONSE_CACHE_ENABLED = (os.getenv("RESPONSE_CACHE_ENABLED") or "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE") or "1000")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY") or "0.92")
+RESPONSE_CACHE_MIN_CHARS = int(os.getenv("RESPONSE_CACHE_MIN_CHARS") or "6")
+
+# Seconds a cached answer stays valid, by the kind of tool the question needs
+RESPONSE_CACHE_TTLS = {
+    "weather": int(os.getenv("RESPONSE_CACHE_TTL_WEATHER") or "600"),
+    "search": int(os.getenv("RESPONSE_CACHE_TTL_SEARCH") or "1800"),
+    "maps": int(os.getenv("RESPONSE_CACHE_TTL_MAPS") or "86400"),
+    "general": int(os.getenv("RESPONSE_CACHE_TTL_GENERAL") or "86400"),
+}
+
+# First matching category wins; None means the answer must never be cached
+TOOL_CATEGORIES = [
+    (None, re.compile(r"畫|繪|圖片|照片|image|picture|photo|draw|generate|翻譯|translate", re.I)),
+    ("weather", re.compile(r"天氣|氣溫|溫度|下雨|降雨|颱風|weather|forecast|temperature|rain", re.I)),
+    ("search", re.compile(r"新聞|最新|今天|現在|股價|匯率|news|latest|today|now|price|stock|score", re.I)),
+    ("maps", re.compile(r"地址|附近|怎麼去|路線|地圖|餐廳|where is|nearby|address|route|directions|restaurant", re.I)),
+]
+
+# Turns that lean on earlier ones ("and tomorrow?", "那明天呢"); their answer depends on the user's history
+FOLLOW_UP = re.compile(
+    r"^(and|or|but|so|also|then|what about|how about|same|again)\b|\b(it|its|that|this|there|them|those|these)\b"
+    r"|^(那|還有|然後|所以|另外|再)|(呢|那裡|那邊|這個|那個|他們|它)", re.I)
+
+# Turns about the user or the conversation ("what is my name", "我叫什麼名字"); only that user's history answers them
+PERSONAL = re.compile(
+    r"\b(i|me|my|mine|myself|we|us|our|ours|remember|remembered|earlier|previous|previously|before|last time)\b"
+    r"|我|咱|記得|剛才|剛剛|之前|上次|前面|說過|問過", re.I)
+
+# Words that carry no entity (city, query, name); everything else in a question must match for a similar hit
+STOP_WORDS = frozenset("""
+a an the is are was were be will would can could should do does did i me my you your we our it to of in on at
+for from with about what whats how hows which who when where why like please tell give show find any some
+much many there this that and or going s t d m ll re ve
+""".split())
+CJK_STOP = re.compile(r"的|了|嗎|呢|吧|啊|是|在|有|會|要|請|問|一下|我|你|如何|怎麼樣|怎麼|怎樣|什麼|多少|哪裡|幾度|告訴|查")
+CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+NGRAM_DIMENSIONS = 1024
+
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def items(self):
+        """Live (key, value) pairs, least recently used first; does not count as use."""
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def touch(self, key):
+        if key in self._data:
+            self._data.move_to_end(key)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def normalize_question(text):
+    """Case-, width- and punctuation-insensitive form of a question."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def tool_category(text):
+    for category, pattern in TOOL_CATEGORIES:
+        if pattern.search(text):
+            return category
+    return "general"
+
+
+def is_follow_up(text):
+    return bool(FOLLOW_UP.search(text))
+
+
+def is_personal(text):
+    return bool(PERSONAL.search(text))
+
+
+def question_entities(text):
+    """The words of a normalised question that name what it is about: numbers, places, search terms.
+
+    Category keywords ("weather", "天氣") and function words are dropped, so
+    "Kyoto forecast" gives {"kyoto"} and "台北天氣如何" gives {"台北"}.
+    """
+    for _, pattern in TOOL_CATEGORIES:
+        text = pattern.sub(" ", text)
+    text = CJK_STOP.sub(" ", text)
+    entities = set()
+    for word in text.split():
+        for part in CJK_RUN.split(word):
+            if part and part not in STOP_WORDS:
+                entities.add(part)
+        entities.update(CJK_RUN.findall(word))
+    return frozenset(entities)
+
+
+def ngram_vector(text):
+    """Hashed character 2/3-gram vector, L2-normalised; works without word boundaries (zh/ja)."""
+    compact = text.replace(" ", "_")
+    vector = {}
+    for n in (2, 3):
+        for i in range(len(compact) - n + 1):
+            digest = hashlib.blake2b(compact[i:i + n].encode(), digest_size=4).digest()
+            index = int.from_bytes(digest, "little") % NGRAM_DIMENSIONS
+            vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+    return {index: value / norm for index, value in vector.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class ResponseCache:
+    """Answers to recently asked questions, matched exactly or by n-gram similarity.
+
+    Keyed on the tool category, the question's entities (the city, search terms,
+    numbers the tools would be called with) and the normalised last user message;
+    each category has its own TTL (weather expires quickly, general knowledge
+    slowly). A similar question only hits an entry with the same category and
+    entities, so "Kyoto forecast" never gets the Tokyo answer. The cache is shared
+    by all users, so questions whose answer depends on who asks are never cached:
+    follow-ups ("and tomorrow?"), questions about the user or the conversation
+    ("what is my name", "what did I just ask"), short turns, and image or
+    translation requests.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, similarity=RESPONSE_CACHE_SIMILARITY,
+                 ttls=RESPONSE_CACHE_TTLS, min_chars=RESPONSE_CACHE_MIN_CHARS):
+        self.similarity = similarity
+        self.ttls = ttls
+        self.min_chars = min_chars
+        self._entries = TTLCache(maxsize=maxsize)  # (category, entities, question) -> (vector, answer, cost)
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.saved_seconds = 0.0
+
+    def _key(self, question):
+        question = normalize_question(question)
+        if len(question) < self.min_chars or is_follow_up(question) or is_personal(question):
+            return None
+        category = tool_category(question)
+        if category is None:
+            return None
+        return category, question_entities(question), question
+
+    def get(self, question):
+        key = self._key(question)
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.exact_hits += 1
+        else:
+            entry = self._most_similar(key)
+            if entry is None:
+                return None
+            self.similar_hits += 1
+        _, answer, cost = entry
+        self.saved_seconds += cost
+        return answer
+
+    def _most_similar(self, key):
+        category, entities, question = key
+        vector = ngram_vector(question)
+        best, best_key, best_score = None, None, self.similarity
+        for other_key, entry in self._entries.items():
+            # Places, search terms and numbers must match exactly however similar the rest is
+            if other_key[:2] != (category, entities):
+                continue
+            score = cosine(vector, entry[0])
+            if score >= best_score:
+                best, best_key, best_score = entry, other_key, score
+        if best_key is not None:
+            self._entries.touch(best_key)
+        return best
+
+    def put(self, question, answer, cost=0.0):
+        """Remember answer; cost is the generation time a later hit saves."""
+        key = self._key(question)
+        if key is None:
+            return
+        self._entries.set(key, (ngram_vector(key[2]), answer, cost), ttl=self.ttls.get(key[0]))
+
+    def wrap(self, generate, should_cache=None):
+        """Cache around generate(history, ...) keyed on the last user message of history."""
+
+        @wraps(generate)
+        async def cached_generate(history, *args, **kwargs):
+            question = history[-1]["content"] if history and history[-1].get("role") == "user" else ""
+            answer = self.get(question) if question else None
+            if answer is not None:
+                return answer
+            started = time.monotonic()
+            answer = await generate(history, *args, **kwargs)
+            if question and (should_cache is None or should_cache(answer)):
+                self.put(question, answer, time.monotonic() - started)
+            return answer
+
+        return cached_generate
+
+    def stats(self):
+        hits = self.exact_hits + self.similar_hits
+        lookups = self._entries.hits + self._entries.misses
+        return {
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": lookups - hits,
+            "evictions": self._entries.evictions,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+        }
@@ -0,0 +1,428 @@
+#linebot_comfyui.py
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import Counter, deque
+from urllib.parse import urlencode
+import aiohttp
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# ComfyUI client configuration
+COMFYUI_TIMEOUT = float(os.getenv("COMFYUI_TIMEOUT") or "120")  # seconds for one whole generation
+COMFYUI_REQUEST_TIMEOUT = float(os.getenv("COMFYUI_REQUEST_TIMEOUT") or "10")  # seconds per HTTP call
+COMFYUI_RECONNECT_DELAY = float(os.getenv("COMFYUI_RECONNECT_DELAY") or "1")
+
+# Scheduling over several ComfyUI servers
+COMFYUI_BACKEND_SLOTS = int(os.getenv("COMFYUI_BACKEND_SLOTS") or "2")  # prompts this bot keeps on each server
+COMFYUI_USER_QUOTA = int(os.getenv("COMFYUI_USER_QUOTA") or "1")  # prompts one user may have rendering at once
+COMFYUI_QUEUE_REFRESH = float(os.getenv("COMFYUI_QUEUE_REFRESH") or "1")  # seconds queue lengths are reused
+
+
+class ComfyUIError(RuntimeError):
+    """ComfyUI rejected or failed a prompt."""
+
+
+class ComfyUITimeout(ComfyUIError):
+    """A prompt did not finish within the client's timeout."""
+
+
+class ComfyUIUnreachable(ComfyUIError):
+    """The server could not be reached before the prompt was submitted; another server can take it."""
+
+
+class ComfyUIClient:
+    """Async client for one ComfyUI server.
+
+    Prompts are submitted with `POST /prompt` and their completion is read from the
+    `/ws?clientId=` progress stream, so waiting for an image costs no requests and
+    never blocks the event loop. A prompt that times out or whose caller is
+    cancelled is removed from ComfyUI's queue, or interrupted if it is running.
+    """
+
+    def __init__(self, base_url, client_id=None, session=None, timeout=COMFYUI_TIMEOUT,
+                 request_timeout=COMFYUI_REQUEST_TIMEOUT, reconnect_delay=COMFYUI_RECONNECT_DELAY):
+        self.base_url = (base_url or "").rstrip("/")
+        self.client_id = client_id or str(uuid.uuid4())
+        self.timeout = timeout
+        self.request_timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self.reconnect_delay = reconnect_delay
+        self._session = session
+        self._owns_session = session is None
+        self.generation_time = LatencyRecorder()
+        self.queue_wait = LatencyRecorder()  # submitted until ComfyUI starts executing it
+        self.render_time = LatencyRecorder()  # execution start until done
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.ws_reconnects = 0
+
+    @property
+    def ws_url(self):
+        scheme, sep, rest = self.base_url.partition("://")
+        scheme = {"https": "wss", "http": "ws"}.get(scheme, scheme)
+        return f"{scheme}{sep}{rest}/ws?clientId={self.client_id}"
+
+    def _get_session(self):
+        # Created on first use so the client can be built before the event loop runs
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def view_url(self, image):
+        """URL that downloads an output image listed in a prompt's history."""
+        query = urlencode({
+            "filename": image["filename"],
+            "subfolder": image.get("subfolder", ""),
+            "type": image.get("type", "output"),
+        })
+        return f"{self.base_url}/view?{query}"
+
+    async def generate(self, workflow, timeout=None):
+        """Run a workflow and return its output images as {"filename", "subfolder", "type", "url"} dicts.
+
+        Images also get "render_seconds", the GPU time, when the start of execution was seen."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        timing = {}
+        prompt_id = None
+        ws = None
+        self.in_flight += 1
+        try:
+            async with asyncio.timeout(timeout):
+                try:
+                    # Listen before submitting, so a fast prompt can't finish unseen
+                    ws = await self._connect_ws()
+                    prompt_id = await self.submit(workflow)
+                except aiohttp.ClientConnectorError as e:
+                    raise ComfyUIUnreachable(f"ComfyUI server {self.base_url} unreachable: {e}") from e
+                timing["submitted"] = time.monotonic()
+                ws = await self._wait(prompt_id, ws, timing)
+                images = await self.images(prompt_id)
+                if images is None:
+                    raise ComfyUIError(f"ComfyUI finished prompt {prompt_id} but has no history for it")
+        except TimeoutError:
+            self.timeouts += 1
+            await self._abandon(prompt_id)
+            raise ComfyUITimeout(f"ComfyUI prompt {prompt_id} did not finish within {timeout:g}s") from None
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            await self._abandon(prompt_id)
+            raise
+        except ComfyUIError:
+            self.failed += 1
+            raise
+        except Exception:
+            # e.g. the progress stream or history could not be read: don't leave the prompt rendering
+            self.failed += 1
+            await self._abandon(prompt_id)
+            raise
+        finally:
+            self.in_flight -= 1
+            if ws is not None:
+                await ws.close()
+        finished = time.monotonic()
+        self.completed += 1
+        self.generation_time.record(finished - started)
+        if "executing" in timing:
+            self.queue_wait.record(timing["executing"] - timing["submitted"])
+            self.render_time.record(finished - timing["executing"])
+            for image in images:
+                image["render_seconds"] = finished - timing["executing"]
+        return images
+
+    async def submit(self, workflow):
+        """Queue a workflow and return its prompt id."""
+        payload = {"prompt": workflow, "client_id": self.client_id}
+        async with self._get_session().post(f"{self.base_url}/prompt", json=payload,
+                                            timeout=self.request_timeout) as response:
+            data = await response.json(content_type=None)
+            if response.status != 200 or "prompt_id" not in data:
+                raise ComfyUIError(f"ComfyUI rejected the prompt ({response.status}): {data.get('error') or data}")
+        self.submitted += 1
+        return data["prompt_id"]
+
+    async def images(self, prompt_id):
+        """Output images of a finished prompt, or None if ComfyUI has no history for it yet."""
+        async with self._get_session().get(f"{self.base_url}/history/{prompt_id}",
+                                           timeout=self.request_timeout) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        if prompt_id not in data:
+            return None
+        entry = data[prompt_id]
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            raise ComfyUIError(f"ComfyUI prompt {prompt_id} failed")
+        return [
+            dict(image, url=self.view_url(image))
+            for node_output in entry.get("outputs", {}).values()
+            for image in node_output.get("images", [])
+        ]
+
+    async def queue_remaining(self):
+        """Prompts queued or running on this server, from GET /prompt."""
+        async with self._get_session().get(f"{self.base_url}/prompt", timeout=self.request_timeout) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        return int(data["exec_info"]["queue_remaining"])
+
+    async def interrupt(self, prompt_id):
+        """Drop a queued prompt, or stop it if it is the one running."""
+        session = self._get_session()
+        async with session.post(f"{self.base_url}/queue", json={"delete": [prompt_id]},
+                                timeout=self.request_timeout):
+            pass
+        async with session.get(f"{self.base_url}/queue", timeout=self.request_timeout) as response:
+            queue = await response.json(content_type=None)
+        # Older ComfyUI ignores prompt_id and stops whatever runs, so only interrupt our own prompt
+        if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+            async with session.post(f"{self.base_url}/interrupt", json={"prompt_id": prompt_id},
+                                    timeout=self.request_timeout):
+                pass
+
+    async def _abandon(self, prompt_id):
+        if prompt_id is None:
+            return
+        try:
+            # Shielded, so a cancelled caller still frees the GPU
+            await asyncio.shield(asyncio.wait_for(self.interrupt(prompt_id), self.request_timeout.total))
+        except (Exception, asyncio.CancelledError) as e:
+            logger.warning(f"Interrupting ComfyUI prompt {prompt_id} failed: {e!r}")
+
+    async def _connect_ws(self):
+        return await self._get_session().ws_connect(self.ws_url, heartbeat=30)
+
+    async def _wait(self, prompt_id, ws, timing):
+        """Read the progress stream until prompt_id is done; returns the websocket in use."""
+        while True:
+            done = await self._read_until_done(prompt_id, ws, timing)
+            if done:
+                return ws
+            # Stream dropped: the prompt may have finished while we weren't listening
+            await ws.close()
+            self.ws_reconnects += 1
+            if await self.images(prompt_id) is not None:
+                return ws
+            await asyncio.sleep(self.reconnect_delay)
+            ws = await self._connect_ws()
+            if await self.images(prompt_id) is not None:
+                return ws
+
+    async def _read_until_done(self, prompt_id, ws, timing):
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue  # binary frames are latent previews
+            event = json.loads(message.data)
+            kind, data = event.get("type"), event.get("data") or {}
+            if data.get("prompt_id") != prompt_id:
+                continue
+            if kind == "execution_start":
+                timing["executing"] = time.monotonic()
+            elif kind == "progress":
+                logger.debug(f"ComfyUI prompt {prompt_id}: step {data.get('value')}/{data.get('max')}")
+            elif kind == "execution_error":
+                raise ComfyUIError(
+                    f"ComfyUI prompt {prompt_id} failed in node {data.get('node_id')}: {data.get('exception_message')}"
+                )
+            elif kind == "execution_interrupted":
+                raise ComfyUIError(f"ComfyUI prompt {prompt_id} was interrupted")
+            elif kind == "execution_success" or (kind == "executing" and data.get("node") is None):
+                return True
+        return False
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "ws_reconnects": self.ws_reconnects,
+            "in_flight": self.in_flight,
+            "generation": self.generation_time.stats(),
+            "queue_wait": self.queue_wait.stats(),
+            "render": self.render_time.stats(),
+        }
+
+
+class ComfyUIScheduler:
+    """Spreads prompts over several ComfyUI servers.
+
+    Each prompt goes to the healthy server with the shortest queue, as reported by
+    `GET /prompt` (refreshed at most every `queue_refresh` seconds) plus what was
+    sent there since. At most `slots_per_backend` prompts per server are in flight
+    from this process; the rest wait here, where users take turns. A free slot goes
+    to the next waiting user with fewer than `user_quota` prompts rendering, so one
+    user's burst can't starve everyone else; slots nobody else wants are still used.
+    Calls with the same `key` while one is in flight share its result.
+    """
+
+    def __init__(self, base_urls, client_id=None, slots_per_backend=COMFYUI_BACKEND_SLOTS,
+                 user_quota=COMFYUI_USER_QUOTA, queue_refresh=COMFYUI_QUEUE_REFRESH, **client_kwargs):
+        if isinstance(base_urls, str):
+            base_urls = base_urls.split(",")
+        base_urls = [url.strip() for url in base_urls if url and url.strip()] or [""]
+        client_id = client_id or str(uuid.uuid4())  # this process, on every server
+        self.backends = [ComfyUIClient(url, client_id=client_id, **client_kwargs) for url in base_urls]
+        self.capacity = len(self.backends) * max(1, slots_per_backend)
+        self.user_quota = max(1, user_quota)
+        self.queue_refresh = queue_refresh
+        self._queue_depth = {backend: 0 for backend in self.backends}  # as last reported
+        self._sent_since_refresh = Counter()
+        self._healthy = {backend: True for backend in self.backends}
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._waiting = {}  # user_id -> deque of futures, in turn order
+        self._running_by_user = Counter()
+        self._running = 0
+        self._shared = {}  # key -> [task, number of callers waiting for it]
+        self.slot_wait = LatencyRecorder()
+        self.coalesced = 0
+        self.failovers = 0
+
+    async def close(self):
+        await asyncio.gather(*(backend.close() for backend in self.backends))
+
+    async def generate(self, workflow, key=None, user_id=None, timeout=None):
+        """Run a workflow on the least loaded server; returns its output images (see ComfyUIClient)."""
+        if key is None:
+            return await self._generate(workflow, user_id, timeout)
+        shared = self._shared.get(key)
+        if shared is None:
+            task = asyncio.create_task(self._generate(workflow, user_id, timeout))
+            shared = self._shared[key] = [task, 0]
+            task.add_done_callback(lambda _: self._shared.pop(key, None))
+        else:
+            self.coalesced += 1
+        shared[1] += 1
+        try:
+            return await asyncio.shield(shared[0])
+        except asyncio.CancelledError:
+            # Only stop the render once nobody is waiting for it any more
+            if not shared[0].done() and shared[1] == 1:
+                shared[0].cancel()
+            raise
+        finally:
+            shared[1] -= 1
+
+    async def _generate(self, workflow, user_id, timeout):
+        await self._acquire(user_id)
+        try:
+            tried = set()
+            while True:
+                backend = await self._pick(tried)
+                self._sent_since_refresh[backend] += 1
+                try:
+                    return await backend.generate(workflow, timeout=timeout)
+                except ComfyUIUnreachable as e:
+                    # Nothing was submitted yet, so another server can take the prompt
+                    self._healthy[backend] = False
+                    tried.add(backend)
+                    if len(tried) == len(self.backends):
+                        raise ComfyUIError(f"No ComfyUI server reachable: {e}") from e
+                    self.failovers += 1
+                    logger.warning(f"{e}; trying another")
+        finally:
+            self._release(user_id)
+
+    async def _pick(self, exclude=()):
+        await self._refresh()
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        healthy = [backend for backend in candidates if self._healthy[backend]] or candidates
+        return min(healthy, key=lambda backend: (
+            self._queue_depth[backend] + self._sent_since_refresh[backend], backend.in_flight,
+        ))
+
+    async def _refresh(self):
+        if time.monotonic() - self._refreshed_at < self.queue_refresh:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._refreshed_at < self.queue_refresh:
+                return
+            depths = await asyncio.gather(*(backend.queue_remaining() for backend in self.backends),
+                                          return_exceptions=True)
+            for backend, depth in zip(self.backends, depths):
+                self._healthy[backend] = not isinstance(depth, BaseException)
+                if self._healthy[backend]:
+                    self._queue_depth[backend] = depth
+                else:
+                    logger.warning(f"ComfyUI server {backend.base_url} queue check failed: {depth!r}")
+            self._sent_since_refresh.clear()
+            self._refreshed_at = time.monotonic()
+
+    async def _acquire(self, user_id):
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(user_id)  # granted a slot just as the caller gave up
+            else:
+                waiter.cancel()
+                self._dispatch()
+            raise
+        self.slot_wait.record(time.monotonic() - started)
+
+    def _release(self, user_id):
+        self._running -= 1
+        self._running_by_user[user_id] -= 1
+        if self._running_by_user[user_id] <= 0:
+            del self._running_by_user[user_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiting users in turn, preferring users under their quota."""
+        while self._running < self.capacity and self._waiting:
+            user_id = next((user_id for user_id in self._waiting
+                            if self._running_by_user[user_id] < self.user_quota), next(iter(self._waiting)))
+            waiters = self._waiting.pop(user_id)
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting[user_id] = waiters  # back of the line
+            if waiter.done():
+                continue  # cancelled while waiting
+            self._running += 1
+            self._running_by_user[user_id] += 1
+            waiter.set_result(None)
+
+    def stats(self):
+        backends = {}
+        for backend in self.backends:
+            backends[backend.base_url] = dict(
+                backend.stats(),
+                healthy=int(self._healthy[backend]),
+                queue_depth=self._queue_depth[backend],
+            )
+        return {
+            "capacity": self.capacity,
+            "running": self._running,
+            "waiting": sum(len(waiters) for waiters in self._waiting.values()),
+            "waiting_users": len(self._waiting),
+            "coalesced": self.coalesced,
+            "failovers": self.failovers,
+            "slot_wait": self.slot_wait.stats(),
+            "backends": backends,
+        }
@@ -0,0 +1,191 @@
+#linebot_dedup.py
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# Webhook deduplication configuration
+# LINE redelivers an event when the webhook answers slowly or fails; each event keeps its webhookEventId
+WEBHOOK_DEDUP_ENABLED = (os.getenv("WEBHOOK_DEDUP_ENABLED") or "true").lower() in ("1", "true", "yes")
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL") or "86400")  # seconds a handled event id is remembered
+# A claim not marked done within this time (the replica died mid-event) lets a redelivery through
+WEBHOOK_DEDUP_PROCESSING_TTL = int(os.getenv("WEBHOOK_DEDUP_PROCESSING_TTL") or "600")
+
+PROCESSING = "processing"
+DONE = "done"
+
+
+def get_event_claim_key(event_id):
+    return f"webhook:event:{event_id}"
+
+
+class EventClaims(ABC):
+    """Atomic first-come claims on webhook event ids, shared by every replica that uses the same store."""
+
+    @abstractmethod
+    async def claim(self, event_ids, ttl):
+        """Claim each id for ttl seconds; returns one bool per id, True where this call got the claim."""
+
+    @abstractmethod
+    async def mark(self, event_id, state, ttl):
+        """Set an existing claim's state and TTL."""
+
+    @abstractmethod
+    async def release(self, event_ids):
+        """Drop claims so the events are processed when LINE delivers them again."""
+
+
+class RedisEventClaims(EventClaims):
+    """SET NX EX per event id on the conversation store's Redis."""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def claim(self, event_ids, ttl):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for event_id in event_ids:
+                pipe.set(get_event_claim_key(event_id), PROCESSING, nx=True, ex=ttl)
+            return [bool(claimed) for claimed in await pipe.execute()]
+
+    async def mark(self, event_id, state, ttl):
+        await self.redis.set(get_event_claim_key(event_id), state, xx=True, ex=ttl)
+
+    async def release(self, event_ids):
+        if event_ids:
+            await self.redis.delete(*(get_event_claim_key(event_id) for event_id in event_ids))
+
+
+class InMemoryEventClaims(EventClaims):
+    """Process-local claims; only deduplicates deliveries that reach this replica."""
+
+    def __init__(self, sweep_interval=60):
+        self._claims = {}  # event id -> (expires_at, state)
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self._sweep_interval
+        self._claims = {key: value for key, value in self._claims.items() if value[0] > now}
+
+    async def claim(self, event_ids, ttl):
+        now = time.monotonic()
+        self._sweep(now)
+        claimed = []
+        for event_id in event_ids:
+            entry = self._claims.get(event_id)
+            if entry is not None and entry[0] > now:
+                claimed.append(False)
+            else:
+                self._claims[event_id] = (now + ttl, PROCESSING)
+                claimed.append(True)
+        return claimed
+
+    async def mark(self, event_id, state, ttl):
+        if event_id in self._claims:
+            self._claims[event_id] = (time.monotonic() + ttl, state)
+
+    async def release(self, event_ids):
+        for event_id in event_ids:
+            self._claims.pop(event_id, None)
+
+
+class WebhookDeduplicator:
+    """Drops webhook events another delivery (on any replica) has already claimed.
+
+    `claim` is called before the webhook is acknowledged: each event's
+    webhookEventId is claimed atomically for `processing_ttl` seconds, and only the
+    events this delivery won are returned. `done` keeps the id for `ttl` seconds
+    after the event is handled; `release` gives the ids back when the delivery is
+    refused so LINE's retry is processed. Events without an id pass through, and so
+    does everything while the claim store is unreachable (duplicates are cheaper
+    than lost messages).
+    """
+
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, processing_ttl=WEBHOOK_DEDUP_PROCESSING_TTL):
+        self.ttl = ttl
+        self.processing_ttl = processing_ttl
+        self.claims = None
+        self.claimed = 0
+        self.duplicates = 0
+        self.redelivered = 0
+        self.redelivered_duplicates = 0
+        self.errors = 0
+
+    def start(self, claims):
+        self.claims = claims
+
+    async def claim(self, events):
+        """The events of one delivery that this replica should process."""
+        for event in events:
+            if _is_redelivery(event):
+                self.redelivered += 1
+        ids = [event.webhook_event_id for event in events if getattr(event, "webhook_event_id", None)]
+        if self.claims is None or not ids:
+            return list(events)
+        try:
+            won = dict(zip(ids, await self.claims.claim(ids, self.processing_ttl)))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Claiming webhook events failed, processing them without deduplication: {e!r}")
+            return list(events)
+
+        accepted = []
+        for event in events:
+            event_id = getattr(event, "webhook_event_id", None)
+            if event_id and not won[event_id]:
+                self.duplicates += 1
+                if _is_redelivery(event):
+                    self.redelivered_duplicates += 1
+                logger.info(f"Dropping duplicate webhook event {event_id}")
+                continue
+            if event_id:
+                self.claimed += 1
+            accepted.append(event)
+        return accepted
+
+    async def done(self, event):
+        """Remember a handled event for `ttl` seconds."""
+        event_id = getattr(event, "webhook_event_id", None)
+        if self.claims is None or not event_id:
+            return
+        try:
+            await self.claims.mark(event_id, DONE, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Marking webhook event {event_id} done failed: {e!r}")
+
+    async def release(self, events):
+        ids = [event.webhook_event_id for event in events if getattr(event, "webhook_event_id", None)]
+        if self.claims is None or not ids:
+            return
+        try:
+            await self.claims.release(ids)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Releasing webhook events failed: {e!r}")
+
+    def stats(self):
+        return {
+            "claimed": self.claimed,
+            "duplicates": self.duplicates,
+            "redelivered": self.redelivered,
+            "redelivered_duplicates": self.redelivered_duplicates,
+            "errors": self.errors,
+        }
+
+
+def _is_redelivery(event):
+    context = getattr(event, "delivery_context", None)
+    return bool(context and context.is_redelivery)
+
+
+def create_event_claims(conversation_store):
+    """Share the conversation store's Redis client when there is one."""
+    redis = getattr(conversation_store, "redis", None)
+    if redis is not None:
+        return RedisEventClaims(redis)
+    return InMemoryEventClaims()
@@ -0,0 +1,169 @@
+#linebot_history.py
+import asyncio
+import logging
+import os
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the history sent with each prompt (system prompt and new message excluded)
+LINE_CHAT_HISTORY_TOKENS = int(os.getenv("LINE_CHAT_HISTORY_TOKENS") or "3000")
+TOKENIZER_ENCODING = "cl100k_base"
+# When the BPE ranks are loaded (downloaded once, then read from tiktoken's disk cache):
+# "background" while the app already serves, "startup" before it serves, "lazy" on the first message
+TOKENIZER_PRELOAD = (os.getenv("TOKENIZER_PRELOAD") or "background").lower()
+
+# Rolling summary configuration: older turns are folded into a summary instead of being dropped
+LINE_CHAT_SUMMARY_ENABLED = (os.getenv("LINE_CHAT_SUMMARY_ENABLED") or "false").lower() in ("1", "true", "yes")
+LINE_CHAT_SUMMARY_WINDOW_TOKENS = int(os.getenv("LINE_CHAT_SUMMARY_WINDOW_TOKENS") or "1000")
+LINE_CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv("LINE_CHAT_SUMMARY_MIN_MESSAGES") or "4")
+LINE_CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("LINE_CHAT_SUMMARY_MAX_TOKENS") or "400")
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    """Return the shared tiktoken encoder; the first call loads the BPE ranks."""
+    import tiktoken
+
+    return tiktoken.get_encoding(TOKENIZER_ENCODING)
+
+
+async def preload_tokenizer():
+    """Load the tokenizer in a worker thread; a failure is logged and the load retried on first use."""
+    started = time.monotonic()
+    try:
+        await asyncio.to_thread(get_tokenizer)
+    except Exception as e:
+        logger.warning(f"Loading the {TOKENIZER_ENCODING} tokenizer failed, retrying on first use: {e!r}")
+        return
+    logger.info(f"Loaded the {TOKENIZER_ENCODING} tokenizer in {time.monotonic() - started:.2f}s")
+
+
+def count_tokens(text):
+    return len(get_tokenizer().encode(text))
+
+
+def message_tokens(message):
+    """Token count of a history entry, computed only for entries stored without one."""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(message.get("content") or "")
+    return tokens
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to at most max_tokens tokens; returns (text, token count)."""
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return tokenizer.decode(tokens[:max_tokens]), max_tokens
+
+
+def trim_to_budget(history, budget=LINE_CHAT_HISTORY_TOKENS):
+    """Return the longest tail of history whose token counts fit in budget.
+
+    Walks back from the newest message, so the cost depends only on how many
+    messages are kept, not on how long the stored history is.
+    """
+    used = 0
+    start = len(history)
+    while start > 0:
+        tokens = message_tokens(history[start - 1])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    return history[start:]
+
+
+def to_model_input(messages):
+    """Strip bookkeeping fields so only role/content reach the model."""
+    return [{"role": message["role"], "content": message["content"]} for message in messages]
+
+
+def build_prompt(system_prompt, window, user_message, summary=None):
+    """Model input: system prompt, running summary (if any), history window, new message."""
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    return messages + to_model_input(window + [user_message])
+
+
+class ConversationSummarizer:
+    """Folds messages that fall out of the prompt window into a per-user running summary.
+
+    `summarize` is an async callable (previous summary, messages) -> new summary. It runs
+    in a background task, so the reply never waits for it; the summary shows up in the
+    prompt from the next turn on.
+    """
+
+    def __init__(self, store, summarize, window_tokens=LINE_CHAT_SUMMARY_WINDOW_TOKENS,
+                 min_messages=LINE_CHAT_SUMMARY_MIN_MESSAGES, max_tokens=LINE_CHAT_SUMMARY_MAX_TOKENS):
+        self._store = store
+        self._summarize = summarize
+        self.window_tokens = window_tokens
+        self.min_messages = min_messages
+        self.max_tokens = max_tokens
+        self._tasks = {}  # user_id -> running summary task
+        self._time_total = 0.0
+        self.scheduled = 0
+        self.completed = 0
+        self.stale = 0
+        self.failed = 0
+        self.summarized_messages = 0
+
+    def split(self, history):
+        """Return (overflow, window): the messages outside and inside the token window."""
+        window = trim_to_budget(history, self.window_tokens)
+        return history[:len(history) - len(window)], window
+
+    def schedule(self, user_id, summary, overflow):
+        """Start summarizing overflow unless there is too little of it or a run is in flight."""
+        if len(overflow) < self.min_messages or user_id in self._tasks:
+            return False
+        task = asyncio.create_task(self._run(user_id, summary, list(overflow)))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+        self.scheduled += 1
+        return True
+
+    async def _run(self, user_id, summary, overflow):
+        started = time.monotonic()
+        try:
+            new_summary = await self._summarize(summary, overflow)
+            new_summary, _ = truncate_to_tokens(new_summary, self.max_tokens)
+            if await self._store.save_summary(user_id, new_summary, overflow):
+                self.completed += 1
+                self.summarized_messages += len(overflow)
+            else:
+                # History changed underneath (cleared or trimmed); the next turn retries
+                self.stale += 1
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Summarizing conversation of {user_id} failed")
+        finally:
+            self._time_total += time.monotonic() - started
+
+    async def close(self, timeout=None):
+        """Give running summaries a chance to finish, then cancel the rest."""
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self):
+        runs = self.completed + self.stale + self.failed
+        return {
+            "in_flight": len(self._tasks),
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "stale": self.stale,
+            "failed": self.failed,
+            "summarized_messages": self.summarized_messages,
+            "avg_ms": round(self._time_total / runs * 1000, 2) if runs else 0.0,
+        }
@@ -0,0 +1,223 @@
+#linebot_imagecache.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed image cache configuration (opt-in; makes image seeds deterministic)
+IMAGE_CACHE_ENABLED = (os.getenv("IMAGE_CACHE_ENABLED") or "false").lower() in ("1", "true", "yes")
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL") or str(7 * 86400))  # seconds since the image was last used
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES") or "1000")
+IMAGE_CACHE_SWEEP_INTERVAL = float(os.getenv("IMAGE_CACHE_SWEEP_INTERVAL") or "600")  # seconds between evictions
+IMAGE_CACHE_PREFIX = "cache/"  # object key prefix in the bucket
+
+
+def get_image_cache_key(cache_key):
+    return f"imagecache:{cache_key}"
+
+
+# Sorted set of cache keys scored by when they were last used
+IMAGE_CACHE_INDEX_KEY = "imagecache:index"
+
+
+def deterministic_seeds(prompt, fingerprint):
+    """(seed, refiner_seed) derived from the prompt and workflow, in the ranges the tool used to draw from."""
+    digest = hashlib.sha256(f"{fingerprint}\n{prompt}".encode()).digest()
+    return 1 + int.from_bytes(digest[:8], "big") % 49999, 50000 + int.from_bytes(digest[8:16], "big") % 50000
+
+
+def image_cache_key(fingerprint, prompt, seeds):
+    """Content address of the image a workflow renders for prompt with seeds."""
+    material = json.dumps([fingerprint, prompt, list(seeds)], ensure_ascii=False)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ImageCacheIndex(ABC):
+    """Maps cache keys to stored images ({"url", "object_key", "gpu_seconds"}) in least recently used order."""
+
+    @abstractmethod
+    async def get(self, key):
+        """Return the entry for key and mark it used, or None."""
+
+    @abstractmethod
+    async def put(self, key, entry):
+        """Add or replace the entry for key."""
+
+    @abstractmethod
+    async def evict(self, unused_since, max_entries):
+        """Remove entries last used before unused_since, then the least recently used
+        beyond max_entries; returns the removed entries."""
+
+    @abstractmethod
+    async def count(self):
+        """Number of entries."""
+
+
+class RedisImageCacheIndex(ImageCacheIndex):
+    """Entries as JSON strings plus a last-used sorted set, on the conversation store's Redis."""
+
+    def __init__(self, redis, ttl=IMAGE_CACHE_TTL):
+        self.redis = redis
+        self.ttl = ttl
+
+    async def get(self, key):
+        value = await self.redis.get(get_image_cache_key(key))
+        if value is None:
+            return None
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(IMAGE_CACHE_INDEX_KEY, {key: time.time()})
+            pipe.expire(get_image_cache_key(key), self.ttl * 2)
+            await pipe.execute()
+        return json.loads(value)
+
+    async def put(self, key, entry):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # The key outlives the TTL so eviction can still find the object to delete
+            pipe.set(get_image_cache_key(key), json.dumps(entry, ensure_ascii=False), ex=self.ttl * 2)
+            pipe.zadd(IMAGE_CACHE_INDEX_KEY, {key: time.time()})
+            await pipe.execute()
+
+    async def evict(self, unused_since, max_entries):
+        keys = await self.redis.zrangebyscore(IMAGE_CACHE_INDEX_KEY, "-inf", unused_since)
+        excess = await self.redis.zcard(IMAGE_CACHE_INDEX_KEY) - len(keys) - max_entries
+        if excess > 0:
+            keys += await self.redis.zrange(IMAGE_CACHE_INDEX_KEY, len(keys), len(keys) + excess - 1)
+        keys = [key.decode() if isinstance(key, bytes) else key for key in keys]
+        if not keys:
+            return []
+        values = await self.redis.mget([get_image_cache_key(key) for key in keys])
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*(get_image_cache_key(key) for key in keys))
+            pipe.zrem(IMAGE_CACHE_INDEX_KEY, *keys)
+            await pipe.execute()
+        return [json.loads(value) for value in values if value is not None]
+
+    async def count(self):
+        return await self.redis.zcard(IMAGE_CACHE_INDEX_KEY)
+
+
+class InMemoryImageCacheIndex(ImageCacheIndex):
+    """Process-local index; entries are forgotten on restart (their objects are not deleted)."""
+
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (last used, entry), least recently used first
+
+    async def get(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        self._entries[key] = (time.time(), item[1])
+        self._entries.move_to_end(key)
+        return item[1]
+
+    async def put(self, key, entry):
+        self._entries[key] = (time.time(), entry)
+        self._entries.move_to_end(key)
+
+    async def evict(self, unused_since, max_entries):
+        removed = []
+        while self._entries:
+            key, (last_used, entry) = next(iter(self._entries.items()))
+            if last_used > unused_since and len(self._entries) <= max_entries:
+                break
+            del self._entries[key]
+            removed.append(entry)
+        return removed
+
+    async def count(self):
+        return len(self._entries)
+
+
+class ImageCache:
+    """Images already rendered, by content address, so asking again costs no GPU time.
+
+    Entries point at objects stored under IMAGE_CACHE_PREFIX in the image bucket.
+    Every `sweep_interval` seconds (checked when images are added) entries unused
+    for `ttl` seconds, and the least recently used beyond `max_entries`, are removed
+    together with their objects.
+    """
+
+    def __init__(self, storage, ttl=IMAGE_CACHE_TTL, max_entries=IMAGE_CACHE_MAX_ENTRIES,
+                 sweep_interval=IMAGE_CACHE_SWEEP_INTERVAL):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._index = None
+        self._swept_at = time.monotonic()
+        self._sweep_task = None
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.gpu_seconds_saved = 0.0
+
+    def start(self, index):
+        self._index = index
+
+    @staticmethod
+    def object_key(key):
+        return f"{IMAGE_CACHE_PREFIX}{key}.png"
+
+    async def get(self, key):
+        """Public URL of the cached image for key, or None."""
+        entry = await self._index.get(key) if self._index is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.gpu_seconds_saved += entry.get("gpu_seconds", 0.0)
+        return entry["url"]
+
+    async def put(self, key, url, gpu_seconds):
+        """Remember the image stored at object_key(key); gpu_seconds is what a hit saves."""
+        if self._index is None:
+            return
+        await self._index.put(key, {"url": url, "object_key": self.object_key(key), "gpu_seconds": gpu_seconds})
+        self.stored += 1
+        if time.monotonic() - self._swept_at >= self.sweep_interval and self._sweep_task is None:
+            self._swept_at = time.monotonic()
+            self._sweep_task = asyncio.create_task(self.sweep())
+            self._sweep_task.add_done_callback(lambda _: setattr(self, "_sweep_task", None))
+
+    async def sweep(self):
+        """Evict expired and surplus entries and delete their objects; returns how many went."""
+        try:
+            removed = await self._index.evict(time.time() - self.ttl, self.max_entries)
+            await self.storage.delete(entry["object_key"] for entry in removed)
+        except Exception as e:
+            logger.warning(f"Image cache eviction failed: {e}")
+            return 0
+        self.evicted += len(removed)
+        if removed:
+            logger.info(f"Evicted {len(removed)} cached image(s)")
+        return len(removed)
+
+    async def close(self):
+        if self._sweep_task is not None:
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "gpu_seconds_saved": round(self.gpu_seconds_saved, 2),
+        }
+
+
+def create_image_cache_index(conversation_store):
+    """Share the conversation store's Redis client when there is one."""
+    redis = getattr(conversation_store, "redis", None)
+    if redis is not None:
+        return RedisImageCacheIndex(redis)
+    return InMemoryImageCacheIndex()
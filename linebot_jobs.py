@@ -0,0 +1,496 @@
+#linebot_jobs.py
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# Background image job configuration
+IMAGE_JOB_CONCURRENCY = int(os.getenv("IMAGE_JOB_CONCURRENCY") or "2")  # renders at once, all users and workers
+IMAGE_JOB_PER_USER = int(os.getenv("IMAGE_JOB_PER_USER") or "2")  # unfinished jobs one user may have, all workers
+IMAGE_JOB_TTL = int(os.getenv("IMAGE_JOB_TTL") or "86400")  # seconds a job record is kept
+IMAGE_JOB_LEASE = int(os.getenv("IMAGE_JOB_LEASE") or "300")  # seconds a worker owns a running job
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS") or "2")
+
+# Job statuses; a job stays "active" until its image or failure notice was pushed (delivered_at)
+QUEUED, RUNNING, DONE, DELIVERED, FAILED = "queued", "running", "done", "delivered", "failed"
+
+
+def get_image_job_key(job_id):
+    return f"imagejob:{job_id}"
+
+
+def get_image_job_lock_key(job_id):
+    return f"imagejob:{job_id}:lock"
+
+
+def get_image_job_user_key(user_id):
+    """Set of the user's job ids not yet delivered."""
+    return f"imagejobs:user:{user_id}"
+
+
+# Set of job ids not yet delivered, scanned on startup
+IMAGE_JOBS_ACTIVE_KEY = "imagejobs:active"
+# Sorted set of job ids rendering now, scored by when their slot expires unless renewed
+IMAGE_JOBS_RENDERING_KEY = "imagejobs:rendering"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ImageJobLimitError(RuntimeError):
+    """The user already has IMAGE_JOB_PER_USER unfinished image jobs."""
+
+
+class ImageJobStore(ABC):
+    """Where image job records live, so a restarted worker can finish them."""
+
+    def __init__(self, ttl=IMAGE_JOB_TTL):
+        self.ttl = ttl
+
+    @abstractmethod
+    async def add(self, job, per_user):
+        """Save a new job unless its user already has `per_user` undelivered jobs; False if so."""
+
+    @abstractmethod
+    async def save(self, job):
+        """Write the job record; jobs with a delivered_at leave the active set."""
+
+    @abstractmethod
+    async def load(self, job_id):
+        """Return the job record, or None if it is unknown or expired."""
+
+    @abstractmethod
+    async def active(self):
+        """Return the records of every job that was not delivered yet."""
+
+    @abstractmethod
+    async def claim(self, job_id, owner, lease):
+        """Take the job for `lease` seconds; False if another worker holds it."""
+
+    @abstractmethod
+    async def renew(self, job_id, owner, lease):
+        """Extend owner's claim by `lease` seconds; False if owner lost it."""
+
+    @abstractmethod
+    async def release(self, job_id, owner):
+        """Give up a claim made by owner."""
+
+    @abstractmethod
+    async def acquire_slot(self, job_id, limit, lease):
+        """Take one of `limit` render slots shared by all workers for `lease` seconds; False if all are taken."""
+
+    @abstractmethod
+    async def renew_slot(self, job_id, lease):
+        """Keep job_id's render slot for another `lease` seconds."""
+
+    @abstractmethod
+    async def release_slot(self, job_id):
+        """Free job_id's render slot."""
+
+
+class RedisImageJobStore(ImageJobStore):
+    """Job records as JSON strings on a redis.asyncio client (the conversation store's)."""
+
+    def __init__(self, redis, ttl=IMAGE_JOB_TTL):
+        super().__init__(ttl)
+        self.redis = redis
+
+    async def add(self, job, per_user):
+        from redis.exceptions import WatchError
+
+        user_key = get_image_job_user_key(job["user_id"])
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Watched, so two workers can't both admit the user's last allowed job
+                    await pipe.watch(user_key)
+                    job_ids = [_decode(job_id) for job_id in await pipe.smembers(user_key)]
+                    values = await pipe.mget([get_image_job_key(job_id) for job_id in job_ids]) if job_ids else []
+                    expired = [job_id for job_id, value in zip(job_ids, values) if value is None]
+                    if len(job_ids) - len(expired) >= per_user:
+                        await pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    if expired:
+                        pipe.srem(user_key, *expired)
+                    pipe.set(get_image_job_key(job["id"]), json.dumps(job, ensure_ascii=False), ex=self.ttl)
+                    pipe.sadd(IMAGE_JOBS_ACTIVE_KEY, job["id"])
+                    pipe.sadd(user_key, job["id"])
+                    pipe.expire(user_key, self.ttl)
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    continue  # another job of this user was added or finished meanwhile; count again
+
+    async def save(self, job):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(get_image_job_key(job["id"]), json.dumps(job, ensure_ascii=False), ex=self.ttl)
+            if job.get("delivered_at"):
+                pipe.srem(IMAGE_JOBS_ACTIVE_KEY, job["id"])
+                pipe.srem(get_image_job_user_key(job["user_id"]), job["id"])
+            else:
+                pipe.sadd(IMAGE_JOBS_ACTIVE_KEY, job["id"])
+            await pipe.execute()
+
+    async def load(self, job_id):
+        value = await self.redis.get(get_image_job_key(job_id))
+        return json.loads(value) if value is not None else None
+
+    async def active(self):
+        job_ids = [_decode(job_id) for job_id in await self.redis.smembers(IMAGE_JOBS_ACTIVE_KEY)]
+        if not job_ids:
+            return []
+        values = await self.redis.mget([get_image_job_key(job_id) for job_id in job_ids])
+        expired = [job_id for job_id, value in zip(job_ids, values) if value is None]
+        if expired:
+            await self.redis.srem(IMAGE_JOBS_ACTIVE_KEY, *expired)
+        return [json.loads(value) for value in values if value is not None]
+
+    async def claim(self, job_id, owner, lease):
+        return bool(await self.redis.set(get_image_job_lock_key(job_id), owner, nx=True, ex=lease))
+
+    async def _if_held(self, job_id, owner, command):
+        """Run command(pipe, key) in a transaction only while owner still holds the lock.
+
+        The lock is watched, so if it expires and another worker claims it between
+        the check and the write, the write is dropped instead of touching their lock.
+        """
+        from redis.exceptions import WatchError
+
+        key = get_image_job_lock_key(job_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if _decode(await pipe.get(key)) != owner:
+                    return False
+                pipe.multi()
+                command(pipe, key)
+                return bool((await pipe.execute())[0])
+            except WatchError:
+                return False
+
+    async def renew(self, job_id, owner, lease):
+        return await self._if_held(job_id, owner, lambda pipe, key: pipe.expire(key, lease))
+
+    async def release(self, job_id, owner):
+        await self._if_held(job_id, owner, lambda pipe, key: pipe.delete(key))
+
+    async def acquire_slot(self, job_id, limit, lease):
+        from redis.exceptions import WatchError
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                now = time.time()
+                try:
+                    await pipe.watch(IMAGE_JOBS_RENDERING_KEY)
+                    # Slots of workers that died without releasing them run out
+                    held = await pipe.zcount(IMAGE_JOBS_RENDERING_KEY, f"({now}", "+inf")
+                    if held >= limit and await pipe.zscore(IMAGE_JOBS_RENDERING_KEY, job_id) is None:
+                        await pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.zremrangebyscore(IMAGE_JOBS_RENDERING_KEY, "-inf", now)
+                    pipe.zadd(IMAGE_JOBS_RENDERING_KEY, {job_id: now + lease})
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    async def renew_slot(self, job_id, lease):
+        await self.redis.zadd(IMAGE_JOBS_RENDERING_KEY, {job_id: time.time() + lease}, xx=True)
+
+    async def release_slot(self, job_id):
+        await self.redis.zrem(IMAGE_JOBS_RENDERING_KEY, job_id)
+
+
+class InMemoryImageJobStore(ImageJobStore):
+    """Process-local job records; jobs do not survive a restart."""
+
+    def __init__(self, ttl=IMAGE_JOB_TTL):
+        super().__init__(ttl)
+        self._jobs = {}  # job_id -> (expires_at, json)
+        self._locks = {}  # job_id -> (expires_at, owner)
+        self._slots = {}  # job_id -> expires_at
+
+    async def add(self, job, per_user):
+        unfinished = [other for other in await self.active() if other["user_id"] == job["user_id"]]
+        if len(unfinished) >= per_user:
+            return False
+        await self.save(job)
+        return True
+
+    async def save(self, job):
+        self._jobs[job["id"]] = (time.monotonic() + self.ttl, json.dumps(job, ensure_ascii=False))
+
+    async def load(self, job_id):
+        entry = self._jobs.get(job_id)
+        if entry is None or entry[0] <= time.monotonic():
+            self._jobs.pop(job_id, None)
+            return None
+        return json.loads(entry[1])
+
+    async def active(self):
+        jobs = [await self.load(job_id) for job_id in list(self._jobs)]
+        return [job for job in jobs if job and not job.get("delivered_at")]
+
+    async def claim(self, job_id, owner, lease):
+        lock = self._locks.get(job_id)
+        if lock is not None and lock[0] > time.monotonic() and lock[1] != owner:
+            return False
+        self._locks[job_id] = (time.monotonic() + lease, owner)
+        return True
+
+    async def renew(self, job_id, owner, lease):
+        lock = self._locks.get(job_id)
+        if lock is None or lock[1] != owner:
+            return False
+        self._locks[job_id] = (time.monotonic() + lease, owner)
+        return True
+
+    async def release(self, job_id, owner):
+        lock = self._locks.get(job_id)
+        if lock is not None and lock[1] == owner:
+            del self._locks[job_id]
+
+    async def acquire_slot(self, job_id, limit, lease):
+        now = time.monotonic()
+        self._slots = {other: expires_at for other, expires_at in self._slots.items() if expires_at > now}
+        if job_id not in self._slots and len(self._slots) >= limit:
+            return False
+        self._slots[job_id] = now + lease
+        return True
+
+    async def renew_slot(self, job_id, lease):
+        if job_id in self._slots:
+            self._slots[job_id] = time.monotonic() + lease
+
+    async def release_slot(self, job_id):
+        self._slots.pop(job_id, None)
+
+
+class ImageJobRunner:
+    """Renders images in the background and pushes them to the user when they are ready.
+
+    `render` is an async callable (prompt, user_id, workflow) -> public image URL. `deliver` is an async
+    callable taking the finished job record; it is called with status "done" (the
+    record has "image_url") or "failed" (it has "error"). Job records are written to
+    the store at every step. The worker running a job keeps renewing its claim; one
+    that stops mid-job leaves the claim to expire after `lease` seconds, after which
+    any worker's sweep picks the job up again. A worker that finds its claim lost
+    cancels the job, so it is not rendered and pushed twice.
+
+    Both limits are kept in the store, so they hold across workers: a user may have
+    `per_user` undelivered jobs, and `concurrency` jobs render at once; a job waiting
+    for a render slot checks again every `slot_poll` seconds.
+    """
+
+    def __init__(self, render, concurrency=IMAGE_JOB_CONCURRENCY, per_user=IMAGE_JOB_PER_USER,
+                 lease=IMAGE_JOB_LEASE, max_attempts=IMAGE_JOB_MAX_ATTEMPTS, slot_poll=1.0):
+        self._render = render
+        self.concurrency = max(1, concurrency)
+        self.per_user = per_user
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.slot_poll = slot_poll
+        self.owner = str(uuid.uuid4())
+        self._store = None
+        self._deliver = None
+        self._tasks = {}  # job_id -> task
+        self._user_jobs = {}  # user_id -> set of job ids running in this process, for stats
+        self._rendering = set()  # job ids holding a render slot
+        self._sweeper = None
+        self.render_time = LatencyRecorder()
+        self.submitted = 0
+        self.rejected = 0
+        self.resumed = 0
+        self.delivered = 0
+        self.failed = 0
+        self.claims_lost = 0
+
+    @property
+    def started(self):
+        return self._store is not None
+
+    async def start(self, store, deliver):
+        """Attach the store and delivery callback, then pick up jobs left by earlier workers."""
+        self._store = store
+        self._deliver = deliver
+        await self.resume()
+        self._sweeper = asyncio.create_task(self._sweep(), name="image-job-sweeper")
+
+    async def submit(self, user_id, prompt, workflow=None):
+        """Queue an image job for user_id and return its record without waiting for it."""
+        if not self.started:
+            raise RuntimeError("ImageJobRunner.start() has not been called")
+        now = time.time()
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "prompt": prompt,
+            "workflow": workflow,
+            "status": QUEUED,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if not await self._store.add(job, self.per_user):
+            self.rejected += 1
+            raise ImageJobLimitError(f"{user_id} already has {self.per_user} image(s) being generated")
+        self.submitted += 1
+        self._start_job(job)
+        return job
+
+    async def resume(self):
+        """Restart every unfinished job no live worker holds; returns how many were picked up."""
+        resumed = 0
+        for job in await self._store.active():
+            if job["id"] in self._tasks:
+                continue
+            if await self._store.claim(job["id"], self.owner, self.lease):
+                self._start_job(job, claimed=True)
+                resumed += 1
+        self.resumed += resumed
+        if resumed:
+            logger.info(f"Resumed {resumed} image job(s)")
+        return resumed
+
+    def _start_job(self, job, claimed=False):
+        self._user_jobs.setdefault(job["user_id"], set()).add(job["id"])
+        task = asyncio.create_task(self._run(job, claimed))
+        self._tasks[job["id"]] = task
+        task.add_done_callback(lambda _: self._forget(job))
+
+    def _forget(self, job):
+        self._tasks.pop(job["id"], None)
+        user_jobs = self._user_jobs.get(job["user_id"])
+        if user_jobs is not None:
+            user_jobs.discard(job["id"])
+            if not user_jobs:
+                del self._user_jobs[job["user_id"]]
+
+    async def _update(self, job, **fields):
+        job.update(fields, updated_at=time.time())
+        await self._store.save(job)
+
+    async def _run(self, job, claimed=False):
+        if not claimed and not await self._store.claim(job["id"], self.owner, self.lease):
+            return
+        keepalive = asyncio.create_task(self._keep_claim(job["id"], asyncio.current_task()))
+        try:
+            if job["status"] in (QUEUED, RUNNING):
+                await self._render_job(job)
+            if job["status"] in (DONE, FAILED):
+                await self._deliver_job(job)
+        except asyncio.CancelledError:
+            # Shutting down, or the claim was lost: the record stays active for whoever holds it next
+            raise
+        except Exception:
+            logger.exception(f"Image job {job['id']} failed")
+        finally:
+            keepalive.cancel()
+            await asyncio.shield(self._store.release(job["id"], self.owner))
+
+    async def _keep_claim(self, job_id, job_task):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await self._store.renew(job_id, self.owner, self.lease):
+                    # Another worker may already be running it
+                    self.claims_lost += 1
+                    logger.warning(f"Lost the claim on image job {job_id}, cancelling it")
+                    job_task.cancel()
+                    return
+                if job_id in self._rendering:
+                    await self._store.renew_slot(job_id, self.lease)
+            except Exception as e:
+                logger.warning(f"Renewing the claim on image job {job_id} failed: {e}")
+
+    async def _acquire_slot(self, job_id):
+        while not await self._store.acquire_slot(job_id, self.concurrency, self.lease):
+            await asyncio.sleep(self.slot_poll)
+        self._rendering.add(job_id)
+
+    async def _render_job(self, job):
+        await self._acquire_slot(job["id"])
+        try:
+            if job["attempts"] >= self.max_attempts:
+                await self._update(job, status=FAILED, error="too many attempts")
+                return
+            await self._update(job, status=RUNNING, attempts=job["attempts"] + 1)
+            started = time.monotonic()
+            try:
+                image_url = await self._render(job["prompt"], job["user_id"], job.get("workflow"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Rendering image job {job['id']} failed: {e}")
+                await self._update(job, status=FAILED, error=str(e))
+                return
+            self.render_time.record(time.monotonic() - started)
+            if image_url:
+                await self._update(job, status=DONE, image_url=image_url)
+            else:
+                await self._update(job, status=FAILED, error="no image was produced")
+        finally:
+            self._rendering.discard(job["id"])
+            await asyncio.shield(self._store.release_slot(job["id"]))
+
+    async def _deliver_job(self, job):
+        await self._deliver(job)
+        if job["status"] == FAILED:
+            self.failed += 1
+            await self._update(job, delivered_at=time.time())
+        else:
+            self.delivered += 1
+            await self._update(job, status=DELIVERED, delivered_at=time.time())
+
+    async def _sweep(self):
+        # Jobs of a worker that died are claimable once its lease runs out
+        while True:
+            await asyncio.sleep(self.lease)
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.warning(f"Resuming image jobs failed: {e}")
+
+    async def close(self, timeout=None):
+        """Wait up to timeout for running jobs, then cancel the rest (they resume on restart)."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "running": len(self._tasks),
+            "users": len(self._user_jobs),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "resumed": self.resumed,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "claims_lost": self.claims_lost,
+            "render": self.render_time.stats(),
+        }
+
+
+def create_image_job_store(conversation_store):
+    """Share the conversation store's Redis client when there is one."""
+    redis = getattr(conversation_store, "redis", None)
+    if redis is not None:
+        return RedisImageJobStore(redis)
+    return InMemoryImageJobStore()
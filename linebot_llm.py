@@ -0,0 +1,310 @@
+#linebot_llm.py
+import asyncio
+import logging
+import os
+import threading
+import time
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DEFAULT_CONNECTION_LIMITS
+from agents import OpenAIChatCompletionsModel
+from agents.models.interface import Model
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# LLM backend pool configuration (OPENAI_COMPATIBLE_API_BASE_URL may list several servers, comma separated)
+LLM_BACKEND_CONCURRENCY = int(os.getenv("LLM_BACKEND_CONCURRENCY") or "8")  # requests in flight per server
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS") or str(LLM_BACKEND_CONCURRENCY * 2))  # per server
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS") or str(LLM_BACKEND_CONCURRENCY))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT") or "120")  # seconds per attempt before failing over
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT") or "60")  # seconds waiting for a free slot
+LLM_FAILURE_COOLDOWN = float(os.getenv("LLM_FAILURE_COOLDOWN") or "30")  # seconds a failing server is avoided
+# Hedging: when an answer is slower than the server's recent p95, ask a second server and take the first answer
+LLM_HEDGE = (os.getenv("LLM_HEDGE") or "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE") or "95")
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES") or "20")
+
+# Errors another server may not have; anything else (bad request, auth) would fail everywhere
+FAILOVER_ERRORS = (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError, asyncio.TimeoutError)
+
+
+class LLMUnavailable(RuntimeError):
+    """No LLM server could take or answer the request."""
+
+
+class LLMBackend:
+    """One OpenAI-compatible server: its client, connection pool and concurrency limit.
+
+    The client (and its HTTP connection pool) is created on first use, or by
+    `prepare()` ahead of it.
+    """
+
+    def __init__(self, base_url, api_key, model_name, concurrency=LLM_BACKEND_CONCURRENCY,
+                 max_connections=LLM_MAX_CONNECTIONS, keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                 timeout=LLM_TIMEOUT, max_retries=2):
+        self.base_url = base_url
+        self.model_name = model_name
+        self._client_kwargs = {"base_url": base_url, "api_key": api_key, "timeout": timeout,
+                               "max_retries": max_retries}
+        self.max_connections = max_connections
+        self.keepalive_connections = keepalive_connections
+        self._client = None
+        self._model = None
+        self._client_lock = threading.Lock()  # prepare() may run in a worker thread
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.latency = LatencyRecorder()
+        self.time_to_first_token = LatencyRecorder()
+        self.queue_wait = LatencyRecorder()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._create_client()
+            return self._client
+
+    def _create_client(self):
+        return AsyncOpenAI(
+            # Limits of the HTTP library this openai version is built on
+            http_client=DefaultAsyncHttpxClient(limits=type(DEFAULT_CONNECTION_LIMITS)(
+                max_connections=self.max_connections, max_keepalive_connections=self.keepalive_connections,
+            )),
+            **self._client_kwargs,
+        )
+
+    def prepare(self):
+        """Create the client and load the chat API, which openai imports on first access (about 0.5s)."""
+        self.client.chat.completions
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = OpenAIChatCompletionsModel(model=self.model_name, openai_client=self.client)
+        return self._model
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.unhealthy_until
+
+    @property
+    def load(self):
+        return (self.in_flight + self.waiting) / self.concurrency
+
+    async def acquire(self, timeout):
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise LLMUnavailable(f"No free slot on {self.base_url} within {timeout}s") from None
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.queue_wait.record(time.monotonic() - started)
+
+    async def try_acquire(self):
+        """Take a slot only if one is free right now."""
+        if self._slots.locked():
+            return False
+        await self._slots.acquire()  # returns at once while the semaphore is not locked
+        self.in_flight += 1
+        self.queue_wait.record(0.0)
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def failed(self, error, cooldown):
+        self.failures += 1
+        self.unhealthy_until = time.monotonic() + cooldown
+        logger.warning(f"LLM server {self.base_url} failed, avoiding it for {cooldown}s: {error!r}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+        self._model = None
+
+    def stats(self):
+        return {
+            "healthy": int(self.healthy),
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency": self.latency.stats(),
+            "time_to_first_token": self.time_to_first_token.stats(),
+            "queue_wait": self.queue_wait.stats(),
+        }
+
+
+class LLMPool(Model):
+    """Agents SDK model that spreads chat completions over several OpenAI-compatible servers.
+
+    Each request goes to the healthy server with the lowest load (requests in
+    flight plus waiting, per slot). A server takes at most `concurrency` requests
+    at once; the rest wait for its slots for up to `queue_timeout` seconds.
+    Connection errors, timeouts, 5xx and 429 answers move the request to another
+    server and keep the failing one out of rotation for `cooldown` seconds. A
+    stream can only fail over before its first event.
+
+    With `hedge` on, a non-streamed request still running after the server's
+    recent p95 latency is also sent to another server with a free slot; the first
+    answer wins and the other request is cancelled.
+    """
+
+    def __init__(self, base_urls, api_key, model_name, concurrency=LLM_BACKEND_CONCURRENCY,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, cooldown=LLM_FAILURE_COOLDOWN, hedge=LLM_HEDGE,
+                 hedge_percentile=LLM_HEDGE_PERCENTILE, hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, **backend_kwargs):
+        if isinstance(base_urls, str):
+            base_urls = base_urls.split(",")
+        base_urls = [url.strip() for url in base_urls if url and url.strip()]
+        # With more than one server a failed attempt is retried elsewhere rather than by the client
+        backend_kwargs.setdefault("max_retries", 2 if len(base_urls) == 1 else 0)
+        self.backends = [LLMBackend(url, api_key, model_name, concurrency, **backend_kwargs) for url in base_urls]
+        self.queue_timeout = queue_timeout
+        self.cooldown = cooldown
+        self.hedge = hedge and len(self.backends) > 1
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def _acquire(self, exclude=()):
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            raise LLMUnavailable("Every LLM server failed")
+        healthy = [backend for backend in candidates if backend.healthy] or candidates
+        backend = min(healthy, key=lambda backend: backend.load)
+        await backend.acquire(self.queue_timeout)
+        return backend
+
+    def _hedge_delay(self, backend):
+        if not self.hedge or backend.latency.count < self.hedge_min_samples:
+            return None
+        return backend.latency.percentile(self.hedge_percentile)
+
+    def _start(self, backend, call):
+        """Run call(backend) in a task that holds the backend's slot until it is done."""
+        async def attempt():
+            backend.requests += 1
+            started = time.monotonic()
+            try:
+                result = await call(backend)
+            except FAILOVER_ERRORS as e:
+                backend.failed(e, self.cooldown)
+                raise
+            backend.latency.record(time.monotonic() - started)
+            return result
+
+        task = asyncio.create_task(attempt())
+        task.add_done_callback(lambda _: backend.release())
+        return task
+
+    async def call(self, call):
+        """Await call(backend) on the least loaded server, failing over and hedging as configured."""
+        backend = await self._acquire()
+        tried = {backend}
+        tasks = {self._start(backend, call)}
+        hedges = set()
+        hedge_after = self._hedge_delay(backend)
+        try:
+            while True:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Still waiting after the p95: ask one more server, but only one with a free slot
+                    hedge_after = None
+                    for spare in sorted(self.backends, key=lambda other: other.load):
+                        if spare not in tried and spare.healthy and await spare.try_acquire():
+                            self.hedged += 1
+                            tried.add(spare)
+                            hedge = self._start(spare, call)
+                            tasks.add(hedge)
+                            hedges.add(hedge)
+                            break
+                    continue
+                tasks -= done
+                errors = {task: task.exception() for task in done}
+                for task, error in errors.items():
+                    if error is None:
+                        if task in hedges:
+                            self.hedge_wins += 1
+                        return task.result()
+                error = next(iter(errors.values()))
+                if not isinstance(error, FAILOVER_ERRORS):
+                    raise error
+                if tasks:
+                    continue  # the other request may still answer
+                try:
+                    backend = await self._acquire(tried)
+                except LLMUnavailable:
+                    raise error
+                self.failovers += 1
+                tried.add(backend)
+                tasks.add(self._start(backend, call))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_response(self, *args, **kwargs):
+        return await self.call(lambda backend: backend.model.get_response(*args, **kwargs))
+
+    async def stream_response(self, *args, **kwargs):
+        tried = set()
+        while True:
+            backend = await self._acquire(tried)
+            tried.add(backend)
+            backend.requests += 1
+            started = time.monotonic()
+            stream = backend.model.stream_response(*args, **kwargs)
+            streaming = False
+            try:
+                async for event in stream:
+                    if not streaming:
+                        streaming = True
+                        backend.time_to_first_token.record(time.monotonic() - started)
+                    yield event
+                backend.latency.record(time.monotonic() - started)
+                return
+            except FAILOVER_ERRORS as e:
+                backend.failed(e, self.cooldown)
+                if streaming or len(tried) == len(self.backends):
+                    raise
+                self.failovers += 1
+            finally:
+                await stream.aclose()
+                backend.release()
+
+    async def complete(self, **kwargs):
+        """chat.completions.create(**kwargs) on the pool's model, e.g. for requests outside an agent run."""
+        return await self.call(
+            lambda backend: backend.client.chat.completions.create(model=backend.model_name, **kwargs))
+
+    def prepare(self):
+        """Blocking; run it in a worker thread so the first request does not pay for it on the event loop."""
+        for backend in self.backends:
+            backend.prepare()
+
+    def get_retry_advice(self, request):
+        return self.backends[0].model.get_retry_advice(request)
+
+    async def close(self):
+        await asyncio.gather(*(backend.close() for backend in self.backends))
+
+    def stats(self):
+        return {
+            "hedge": int(self.hedge),
+            "failovers": self.failovers,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "backends": {backend.base_url: backend.stats() for backend in self.backends},
+        }
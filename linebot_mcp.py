@@ -0,0 +1,293 @@
+#linebot_mcp.py
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from agents.mcp import MCPServer
+
+logger = logging.getLogger(__name__)
+
+# MCP server pool configuration
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE") or "2")
+MCP_CHECKOUT_TIMEOUT = float(os.getenv("MCP_CHECKOUT_TIMEOUT") or "30")
+
+# MCP connection supervision
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL") or "30")
+MCP_PING_TIMEOUT = float(os.getenv("MCP_PING_TIMEOUT") or "10")
+MCP_RETRY_DELAY = float(os.getenv("MCP_RETRY_DELAY") or "5")
+
+
+class MCPSupervisor:
+    """Keeps one MCP server connected for the lifetime of the app.
+
+    The stdio transport has to be opened and closed in the same task, so a single
+    supervisor task owns the connection: it connects, pings the server every
+    `health_interval` seconds, and reconnects when a ping fails.
+    """
+
+    def __init__(self, server, health_interval=MCP_HEALTH_CHECK_INTERVAL,
+                 ping_timeout=MCP_PING_TIMEOUT, retry_delay=MCP_RETRY_DELAY, on_change=None):
+        self.server = server
+        self.on_change = on_change  # called with the supervisor when `connected` flips
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.retry_delay = retry_delay
+        self.connected = False
+        self._task = None
+        self._check = asyncio.Event()
+        self._ready = asyncio.Event()
+        self.connects = 0
+        self.connect_failures = 0
+        self.ping_failures = 0
+
+    async def start(self, wait_timeout=None):
+        """Start supervising and wait (up to wait_timeout) for the first connect attempt."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"mcp-supervisor-{self.server.name}")
+        try:
+            await asyncio.wait_for(self._ready.wait(), wait_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"MCP server {self.server.name} is still starting, continuing without it")
+
+    def check_now(self):
+        """Ask for an immediate health check, e.g. after a run failed."""
+        self._check.set()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.server.connect()
+            except Exception as e:
+                self.connect_failures += 1
+                logger.warning(f"MCP server {self.server.name} failed to connect: {e}")
+                self._ready.set()
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            self._set_connected(True)
+            self.connects += 1
+            self._ready.set()
+            try:
+                while await self._wait_and_ping():
+                    pass
+            finally:
+                self._set_connected(False)
+                try:
+                    await self.server.cleanup()
+                except Exception as e:
+                    logger.warning(f"MCP server {self.server.name} cleanup failed: {e}")
+            logger.warning(f"MCP server {self.server.name} is unhealthy, reconnecting")
+
+    def _set_connected(self, connected):
+        self.connected = connected
+        if self.on_change:
+            self.on_change(self)
+
+    async def _wait_and_ping(self):
+        try:
+            await asyncio.wait_for(self._check.wait(), self.health_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._check.clear()
+        session = getattr(self.server, "session", None)
+        if session is None:
+            return False
+        try:
+            await asyncio.wait_for(session.send_ping(), self.ping_timeout)
+            return True
+        except Exception as e:
+            self.ping_failures += 1
+            logger.warning(f"MCP server {self.server.name} ping failed: {e}")
+            return False
+
+    def stats(self):
+        return {
+            "connected": int(self.connected),
+            "connects": self.connects,
+            "connect_failures": self.connect_failures,
+            "ping_failures": self.ping_failures,
+        }
+
+
+class MCPServerPool(MCPServer):
+    """A fixed number of MCP server processes presented to the agent as one server.
+
+    Every tool call checks out an idle, connected member for just that call, so one
+    slow call no longer holds up everybody else. Each member has its own
+    MCPSupervisor, which restarts it when it stops answering pings.
+    """
+
+    def __init__(self, factory, size=MCP_POOL_SIZE, name="mcp-pool",
+                 checkout_timeout=MCP_CHECKOUT_TIMEOUT, **supervisor_kwargs):
+        super().__init__()
+        self._name = name
+        self.checkout_timeout = checkout_timeout
+        self.supervisors = [
+            MCPSupervisor(factory(i), on_change=self._on_change, **supervisor_kwargs)
+            for i in range(max(1, size))
+        ]
+        self._idle = deque()
+        self._busy = set()
+        self._waiters = deque()
+        self._tools = None
+        self._checkout_wait_total = 0.0
+        self._call_total = 0.0
+        self.max_checkout_wait = 0.0
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.calls = 0
+        self.call_errors = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def connected(self):
+        return any(supervisor.connected for supervisor in self.supervisors)
+
+    async def connect(self, wait_timeout=None):
+        """Start every member and wait for their first connect, so the first user
+        doesn't pay the process start (and npx download) cost."""
+        await asyncio.gather(*(supervisor.start(wait_timeout) for supervisor in self.supervisors))
+        if self.connected:
+            try:
+                await self.list_tools()
+            except Exception as e:
+                logger.warning(f"Listing tools of {self.name} failed: {e}")
+
+    async def cleanup(self):
+        await asyncio.gather(*(supervisor.stop() for supervisor in self.supervisors))
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.cancel()
+
+    async def list_tools(self, run_context=None, agent=None):
+        if self._tools is None:
+            async with self._checkout() as server:
+                self._tools = await server.list_tools(run_context, agent)
+        return self._tools
+
+    @property
+    def cached_tools(self):
+        return self._tools
+
+    async def call_tool(self, tool_name, arguments, meta=None):
+        async with self._checkout() as server:
+            started = time.monotonic()
+            self.calls += 1
+            try:
+                if meta is None:
+                    return await server.call_tool(tool_name, arguments)
+                return await server.call_tool(tool_name, arguments, meta)
+            finally:
+                self._call_total += time.monotonic() - started
+
+    async def list_prompts(self):
+        async with self._checkout() as server:
+            return await server.list_prompts()
+
+    async def get_prompt(self, name, arguments=None):
+        async with self._checkout() as server:
+            return await server.get_prompt(name, arguments)
+
+    def _checkout(self):
+        return _Checkout(self)
+
+    async def _acquire(self):
+        started = time.monotonic()
+        try:
+            supervisor = await asyncio.wait_for(self._next_idle(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            self.checkout_timeouts += 1
+            raise RuntimeError(f"No {self.name} server available after {self.checkout_timeout}s")
+        waited = time.monotonic() - started
+        self.checkouts += 1
+        self._checkout_wait_total += waited
+        self.max_checkout_wait = max(self.max_checkout_wait, waited)
+        self._busy.add(supervisor)
+        return supervisor
+
+    async def _next_idle(self):
+        while True:
+            while self._idle:
+                supervisor = self._idle.popleft()
+                if supervisor.connected:
+                    return supervisor
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _release(self, supervisor, failed=False):
+        self._busy.discard(supervisor)
+        if failed:
+            self.call_errors += 1
+            # A crashed child shows up as a failed call; have it checked right away
+            supervisor.check_now()
+        if supervisor.connected and supervisor not in self._idle:
+            self._idle.append(supervisor)
+            self._wake_one()
+
+    def _on_change(self, supervisor):
+        if not supervisor.connected:
+            if supervisor in self._idle:
+                self._idle.remove(supervisor)
+            return
+        if supervisor not in self._busy and supervisor not in self._idle:
+            self._idle.append(supervisor)
+            self._wake_one()
+
+    def _wake_one(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def stats(self):
+        return {
+            "size": len(self.supervisors),
+            "connected": sum(supervisor.connected for supervisor in self.supervisors),
+            "idle": len(self._idle),
+            "busy": len(self._busy),
+            "waiting": len(self._waiters),
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.checkout_timeouts,
+            "avg_checkout_wait_ms": round(self._checkout_wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+            "max_checkout_wait_ms": round(self.max_checkout_wait * 1000, 2),
+            "calls": self.calls,
+            "call_errors": self.call_errors,
+            "avg_call_ms": round(self._call_total / self.calls * 1000, 2) if self.calls else 0.0,
+            "restarts": sum(max(0, supervisor.connects - 1) for supervisor in self.supervisors),
+            "connect_failures": sum(supervisor.connect_failures for supervisor in self.supervisors),
+            "ping_failures": sum(supervisor.ping_failures for supervisor in self.supervisors),
+        }
+
+
+class _Checkout:
+    """async with pool._checkout() as server: hold one member for the duration of a call."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._supervisor = None
+
+    async def __aenter__(self):
+        self._supervisor = await self._pool._acquire()
+        return self._supervisor.server
+
+    async def __aexit__(self, exc_type, exc, tb):
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        self._pool._release(self._supervisor, failed=failed)
+        return False
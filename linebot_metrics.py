@@ -0,0 +1,256 @@
+#linebot_metrics.py
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Opt-in sampling of where slow requests spend their time
+PROFILE_SLOW_REQUESTS = (os.getenv("PROFILE_SLOW_REQUESTS") or "false").lower() in ("1", "true", "yes")
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS") or "10")  # requests slower than this are logged
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL") or "0.05")  # seconds between samples
+
+# Histogram buckets in seconds, from a Redis round trip to an image render
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# name -> zero-argument callable returning a dict of numbers
+_stats_providers = {}
+
+
+def register_stats(name, provider):
+    """Register a callable whose dict of counters is reported under `name`."""
+    _stats_providers[name] = provider
+
+
+def collect_stats():
+    """Snapshot every registered stats provider."""
+    snapshot = {}
+    for name, provider in _stats_providers.items():
+        try:
+            snapshot[name] = provider()
+        except Exception as e:
+            logger.warning(f"Stats provider {name} failed: {e}")
+    return snapshot
+
+
+class LatencyRecorder:
+    """Count, mean and max of a latency, plus percentiles over the most recent samples."""
+
+    def __init__(self, window=1000):
+        self._recent = deque(maxlen=window)
+        self._total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self._total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def percentile(self, q):
+        """q-th percentile (0-100) in seconds over the recent window, None without samples."""
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def stats(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "avg_ms": round(self._total / self.count * 1000, 2),
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class StageMetrics:
+    """Latency histogram, in-flight gauge and error counter per (stage, name)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}  # (stage, name) -> [count per bucket..., +Inf count, sum]
+        self._in_flight = Counter()
+        self._errors = Counter()
+
+    def enter(self, key):
+        self._in_flight[key] += 1
+
+    def exit(self, key, seconds, failed):
+        self._in_flight[key] -= 1
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+        if failed:
+            self._errors[key] += 1
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP linebot_stage_duration_seconds Time spent in each stage of request handling.",
+            "# TYPE linebot_stage_duration_seconds histogram",
+        ]
+        for (stage, name), histogram in sorted(self._histograms.items()):
+            labels = f'stage="{_escape(stage)}",name="{_escape(name)}"'
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f'linebot_stage_duration_seconds_bucket{{{labels},le="{bound:g}"}} {count}')
+            lines.append(f'linebot_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram[-2]}')
+            lines.append(f"linebot_stage_duration_seconds_sum{{{labels}}} {histogram[-1]:.6f}")
+            lines.append(f"linebot_stage_duration_seconds_count{{{labels}}} {histogram[-2]}")
+        lines += [
+            "# HELP linebot_stage_in_flight Stages currently running.",
+            "# TYPE linebot_stage_in_flight gauge",
+        ]
+        for (stage, name), count in sorted(self._in_flight.items()):
+            lines.append(f'linebot_stage_in_flight{{stage="{_escape(stage)}",name="{_escape(name)}"}} {count}')
+        lines += [
+            "# HELP linebot_stage_errors_total Stages that ended with an error.",
+            "# TYPE linebot_stage_errors_total counter",
+        ]
+        for (stage, name), count in sorted(self._errors.items()):
+            lines.append(f'linebot_stage_errors_total{{stage="{_escape(stage)}",name="{_escape(name)}"}} {count}')
+        return lines
+
+
+stage_metrics = StageMetrics()
+
+# Spans of the request being handled, for its trace log line and slow-request profile
+_current_trace = contextvars.ContextVar("linebot_trace", default=None)
+
+
+class span:
+    """Times one stage, e.g. `with span("redis", "load"):`; works around sync and async code alike.
+
+    An exception leaving the block counts as an error; call fail() for errors the
+    stage handles itself.
+    """
+
+    __slots__ = ("key", "started", "failed")
+
+    def __init__(self, stage, name=""):
+        self.key = (stage, name)
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+    def __enter__(self):
+        stage_metrics.enter(self.key)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        failed = self.failed or (exc_type is not None and not issubclass(exc_type, asyncio.CancelledError))
+        stage_metrics.exit(self.key, elapsed, failed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((self.key, elapsed, failed))
+        return False
+
+
+class request_trace:
+    """Collects the spans of one request (including tools it runs) and logs them at DEBUG.
+
+    With PROFILE_SLOW_REQUESTS on, the awaiting call stack of the request's task is
+    sampled every PROFILE_INTERVAL seconds; requests slower than PROFILE_SLOW_SECONDS
+    are logged with their span breakdown and the stacks they spent the most time in.
+    """
+
+    def __init__(self, label, profile=PROFILE_SLOW_REQUESTS, slow_seconds=PROFILE_SLOW_SECONDS,
+                 interval=PROFILE_INTERVAL):
+        self.label = label
+        self.profile = profile
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        self.spans = []
+        self.samples = Counter()
+        self._token = None
+        self._timer = None
+
+    async def __aenter__(self):
+        self._token = _current_trace.set(self)
+        self.started = time.perf_counter()
+        if self.profile:
+            self._task = asyncio.current_task()
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._sample)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        if self._timer is not None:
+            self._timer.cancel()
+        elapsed = time.perf_counter() - self.started
+        if self.profile and elapsed >= self.slow_seconds:
+            logger.warning(f"Slow request {self.label}: {elapsed:.2f}s; {self.breakdown()}\n{self.profile_report()}")
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Request {self.label}: {elapsed * 1000:.0f}ms; {self.breakdown()}")
+        return False
+
+    def breakdown(self):
+        totals = {}
+        for (stage, name), elapsed, failed in self.spans:
+            key = f"{stage}:{name}" if name else stage
+            totals[key] = totals.get(key, 0.0) + elapsed
+        return " ".join(f"{key}={seconds * 1000:.0f}ms" for key, seconds in totals.items()) or "no spans"
+
+    def _sample(self):
+        self.samples[await_stack(self._task.get_coro())] += 1
+        self._timer = asyncio.get_running_loop().call_later(self.interval, self._sample)
+
+    def profile_report(self, top=5):
+        total = sum(self.samples.values())
+        if not total:
+            return "  (no samples)"
+        return "\n".join(
+            f"  {count / total:4.0%} {' > '.join(stack)}" for stack, count in self.samples.most_common(top)
+        )
+
+
+def await_stack(coro, limit=12):
+    """Innermost `limit` frames of the chain of coroutines coro is awaiting, as "function (file:line)"."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return tuple(frames[-limit:])
+
+
+def render_metrics():
+    """Prometheus text for the stage metrics plus every number the stats providers report."""
+    lines = stage_metrics.render()
+    for provider, stats in collect_stats().items():
+        for path, value in _flatten(stats):
+            name = re.sub(r"[^a-zA-Z0-9_]", "_", f"linebot_{provider}_{path}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _flatten(stats, prefix=""):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+        elif isinstance(value, bool):
+            yield f"{prefix}{key}", int(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
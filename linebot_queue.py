@@ -0,0 +1,173 @@
+#linebot_queue.py
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    """Bounded queue of LINE webhook deliveries drained by a pool of asyncio workers.
+
+    Each queued item is one webhook delivery (a batch of events). A worker handles the
+    events of different users in the batch concurrently, while a per-user lock keeps
+    the events of the same user in arrival order, also across batches.
+    """
+
+    def __init__(self, handler, workers=8, maxsize=1000):
+        self._handler = handler
+        self._worker_count = max(1, workers)
+        self._maxsize = maxsize
+        self._queue = asyncio.Queue()
+        self._pending = 0  # events queued or running
+        self._user_locks = {}  # user_id -> [lock, holders]
+        self._workers = []
+        self._accepting = False
+        self._busy = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._batch_total = 0.0
+        self._batch_serial_total = 0.0
+        self._batch_events = 0
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.max_batch_ms = 0.0
+
+    def start(self):
+        """Spawn the worker tasks. Must be called from a running event loop."""
+        if self._workers:
+            return
+        self._accepting = True
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"line-event-worker-{i}")
+            for i in range(self._worker_count)
+        ]
+
+    def put_batch(self, items):
+        """Enqueue one delivery of (user_id, event) pairs without waiting.
+
+        The batch is accepted as a whole or not at all, so a rejected delivery can be
+        retried by LINE without duplicating the events that would otherwise have fit.
+        Returns False when the queue is shutting down or has no room.
+        """
+        if not self._accepting:
+            self.rejected += len(items)
+            return False
+        if self._maxsize and self._maxsize - self._pending < len(items):
+            self.rejected += len(items)
+            logger.warning(f"Event queue full, rejecting {len(items)} event(s)")
+            return False
+
+        self._queue.put_nowait((list(items), time.monotonic()))
+        self._pending += len(items)
+        self.enqueued += len(items)
+        self.max_depth = max(self.max_depth, self._pending)
+        return True
+
+    async def drain(self, timeout=None):
+        """Stop accepting events, wait for queued ones to finish, then stop the workers."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Event queue drain timed out with {self._pending} event(s) left")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            items, enqueued_at = await self._queue.get()
+            try:
+                await self._run_batch(items, enqueued_at)
+            finally:
+                self._queue.task_done()
+
+    async def _run_batch(self, items, enqueued_at):
+        by_user = {}
+        for user_id, event in items:
+            by_user.setdefault(user_id, []).append(event)
+
+        started = time.monotonic()
+        async with asyncio.TaskGroup() as group:
+            # Tasks start in creation order, so every user's lock is requested
+            # before a batch picked up later can request it.
+            tasks = [
+                group.create_task(self._run_user(user_id, events, enqueued_at))
+                for user_id, events in by_user.items()
+            ]
+        serial = sum(task.result() for task in tasks)
+
+        elapsed = time.monotonic() - started
+        self.batches += 1
+        self._batch_events += len(items)
+        self.max_batch_size = max(self.max_batch_size, len(items))
+        self.max_batch_ms = max(self.max_batch_ms, elapsed * 1000)
+        self._batch_total += elapsed
+        self._batch_serial_total += serial
+        if len(items) > 1:
+            logger.info(
+                f"Processed batch of {len(items)} event(s) from {len(by_user)} user(s) "
+                f"in {elapsed * 1000:.0f} ms (sequential would be {serial * 1000:.0f} ms)"
+            )
+
+    async def _run_user(self, user_id, events, enqueued_at):
+        """Run one user's events in order; returns the summed handler time."""
+        entry = self._user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        spent = 0.0
+        try:
+            async with entry[0]:
+                for event in events:
+                    spent += await self._run(event, enqueued_at)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user_id]
+        return spent
+
+    async def _run(self, event, enqueued_at):
+        started = time.monotonic()
+        self._wait_total += started - enqueued_at
+        self._busy += 1
+        try:
+            # Errors stay with their event so the rest of the batch is still processed
+            await self._handler(event)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Error while processing LINE event")
+        finally:
+            self._busy -= 1
+            self._pending -= 1
+            spent = time.monotonic() - started
+            self._run_total += spent
+        return spent
+
+    def stats(self):
+        done = self.processed + self.failed
+        return {
+            "workers": len(self._workers),
+            "in_flight": self._busy,
+            "depth": self._pending - self._busy,
+            "capacity": self._maxsize,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self._wait_total / done * 1000, 2) if done else 0.0,
+            "avg_run_ms": round(self._run_total / done * 1000, 2) if done else 0.0,
+            "batches": self.batches,
+            "avg_batch_size": round(self._batch_events / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_ms": round(self._batch_total / self.batches * 1000, 2) if self.batches else 0.0,
+            "max_batch_ms": round(self.max_batch_ms, 2),
+            "batch_speedup": round(self._batch_serial_total / self._batch_total, 2) if self._batch_total else 1.0,
+        }
@@ -0,0 +1,99 @@
+#linebot_reply.py
+import asyncio
+import logging
+import os
+import time
+from linebot.models import TextSendMessage
+
+logger = logging.getLogger(__name__)
+
+# Slow generation handling
+LINE_PARTIAL_REPLY_AFTER = float(os.getenv("LINE_PARTIAL_REPLY_AFTER") or "8")  # seconds
+LINE_PARTIAL_MIN_CHARS = int(os.getenv("LINE_PARTIAL_MIN_CHARS") or "80")
+LINE_LOADING_SECONDS = int(os.getenv("LINE_LOADING_SECONDS") or "20")  # 5-60, multiple of 5
+LINE_REPLY_TOKEN_TTL = float(os.getenv("LINE_REPLY_TOKEN_TTL") or "50")  # reply tokens expire after ~1 minute
+
+reply_counters = {"replies": 0, "pushes": 0, "partial_replies": 0, "loading_indicators": 0}
+
+
+def reply_stats():
+    return dict(reply_counters)
+
+
+class StreamingReply:
+    """Delivers one answer to a LINE user, early if generating it takes long.
+
+    If the answer is not ready after `partial_after` seconds, the text streamed so far
+    is sent with the reply token, cut at a line break. If there is not enough text yet,
+    a loading animation is shown instead. Whatever is still missing is pushed when the
+    generation finishes, because the reply token can only be used once and expires.
+    """
+
+    def __init__(self, line_bot_api, http_session, user_id, reply_token, received_at=None,
+                 partial_after=LINE_PARTIAL_REPLY_AFTER, min_partial_chars=LINE_PARTIAL_MIN_CHARS):
+        self._api = line_bot_api
+        self._session = http_session
+        self.user_id = user_id
+        self.reply_token = reply_token
+        self.partial_after = partial_after
+        self.min_partial_chars = min_partial_chars
+        # Wall-clock seconds when LINE sent the event; the reply token's age counts from there
+        self.received_at = received_at or time.time()
+        self.reply_token_used = False
+        self._text = ""
+        self._sent_text = ""
+
+    def on_text(self, text):
+        """Streaming callback: the answer generated so far."""
+        self._text = text
+
+    async def run(self, generation):
+        """Await the generation, sending a partial answer or loading indicator if it is slow."""
+        task = asyncio.ensure_future(generation)
+        done, _ = await asyncio.wait({task}, timeout=self.partial_after)
+        if not done:
+            try:
+                await self._send_early()
+            except Exception as e:
+                logger.warning(f"Early reply to {self.user_id} failed: {e}")
+        return await task
+
+    async def finish(self, text):
+        """Send the final answer, or the part of it the user has not seen yet."""
+        remaining = text
+        if self._sent_text and text.startswith(self._sent_text):
+            remaining = text[len(self._sent_text):].strip()
+        if remaining:
+            await self.send([TextSendMessage(text=remaining)])
+
+    async def send(self, messages):
+        """Reply while the reply token is fresh and unused, push otherwise."""
+        if not self.reply_token_used and time.time() - self.received_at < LINE_REPLY_TOKEN_TTL:
+            self.reply_token_used = True
+            reply_counters["replies"] += 1
+            await self._api.reply_message(self.reply_token, messages)
+        else:
+            reply_counters["pushes"] += 1
+            await self._api.push_message(self.user_id, messages)
+
+    async def _send_early(self):
+        cut = self._text.rfind("\n")
+        if cut >= self.min_partial_chars:
+            partial = self._text[:cut]
+            reply_counters["partial_replies"] += 1
+            await self.send([TextSendMessage(text=partial)])
+            # Only what was delivered is left out of the final message
+            self._sent_text = partial
+        else:
+            await self.show_loading()
+
+    async def show_loading(self, seconds=LINE_LOADING_SECONDS):
+        """Show LINE's loading animation in the user's chat (one-on-one chats only)."""
+        reply_counters["loading_indicators"] += 1
+        async with self._session.post(
+            f"{self._api.endpoint}/v2/bot/chat/loading/start",
+            headers=self._api.headers,
+            json={"chatId": self.user_id, "loadingSeconds": seconds},
+        ) as response:
+            if response.status >= 300:
+                logger.warning(f"Loading animation for {self.user_id} failed: {response.status}")
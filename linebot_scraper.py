@@ -0,0 +1,245 @@
+#linebot_scraper.py
+import asyncio
+import codecs
+import logging
+import os
+import time
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import aiohttp
+from linebot_cache import TTLCache
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# Web scraper configuration
+SCRAPE_MAX_CHARS = int(os.getenv("SCRAPE_MAX_CHARS") or "2000")  # text returned to the model
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES") or str(2 * 1024 * 1024))  # body read at most
+SCRAPE_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT") or "10")  # seconds for the whole fetch
+SCRAPE_CACHE_SIZE = int(os.getenv("SCRAPE_CACHE_SIZE") or "256")
+SCRAPE_CACHE_FRESH = int(os.getenv("SCRAPE_CACHE_FRESH") or "300")  # seconds served without asking the site
+SCRAPE_CACHE_TTL = int(os.getenv("SCRAPE_CACHE_TTL") or "86400")  # seconds kept for revalidation
+SCRAPE_ROBOTS_TTL = int(os.getenv("SCRAPE_ROBOTS_TTL") or "3600")
+SCRAPE_USER_AGENT = os.getenv("SCRAPE_USER_AGENT") or "linebot-agent"
+
+CHUNK_SIZE = 64 * 1024
+ROBOTS_MAX_BYTES = 500 * 1024  # RFC 9309: parse at least the first 500 KiB
+TEXT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+# Elements whose text is never main content
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "head", "nav", "header", "footer", "aside", "form"}
+# Elements that end a block of text
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "td", "th", "tr", "table", "pre",
+              "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "br", "dd", "dt", "figcaption"}
+VOID_TAGS = {"br", "img", "hr", "meta", "link", "input", "source", "wbr", "area", "base", "col", "embed", "track"}
+
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML to readable text: boilerplate elements and link lists are dropped.
+
+    Feed it chunks as they arrive; `done` turns true once `max_chars` of text is
+    collected, so the caller can stop downloading.
+    """
+
+    def __init__(self, max_chars=SCRAPE_MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.blocks = []
+        self.chars = 0
+        self._skip_stack = []
+        self._link_depth = 0
+        self._text = []
+        self._link_chars = 0
+
+    @property
+    def done(self):
+        return self.chars >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag == "br":
+                self._end_block()
+            return
+        if tag in SKIP_TAGS:
+            self._skip_stack.append(tag)
+            self._end_block()
+        elif tag in BLOCK_TAGS:
+            self._end_block()
+        elif tag == "a":
+            self._link_depth += 1
+
+    def handle_endtag(self, tag):
+        if self._skip_stack and tag == self._skip_stack[-1]:
+            self._skip_stack.pop()
+        elif tag in BLOCK_TAGS:
+            self._end_block()
+        elif tag == "a" and self._link_depth:
+            self._link_depth -= 1
+
+    def handle_data(self, data):
+        if self._skip_stack or self.done:
+            return
+        self._text.append(data)
+        if self._link_depth:
+            self._link_chars += len(data.strip())
+
+    def _end_block(self):
+        text = " ".join("".join(self._text).split())
+        link_chars = self._link_chars
+        self._text = []
+        self._link_chars = 0
+        # Menus and link lists are mostly link text; a sentence is not
+        if not text or link_chars > len(text) / 2:
+            return
+        self.blocks.append(text)
+        self.chars += len(text) + 1
+
+    def text(self):
+        self._end_block()
+        return "\n".join(self.blocks)[:self.max_chars]
+
+
+class WebScraper:
+    """Fetches pages for the scrape tool without reading more than it returns.
+
+    The body is streamed and parsed as it arrives; the download stops once enough
+    text is extracted, after `max_bytes`, or after `timeout` seconds. Only text
+    content types are read. Pages are cached by URL: fresh for `cache_fresh`
+    seconds, then revalidated with ETag / Last-Modified. robots.txt is honoured.
+    """
+
+    def __init__(self, max_chars=SCRAPE_MAX_CHARS, max_bytes=SCRAPE_MAX_BYTES, timeout=SCRAPE_TIMEOUT,
+                 cache_size=SCRAPE_CACHE_SIZE, cache_fresh=SCRAPE_CACHE_FRESH, cache_ttl=SCRAPE_CACHE_TTL,
+                 robots_ttl=SCRAPE_ROBOTS_TTL, user_agent=SCRAPE_USER_AGENT, session=None):
+        self.max_chars = max_chars
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache_fresh = cache_fresh
+        self.user_agent = user_agent
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)  # url -> page entry
+        self.robots = TTLCache(maxsize=cache_size, ttl=robots_ttl)  # origin -> RobotFileParser
+        self._session = session
+        self._owns_session = session is None
+        self.fetch_time = LatencyRecorder()
+        self.fetches = 0
+        self.revalidated = 0
+        self.robots_blocked = 0
+        self.truncated = 0
+        self.bytes_read = 0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers={"User-Agent": self.user_agent})
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def scrape(self, url):
+        """{"status": 200, "content": text} for url, or {"status": code, "error": message}."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            return {"status": 400, "error": f"Only http(s) URLs can be scraped: {url}"}
+        cached = self.cache.get(url)
+        if cached is not None and time.monotonic() - cached["checked"] < self.cache_fresh:
+            return {"status": 200, "content": cached["content"]}
+        if not await self._allowed(parts):
+            self.robots_blocked += 1
+            return {"status": 403, "error": f"robots.txt of {parts.netloc} does not allow fetching {url}"}
+
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        started = time.monotonic()
+        async with self._get_session().get(url, headers=headers, timeout=self.timeout) as response:
+            if response.status == 304 and cached is not None:
+                self.revalidated += 1
+                cached["checked"] = time.monotonic()
+                self.cache.set(url, cached)
+                return {"status": 200, "content": cached["content"]}
+            if response.status >= 400:
+                return {"status": response.status, "error": f"{response.status} {response.reason}"}
+            content_type = response.content_type
+            if content_type not in TEXT_TYPES:
+                return {"status": 415, "error": f"Not a text page ({content_type})"}
+            content = await self._extract(response, plain=content_type == "text/plain")
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        self.fetches += 1
+        self.fetch_time.record(time.monotonic() - started)
+        if etag or last_modified or self.cache_fresh:
+            self.cache.set(url, {"content": content, "etag": etag, "last_modified": last_modified,
+                                 "checked": time.monotonic()})
+        return {"status": 200, "content": content}
+
+    async def _extract(self, response, plain=False):
+        decoder = codecs.getincrementaldecoder(_codec(response.charset))(errors="replace")
+        parser = None if plain else TextExtractor(self.max_chars)
+        text, read = [], 0
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            read += len(chunk)
+            decoded = decoder.decode(chunk)
+            if parser is None:
+                text.append(decoded)
+                if sum(map(len, text)) >= self.max_chars:
+                    break
+            else:
+                parser.feed(decoded)
+                if parser.done:
+                    break
+            if read >= self.max_bytes:
+                self.truncated += 1
+                break
+        self.bytes_read += read
+        if parser is None:
+            return " ".join("".join(text).split())[:self.max_chars]
+        return parser.text()
+
+    async def _allowed(self, parts):
+        origin = f"{parts.scheme}://{parts.netloc}"
+        rules = self.robots.get(origin)
+        if rules is None:
+            rules = await self._fetch_robots(origin)
+            self.robots.set(origin, rules)
+        return rules.can_fetch(self.user_agent, parts.geturl())
+
+    async def _fetch_robots(self, origin):
+        rules = RobotFileParser(f"{origin}/robots.txt")
+        try:
+            async with self._get_session().get(rules.url, timeout=self.timeout) as response:
+                if response.status >= 500:
+                    rules.disallow_all = True  # RFC 9309: server errors mean "assume disallowed"
+                elif response.status >= 400:
+                    rules.allow_all = True
+                else:
+                    body = await response.content.read(ROBOTS_MAX_BYTES)
+                    rules.parse(body.decode("utf-8", errors="replace").splitlines())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Could not read {rules.url}, treating the site as disallowed: {e}")
+            rules.disallow_all = True
+        return rules
+
+    def stats(self):
+        return {
+            "fetches": self.fetches,
+            "cache": self.cache.stats(),
+            "revalidated": self.revalidated,
+            "robots_blocked": self.robots_blocked,
+            "truncated": self.truncated,
+            "bytes_read": self.bytes_read,
+            "fetch": self.fetch_time.stats(),
+        }
+
+
+def _codec(charset):
+    try:
+        return codecs.lookup(charset or "utf-8").name
+    except LookupError:
+        return "utf-8"
@@ -0,0 +1,216 @@
+#linebot_search.py
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+import aiohttp
+from linebot_cache import TTLCache
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# Web search configuration
+SEARCH_ENGINE = (os.getenv("SEARCH_ENGINE") or "duckduckgo").lower()  # google, duckduckgo or both
+GOOGLE_SEARCH_API_KEY = os.getenv("GOOGLE_SEARCH_API_KEY")
+GOOGLE_CX = os.getenv("GOOGLE_CX")
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS") or "10")
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE") or "512")
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL") or "900")  # seconds
+SEARCH_GOOGLE_TIMEOUT = float(os.getenv("SEARCH_GOOGLE_TIMEOUT") or "5")
+SEARCH_DUCKDUCKGO_TIMEOUT = float(os.getenv("SEARCH_DUCKDUCKGO_TIMEOUT") or "5")
+# Google Custom Search allows 100 queries per minute and (on the free tier) 100 per day
+SEARCH_GOOGLE_PER_MINUTE = int(os.getenv("SEARCH_GOOGLE_PER_MINUTE") or "60")
+SEARCH_GOOGLE_PER_DAY = int(os.getenv("SEARCH_GOOGLE_PER_DAY") or "100")
+
+GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+DUCKDUCKGO_SEARCH_URL = "https://api.duckduckgo.com/search"
+
+
+class SearchRateLimited(RuntimeError):
+    """The engine's query quota is used up for now."""
+
+
+class RateLimiter:
+    """Token bucket of `per_minute` queries (bursts up to that many) plus a daily cap.
+
+    `acquire(wait)` waits at most `wait` seconds for a token and raises
+    SearchRateLimited otherwise; the daily count resets at midnight UTC.
+    """
+
+    def __init__(self, per_minute, per_day=0):
+        self.rate = per_minute / 60
+        self.capacity = max(1, per_minute)
+        self.per_day = per_day
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._day = None
+        self._used_today = 0
+        self._lock = asyncio.Lock()
+        self.limited = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, wait=0.0):
+        async with self._lock:
+            day = time.gmtime().tm_yday
+            if day != self._day:
+                self._day, self._used_today = day, 0
+            if self.per_day and self._used_today >= self.per_day:
+                self.limited += 1
+                raise SearchRateLimited(f"daily quota of {self.per_day} queries used")
+            self._refill()
+            delay = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if delay > wait:
+                self.limited += 1
+                raise SearchRateLimited(f"more than {self.capacity} queries per minute")
+            if delay:
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= 1
+            self._used_today += 1
+
+    def stats(self):
+        return {"used_today": self._used_today, "limited": self.limited}
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a search query; symbols matter ("C++" is not "C#")."""
+    return " ".join(query.casefold().split())
+
+
+def result_key(link):
+    """Form of a result URL used to spot the same page from two engines."""
+    parts = urlsplit(link.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    return f"{host}{parts.path.rstrip('/')}{'?' + parts.query if parts.query else ''}"
+
+
+def merge_results(result_lists, limit):
+    """Interleave ranked (title, link) lists best-first, keeping the first of any duplicate page."""
+    merged, seen = [], set()
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank < len(results):
+                title, link = results[rank]
+                key = result_key(link)
+                if key not in seen:
+                    seen.add(key)
+                    merged.append((title, link))
+    return merged[:limit]
+
+
+class WebSearch:
+    """Google Custom Search and/or DuckDuckGo over one shared aiohttp session.
+
+    Results are cached per (engine, normalised query) for `cache_ttl` seconds and
+    concurrent identical lookups share one request. With engine "both" the engines
+    are queried in parallel, each within its own timeout, and their results are
+    merged without duplicates; an engine that fails or is over quota is skipped.
+    Google queries go through a rate limiter to stay inside the API quota.
+    """
+
+    def __init__(self, engine=SEARCH_ENGINE, google_api_key=GOOGLE_SEARCH_API_KEY, google_cx=GOOGLE_CX,
+                 results=SEARCH_RESULTS, cache_size=SEARCH_CACHE_SIZE, cache_ttl=SEARCH_CACHE_TTL,
+                 timeouts=None, google_limiter=None, session=None):
+        if engine == "both":
+            self.engines = ("google", "duckduckgo")
+        elif engine == "google":
+            self.engines = ("google",)
+        else:
+            self.engines = ("duckduckgo",)
+        if "google" in self.engines and not (google_api_key and google_cx):
+            logger.warning("GOOGLE_SEARCH_API_KEY or GOOGLE_CX is not set; searching with DuckDuckGo only")
+            self.engines = ("duckduckgo",)
+        self.google_api_key = google_api_key
+        self.google_cx = google_cx
+        self.results = results
+        self.timeouts = {"google": SEARCH_GOOGLE_TIMEOUT, "duckduckgo": SEARCH_DUCKDUCKGO_TIMEOUT, **(timeouts or {})}
+        self.google_limiter = google_limiter or RateLimiter(SEARCH_GOOGLE_PER_MINUTE, SEARCH_GOOGLE_PER_DAY)
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._session = session
+        self._owns_session = session is None
+        self._pending = {}  # (engine, query) -> task fetching it
+        self.latency = {engine: LatencyRecorder() for engine in ("google", "duckduckgo")}
+        self.failures = {engine: 0 for engine in ("google", "duckduckgo")}
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def search(self, query):
+        """Ranked (title, link) results for query; raises the last error if every engine failed."""
+        normalized = normalize_query(query)
+        outcomes = await asyncio.gather(
+            *(self._engine_results(engine, query, normalized) for engine in self.engines),
+            return_exceptions=True,
+        )
+        found = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+        for engine, outcome in zip(self.engines, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.warning(f"{engine} search failed: {outcome!r}")
+        if not found:
+            raise outcomes[-1]
+        return merge_results(found, self.results)
+
+    async def _engine_results(self, engine, query, normalized):
+        key = (engine, normalized)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(engine, query))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        results = await asyncio.shield(task)
+        self.cache.set(key, results)
+        return results
+
+    async def _fetch(self, engine, query):
+        timeout = self.timeouts[engine]
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(timeout):
+                if engine == "google":
+                    await self.google_limiter.acquire(wait=timeout / 2)
+                    results = await self._google(query)
+                else:
+                    results = await self._duckduckgo(query)
+        except Exception:
+            self.failures[engine] += 1
+            raise
+        self.latency[engine].record(time.monotonic() - started)
+        return results
+
+    async def _get_json(self, url, params):
+        async with self._get_session().get(url, params=params) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _google(self, query):
+        params = {"key": self.google_api_key, "cx": self.google_cx, "q": query, "num": min(self.results, 10)}
+        data = await self._get_json(GOOGLE_SEARCH_URL, params)
+        return [(item["title"], item["link"]) for item in data.get("items", [])[:self.results]]
+
+    async def _duckduckgo(self, query):
+        data = await self._get_json(DUCKDUCKGO_SEARCH_URL, {"q": query, "format": "json"})
+        return [(item["Title"], item["Url"]) for item in data.get("Web", [])[:self.results]]
+
+    def stats(self):
+        return {
+            "cache": self.cache.stats(),
+            "google_quota": self.google_limiter.stats(),
+            **{f"{engine}_failures": count for engine, count in self.failures.items()},
+            **{engine: recorder.stats() for engine, recorder in self.latency.items()},
+        }
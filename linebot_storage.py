@@ -0,0 +1,210 @@
+#linebot_storage.py
+import asyncio
+import json
+import logging
+import os
+import time
+import aiohttp
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# MinIO / S3 configuration
+MINIO_URL_API = os.getenv("MINIO_URL_API")
+MINIO_BUCKET = os.getenv("MINIO_BUCKET")
+MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
+MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
+MINIO_REGION = os.getenv("MINIO_REGION") or "us-east-1"
+# Uploads are streamed in parts of this size; at most one part is held in memory
+STORAGE_PART_SIZE = int(os.getenv("STORAGE_PART_SIZE") or str(5 * 1024 * 1024))  # S3 minimum is 5 MiB
+STORAGE_DOWNLOAD_TIMEOUT = float(os.getenv("STORAGE_DOWNLOAD_TIMEOUT") or "60")
+
+
+def public_read_policy(bucket):
+    """Bucket policy that lets anyone download (only download) objects in bucket."""
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"AWS": ["*"]},
+                "Action": ["s3:GetObject"],
+                "Resource": [f"arn:aws:s3:::{bucket}/*"],
+            }
+        ],
+    }
+
+
+class _StreamReader:
+    """Blocking file-like view of an aiohttp response body, for boto3 running in a thread.
+
+    read(n) returns exactly n bytes unless the body ends first; boto3 takes a short
+    read for the end of the stream.
+    """
+
+    def __init__(self, content, loop, timeout=None):
+        self._content = content
+        self._loop = loop
+        self._timeout = timeout  # so the thread can't hang if the loop stops feeding it
+        self.bytes_read = 0
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(self._timeout)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._run(self._content.read())
+        else:
+            chunks, remaining = [], size
+            while remaining > 0:
+                chunk = self._run(self._content.read(remaining))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+            data = b"".join(chunks)
+        self.bytes_read += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+
+class ImageStorage:
+    """Generated images in a MinIO/S3 bucket with public read access.
+
+    The S3 client is created, and the bucket and its policy checked, once by
+    `start()`. `upload_from_url` streams an HTTP download (ComfyUI's /view) into a
+    multipart upload part by part, so memory use does not grow with the image size.
+    boto3 is blocking, so it runs in a worker thread while the event loop feeds it;
+    it is only imported by `start()`, so the app starts without loading it.
+    """
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region=MINIO_REGION,
+                 public_url=None, part_size=STORAGE_PART_SIZE, session=None,
+                 download_timeout=STORAGE_DOWNLOAD_TIMEOUT):
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.public_base = (public_url or endpoint or "").rstrip("/")
+        self._credentials = {"aws_access_key_id": access_key, "aws_secret_access_key": secret_key}
+        self.region = region
+        self.part_size = part_size
+        self.transfer_config = None  # boto3 TransferConfig, made by start()
+        self.download_timeout = aiohttp.ClientTimeout(total=download_timeout)
+        self._session = session
+        self._owns_session = session is None
+        self._client = None
+        self._start_lock = asyncio.Lock()
+        self.upload_time = LatencyRecorder()
+        self.uploads = 0
+        self.upload_failures = 0
+        self.bytes_uploaded = 0
+        self.deletes = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(MINIO_URL_API, MINIO_BUCKET, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_REGION)
+
+    @property
+    def ready(self):
+        return self._client is not None
+
+    async def start(self):
+        """Create the S3 client and make sure the bucket exists and is publicly readable."""
+        async with self._start_lock:
+            if self._client is None:
+                self._client = await asyncio.to_thread(self._setup)
+
+    def _setup(self):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.part_size, multipart_chunksize=self.part_size, use_threads=False,
+        )
+        client = boto3.client(
+            "s3",
+            endpoint_url=self.endpoint,
+            region_name=self.region,
+            config=Config(signature_version="s3v4"),
+            **self._credentials,
+        )
+        try:
+            client.head_bucket(Bucket=self.bucket)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchBucket"):
+                raise
+            client.create_bucket(Bucket=self.bucket)
+            logger.info(f"Created bucket {self.bucket}")
+        policy = public_read_policy(self.bucket)
+        try:
+            current = json.loads(client.get_bucket_policy(Bucket=self.bucket)["Policy"])
+        except ClientError:
+            current = None
+        if current != policy:
+            client.put_bucket_policy(Bucket=self.bucket, Policy=json.dumps(policy))
+            logger.info(f"Bucket {self.bucket} policy set to public read")
+        return client
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    def public_url(self, key):
+        return f"{self.public_base}/{self.bucket}/{key}"
+
+    async def upload_from_url(self, url, key, content_type="image/png"):
+        """Stream the body at url into the bucket as key; returns the object's public URL."""
+        if self._client is None:
+            await self.start()
+        started = time.monotonic()
+        try:
+            async with self._get_session().get(url, timeout=self.download_timeout) as response:
+                response.raise_for_status()
+                reader = _StreamReader(response.content, asyncio.get_running_loop(), self.download_timeout.total)
+                await asyncio.to_thread(
+                    self._client.upload_fileobj,
+                    reader,
+                    self.bucket,
+                    key,
+                    ExtraArgs={"ContentType": response.headers.get("Content-Type") or content_type},
+                    Config=self.transfer_config,
+                )
+        except Exception:
+            self.upload_failures += 1
+            raise
+        self.uploads += 1
+        self.bytes_uploaded += reader.bytes_read
+        self.upload_time.record(time.monotonic() - started)
+        return self.public_url(key)
+
+    async def delete(self, keys):
+        """Remove objects from the bucket, up to 1000 per request."""
+        keys = list(keys)
+        if not keys:
+            return
+        if self._client is None:
+            await self.start()
+        for i in range(0, len(keys), 1000):
+            batch = {"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True}
+            await asyncio.to_thread(self._client.delete_objects, Bucket=self.bucket, Delete=batch)
+        self.deletes += len(keys)
+
+    def stats(self):
+        return {
+            "ready": int(self.ready),
+            "uploads": self.uploads,
+            "upload_failures": self.upload_failures,
+            "bytes_uploaded": self.bytes_uploaded,
+            "deletes": self.deletes,
+            "upload": self.upload_time.stats(),
+        }
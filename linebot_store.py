@@ -0,0 +1,264 @@
+#linebot_store.py
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+
+# Conversation store configuration
+CONVERSATION_STORE = (os.getenv("CONVERSATION_STORE") or "redis").lower()  # "redis" or "memory"
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL") or "86400")  # Automatically delete after 1 day
+CONVERSATION_MAX_LENGTH = int(os.getenv("LINE_CHAT_HISTORY_LENGTH") or "41")
+
+
+# Using Redis lists to store conversation history, one message per entry
+def get_history_key(user_id):
+    return f"history:{user_id}"
+
+
+# Running summary of the messages that were trimmed from the history
+def get_summary_key(user_id):
+    return f"summary:{user_id}"
+
+
+# Whole-history JSON blobs written by earlier versions
+def get_conversation_key(user_id):
+    return f"conversation:{user_id}"
+
+
+def parse_legacy_history(history_str):
+    """Turn a legacy conversation:{user_id} JSON value into list entries.
+
+    The system prompt used to be stored with every user; it is now added when the
+    prompt is built, so it is dropped here.
+    """
+    try:
+        history = json.loads(history_str)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(history, list):
+        return []
+    return [
+        json.dumps(message, ensure_ascii=False)
+        for message in history
+        if isinstance(message, dict) and message.get("role") != "system"
+    ]
+
+
+class ConversationStore(ABC):
+    """Where per-user conversation history lives between webhook events.
+
+    History is append-only: a turn writes only its new messages, and the store keeps
+    the last `max_length` of them.
+    """
+
+    def __init__(self, ttl=CONVERSATION_TTL, max_length=CONVERSATION_MAX_LENGTH):
+        self.ttl = ttl
+        self.max_length = max_length
+
+    @abstractmethod
+    async def load(self, user_id):
+        """Return (messages oldest first, running summary or None) for the user."""
+
+    @abstractmethod
+    async def append(self, user_id, messages):
+        """Append messages to the user's history, cap it and refresh its TTL."""
+
+    @abstractmethod
+    async def save_summary(self, user_id, summary, summarized):
+        """Store a new running summary and drop the summarized messages from the history head.
+
+        `summarized` are the oldest messages the summary now covers. Returns False and
+        changes nothing when the history no longer starts with them (e.g. it was
+        cleared or trimmed while the summary was being written).
+        """
+
+    @abstractmethod
+    async def clear(self, user_id):
+        """Forget the user's history."""
+
+    async def close(self):
+        pass
+
+
+class RedisConversationStore(ConversationStore):
+    """Conversation store on an asyncio Redis client sharing one connection pool."""
+
+    def __init__(self, host, port, password=None, db=0, max_connections=50,
+                 ttl=CONVERSATION_TTL, max_length=CONVERSATION_MAX_LENGTH):
+        super().__init__(ttl, max_length)
+        import redis.asyncio as aioredis
+
+        self._pool = aioredis.ConnectionPool(
+            host=host,
+            port=port,
+            db=db,
+            password=password or None,
+            max_connections=max_connections,
+        )
+        self.redis = aioredis.Redis(connection_pool=self._pool)
+
+    async def load(self, user_id):
+        key = get_history_key(user_id)
+        legacy_key = get_conversation_key(user_id)
+        # Look for a not yet migrated blob in the same round trip
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.get(get_summary_key(user_id))
+            pipe.get(legacy_key)
+            entries, summary, legacy = await pipe.execute()
+
+        if legacy is not None:
+            entries = await self._migrate(user_id, entries, legacy)
+        if isinstance(summary, bytes):
+            summary = summary.decode()
+        return [json.loads(entry) for entry in entries], summary
+
+    async def _migrate(self, user_id, entries, legacy):
+        key = get_history_key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if not entries:
+                entries = parse_legacy_history(legacy)[-self.max_length:]
+                if entries:
+                    pipe.rpush(key, *entries)
+                    pipe.expire(key, self.ttl)
+            pipe.delete(get_conversation_key(user_id))
+            await pipe.execute()
+        return entries
+
+    async def append(self, user_id, messages):
+        if not messages:
+            return
+        key = get_history_key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(json.dumps(message, ensure_ascii=False) for message in messages))
+            pipe.ltrim(key, -self.max_length, -1)
+            pipe.expire(key, self.ttl)
+            pipe.expire(get_summary_key(user_id), self.ttl)
+            await pipe.execute()
+
+    async def save_summary(self, user_id, summary, summarized):
+        from redis.exceptions import WatchError
+
+        if not summarized:
+            return False
+        key = get_history_key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                # Another turn may append meanwhile; only the head has to stay the same
+                await pipe.watch(key)
+                head = await pipe.lrange(key, 0, len(summarized) - 1)
+                if [json.loads(entry) for entry in head] != summarized:
+                    return False
+                pipe.multi()
+                pipe.ltrim(key, len(summarized), -1)
+                pipe.setex(get_summary_key(user_id), self.ttl, summary)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def clear(self, user_id):
+        await self.redis.delete(get_history_key(user_id), get_summary_key(user_id), get_conversation_key(user_id))
+
+    async def migrate_all(self, batch_size=500):
+        """Convert every legacy conversation:* blob to a list; returns how many were moved."""
+        migrated = 0
+        async for legacy_key in self.redis.scan_iter(match=get_conversation_key("*"), count=batch_size):
+            legacy_key = legacy_key.decode() if isinstance(legacy_key, bytes) else legacy_key
+            user_id = legacy_key.split(":", 1)[1]
+            legacy = await self.redis.get(legacy_key)
+            if legacy is None:
+                continue
+            entries = await self.redis.lrange(get_history_key(user_id), 0, -1)
+            await self._migrate(user_id, entries, legacy)
+            migrated += 1
+        return migrated
+
+    async def close(self):
+        close = getattr(self.redis, "aclose", None) or self.redis.close  # aclose() since redis 5.0.1
+        await close()
+        await self._pool.disconnect()
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Process-local store for tests and single-node deployments without Redis."""
+
+    def __init__(self, ttl=CONVERSATION_TTL, max_length=CONVERSATION_MAX_LENGTH):
+        super().__init__(ttl, max_length)
+        self._data = {}  # key -> (expires_at, list of json strings or summary text)
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def load(self, user_id):
+        entries = self._get(get_history_key(user_id)) or []
+        return [json.loads(entry) for entry in entries], self._get(get_summary_key(user_id))
+
+    async def append(self, user_id, messages):
+        if not messages:
+            return
+        key = get_history_key(user_id)
+        # Stored serialized, like Redis, so callers can't mutate it in place
+        entries = (self._get(key) or []) + [json.dumps(message, ensure_ascii=False) for message in messages]
+        expires_at = time.monotonic() + self.ttl
+        self._data[key] = (expires_at, entries[-self.max_length:])
+        summary = self._get(get_summary_key(user_id))
+        if summary is not None:
+            self._data[get_summary_key(user_id)] = (expires_at, summary)
+
+    async def save_summary(self, user_id, summary, summarized):
+        key = get_history_key(user_id)
+        entries = self._get(key) or []
+        if not summarized or [json.loads(entry) for entry in entries[:len(summarized)]] != summarized:
+            return False
+        expires_at = time.monotonic() + self.ttl
+        self._data[key] = (expires_at, entries[len(summarized):])
+        self._data[get_summary_key(user_id)] = (expires_at, summary)
+        return True
+
+    async def clear(self, user_id):
+        for key in (get_history_key(user_id), get_summary_key(user_id)):
+            self._data.pop(key, None)
+
+
+def create_conversation_store():
+    """Build the store selected by CONVERSATION_STORE from the environment."""
+    if CONVERSATION_STORE == "memory":
+        return InMemoryConversationStore()
+
+    # REDIS SERVER configuration
+    redis_host = os.getenv("REDIS_HOST", os.getenv("REDIS_HOST_ADDRESS") or "")
+    redis_port = os.getenv("REDIS_PORT", os.getenv("REDIS_HOST_PORT") or "")
+    if not redis_host or not redis_port:
+        raise ValueError(
+            "Please set REDIS_HOST_ADDRESS, REDIS_HOST_PORT via env var or code."
+        )
+    return RedisConversationStore(
+        host=redis_host,
+        port=int(redis_port),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD", os.getenv("REDIS_HOST_PASS") or ""),
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS") or "50"),
+    )
+
+
+if __name__ == "__main__":
+    # One-off migration of legacy JSON histories: python linebot_store.py
+    import asyncio
+
+    async def _migrate_legacy():
+        store = create_conversation_store()
+        try:
+            if isinstance(store, RedisConversationStore):
+                print(f"Migrated {await store.migrate_all()} conversation(s)")
+        finally:
+            await store.close()
+
+    asyncio.run(_migrate_legacy())
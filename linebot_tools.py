@@ -1,424 +1,295 @@
 #linebot_tools.py
 import os
-import json
-import requests
-import aiohttp
-from bs4 import BeautifulSoup
-from datetime import datetime
+import asyncio
+import contextvars
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
 from agents import function_tool, RunContextWrapper
 import random
 import uuid
-import boto3
-from io import BytesIO
 import logging
 from dataclasses import dataclass
+from linebot_metrics import LatencyRecorder, span
+from linebot_comfyui import ComfyUIScheduler, ComfyUITimeout
+from linebot_jobs import ImageJobRunner, ImageJobLimitError
+from linebot_workflow import WorkflowLibrary, WorkflowError
+from linebot_storage import ImageStorage
+from linebot_search import WebSearch
+from linebot_scraper import WebScraper, SCRAPE_TIMEOUT
+from linebot_weather import WeatherClient, WeatherError
+from linebot_imagecache import ImageCache, IMAGE_CACHE_ENABLED, deterministic_seeds, image_cache_key
 
 @dataclass
 class UserInfo:
     name: str
     uid: str
+    user_id: str = ""  # LINE user the answer goes to; images are pushed to them
 
 # Openweathermap API key
 OPENWEATHERMAP_API_KEY = os.getenv("WEATHERMAP_API_KEY") or ""
+# Weather tool: one shared session, results cached per city for OpenWeatherMap's 10 minute update interval
+weather = WeatherClient(OPENWEATHERMAP_API_KEY)
 
-# Configuration Search tool from environment variables
-search_engine = os.getenv("SEARCH_ENGINE", "duckduckgo").lower()
-google_api_key = os.getenv("GOOGLE_SEARCH_API_KEY")
-google_cx = os.getenv("GOOGLE_CX")
+# Search tool (engine, keys, quota from environment variables): one shared session, cached results
+web_search = WebSearch()
+
+# Scrape tool: streamed, size-capped page fetches with a per-URL cache; honours robots.txt
+web_scraper = WebScraper()
 
 # comfyUI configuration
-client_id = str(uuid.uuid4())
-COMFYUI_API_URL =  os.getenv("COMFYUI_WS_ENDPOINT")  # replace to your ComfyUI API URL
-COMFYUI_CLIENT_ID = client_id  
-MINIO_URL_API = os.getenv("MINIO_URL_API") 
-MINIO_URL_WEBUI = os.getenv("MINIO_URL_WEBUI")
-MINIO_BUCKET = os.getenv("MINIO_BUCKET") 
-MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")  
-MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
-MINIO_region_name = "us-east-1"
-
-logging.basicConfig(level=logging.INFO)
+COMFYUI_API_URL =  os.getenv("COMFYUI_WS_ENDPOINT")  # replace to your ComfyUI API URL(s), comma separated
+
+# MinIO bucket for generated images; boto3, the S3 client and the bucket policy are set up once, after startup
+storage = ImageStorage.from_env()
+
+# Optional cache of rendered images by prompt, workflow and seed; main.py attaches its index at startup
+image_cache = ImageCache(storage) if IMAGE_CACHE_ENABLED else None
+
+# ComfyUI workflow templates: parsed once at startup, reloaded when their files change
+workflows = WorkflowLibrary.from_env()
+
+# Shared async ComfyUI scheduler over every configured server (HTTP sessions are opened on first use)
+comfyui = ComfyUIScheduler(COMFYUI_API_URL or "")
+
 logger = logging.getLogger(__name__)
 
+# Tool execution: sync tools run on their own bounded thread pool, never on the event loop
+TOOL_THREADS = int(os.getenv("TOOL_THREADS") or "8")
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT") or "30")  # seconds, unless a tool sets its own
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY") or "8")  # calls of one tool at once
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_THREADS, thread_name_prefix="tool")  # threads start on first use
+_tool_stats = {}  # tool name -> {"calls", "timeouts", "errors", "latency"}
+
+
+def limited_tool(func, timeout=TOOL_TIMEOUT, concurrency=TOOL_CONCURRENCY):
+    """Async version of a tool function with a timeout, a concurrency cap and latency stats.
+
+    A sync function runs on tool_executor and holds its slot until its thread is
+    done, even after a timeout, so a hung tool cannot take more than `concurrency`
+    threads. Running out of `timeout` is reported to the model as the tool's result;
+    a TimeoutError from the tool itself is an error like any other.
+    """
+    name = func.__name__
+    slots = asyncio.Semaphore(concurrency)
+    stats = _tool_stats[name] = {"calls": 0, "timeouts": 0, "errors": 0, "latency": LatencyRecorder()}
+
+    if inspect.iscoroutinefunction(func):
+        async def call(*args, **kwargs):
+            async with slots:
+                return await func(*args, **kwargs)
+    else:
+        async def call(*args, **kwargs):
+            await slots.acquire()
+            run = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+            future = asyncio.get_running_loop().run_in_executor(tool_executor, run)
+            future.add_done_callback(lambda _: slots.release())
+            return await asyncio.shield(future)
+
+    @functools.wraps(func)
+    async def run_tool(*args, **kwargs):
+        stats["calls"] += 1
+        started = time.monotonic()
+        with span("tool", name) as tool_span:
+            deadline = asyncio.timeout(timeout)
+            try:
+                async with deadline:
+                    return await call(*args, **kwargs)
+            except TimeoutError:
+                if not deadline.expired():
+                    # Raised inside the tool, e.g. by its own HTTP client
+                    stats["errors"] += 1
+                    raise
+                stats["timeouts"] += 1
+                tool_span.fail()
+                logger.warning(f"Tool {name} timed out after {timeout:g}s")
+                return f"{name} did not finish within {timeout:g} seconds."
+            except Exception:
+                stats["errors"] += 1
+                raise
+            finally:
+                stats["latency"].record(time.monotonic() - started)
+
+    return run_tool
+
+
+def tool(func=None, *, timeout=TOOL_TIMEOUT, concurrency=TOOL_CONCURRENCY):
+    """function_tool for the agent, run through limited_tool; use as @tool or @tool(timeout=...)."""
+    if func is None:
+        return functools.partial(tool, timeout=timeout, concurrency=concurrency)
+    return function_tool(limited_tool(func, timeout, concurrency))
+
+
+def tool_stats():
+    return {
+        name: {**{key: value for key, value in stats.items() if key != "latency"}, **stats["latency"].stats()}
+        for name, stats in _tool_stats.items()
+    }
+
 # if not OPENWEATHERMAP_API_KEY:
 #     raise ValueError(
 #         "Please set WEATHERMAP_API_KEY via env var or code."
 #     )
 
-@function_tool
-def web_scrape_tool(url: str):
+@tool(timeout=SCRAPE_TIMEOUT + 5)
+async def web_scrape_tool(url: str):
     """Scrape text content from a URL."""
-    print(f"[debug] Scrape web for: {url}")
+    logger.debug("Scrape web for: %s", url)
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        return {
-            "status": 200,
-            "content": soup.get_text(strip=True)[:2000]  # Return first 2000 characters
-        }
+        # Main text only, at most SCRAPE_MAX_CHARS characters (2000 by default)
+        return await web_scraper.scrape(url)
     except Exception as e:
-        return {"status": 500, "error": str(e)}
+        return {"status": 500, "error": str(e) or type(e).__name__}
 
-@function_tool
-def web_search_tool(prompt: str):
+@tool
+async def web_search_tool(prompt: str):
     """Perform a web search using configurable API (Google or DuckDuckGo)"""
-    print(f"[debug] Searching web for: {prompt}")
-       
+    logger.debug("Searching web for: %s", prompt)
     try:
-        if search_engine == "google":
-            # Google Search API implementation
-            url = "https://www.googleapis.com/customsearch/v1"
-            params = {
-                'key': google_api_key,
-                'cx': google_cx,
-                'q': prompt,
-                'num': 10  # Return 3 results
-            }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
-            
-            results = []
-            if 'items' in data:
-                for result in data['items'][:10]:  # Get top 10 results
-                    results.append(f"{result['title']} - {result['link']}")
-                    
-            return "\n".join(results)
-            
-        else:
-            # DuckDuckGo API implementation
-            url = "https://api.duckduckgo.com/search"
-            params = {
-                'q': prompt,
-                'format': 'json'
-            }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
-            
-            results = []
-            if 'Web' in data:
-                for result in data['Web'][:10]:  # Get top 10 results
-                    results.append(f"{result['Title']} - {result['Url']}")
-                    
-            return "\n".join(results)
-            
+        results = await web_search.search(prompt)
     except Exception as e:
-        print(f"[error] Web search failed: {str(e)}")
+        logger.error(f"Web search failed: {e}")
         return f"Can not finish search: {str(e)}"
+    return "\n".join(f"{title} - {link}" for title, link in results)
 
   
-def upload_image_to_s3(image_url, bucket_name, s3_key, s3_endpoint=None):
-    """Upload image from URL to AWS S3 with customizable endpoint"""
-    try:
-        # Download image from ComfyUI
-        response = requests.get(image_url)
-        response.raise_for_status()
-
-        # Configure S3 client with optional custom endpoint using correct Config class
-        s3_config = boto3.session.Config(signature_version='s3v4')
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=s3_endpoint,  # Replace with your S3 server URL
-            use_ssl=True,
-            aws_access_key_id=MINIO_ACCESS_KEY,
-            aws_secret_access_key=MINIO_SECRET_KEY,
-            region_name=MINIO_region_name,
-            config=s3_config
-        )
-
-        # Check if Bucket exists (boto3 does not have a direct bucket_exists method, exceptions need to be caught)
-        try:
-            s3_client.head_bucket(Bucket=bucket_name)
-        except s3_client.exceptions.NoSuchBucket:
-            s3_client.create_bucket(Bucket=bucket_name)
-
-        # Upload to S3
-        s3_client.upload_fileobj(BytesIO(response.content), bucket_name, s3_key)
-
-        # Set Bucket Policy to public
-        policy_json = json.dumps({
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Principal": "*",
-                    "Action": "*",
-                    "Resource": f"arn:aws:s3:::image/*"
-                }
-            ]
-        })     
-
-        s3_client.put_bucket_policy(Bucket=bucket_name, Policy=policy_json)
-        # print(f"Bucket '{bucket_name}' policy set to allow public read access")
-
-        # Get file URL
-        public_url_https = f"{MINIO_URL_API}/{bucket_name}/{s3_key}"
-        # print(f"Public URL for '{s3_key}': {public_url_https}")
-
-        return public_url_https
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading file from URL: {str(e)}")        
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        raise
-
-# From server file load COMFYUI_WORKFLOW.json
-def load_comfy_workflow(workflow_path="COMFYUI_WORKFLOW.json"):
-    """Read COMFYUI_WORKFLOW.json from the specified path, supporting absolute/relative paths"""
-    try:
-        # Check if the file exists
-        if not os.path.exists(workflow_path):
-            raise FileNotFoundError(f"Workflow file not found: {workflow_path}")
-        
-        # Use absolute paths to avoid path problems
-        abs_path = os.path.abspath(workflow_path)
-        logger.info(f"Reading workflow archive: {abs_path}")
-        
-        with open(abs_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
-            
-        # Verify infrastructure
-        if not isinstance(workflow, dict):
-            raise ValueError("The JSON file format does not match the expected format (object is required)")
-            
-        return workflow
-        
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"JSON parsing failed: {e}") from e
-    except Exception as e:
-        raise RuntimeError(f"Failed to load workflow: {e}") from e
-    
-
-def generate_image_with_comfyui(prompt):
-    """Generate image using ComfyUI API and return the prompt ID."""
-    # Initial comfyUI WORKFLOW json
-    try:
-        # Load the workflow from the specified path (example: COMFYUI_WORKFLOW_PATH=custom_workflow.json)
-        workflow_path = os.getenv("COMFYUI_WORKFLOW_PATH", "COMFYUI_WORKFLOW.json")
-        COMFYUI_WORKFLOW = load_comfy_workflow(workflow_path)
-        
-    except Exception as e:
-        logger.error(f"Failed to initialize workflow: {str(e)}")
-        # Handle the error as needed
-        COMFYUI_WORKFLOW = {}  # 或 raise SystemExit()
-
-    workflow = COMFYUI_WORKFLOW.copy()
-    #set the text prompt for our positive CLIPTextEncode
-    workflow["6"]["inputs"]["text"] = prompt
+def build_comfy_workflow(prompt, workflow=None, width=None, height=None, seeds=None):
+    """ComfyUI payload for one request: the cached template with prompt text and sampler seeds set."""
+    #set the seed for our KSampler nodes
+    seed, refiner_seed = seeds or (random.randint(1, 49999), random.randint(50000, 99999))
+    params = {"prompt": prompt, "seed": seed, "refiner_seed": refiner_seed}
+    if width and height:
+        params.update(width=width, height=height)
+    return workflows.render(workflow, **params)
+
+async def generate_image_with_comfyui(prompt, user_id=None, workflow=None, seeds=None):
+    """Generate image using ComfyUI and return its first output image ({"url", "render_seconds", ...}).
+
+    Completion comes from ComfyUI's websocket progress stream; nothing here blocks
+    the event loop while the GPU works. Identical prompts in flight share one render."""
+    payload = build_comfy_workflow(prompt, workflow, seeds=seeds)
+    images = await comfyui.generate(payload, key=(workflow or "", prompt, seeds), user_id=user_id)
+    return images[0] if images else None
+
+async def get_image_url_from_comfyui(image_url, s3_key=None):
+    """Copy a ComfyUI output image to S3 and return its public URL."""
+    if not image_url:
+        return None
+    s3_key = s3_key or f"{uuid.uuid4()}.png"  # Use unique key for each upload
+    # Streamed from ComfyUI into the bucket without holding the whole image
+    return await storage.upload_from_url(image_url, s3_key)
+
+async def render_image(prompt, user_id=None, workflow=None):
+    """Render prompt with ComfyUI and return the public S3 URL of the image (None if there is none).
+
+    With IMAGE_CACHE_ENABLED the seeds follow from the prompt and workflow, so the
+    same request always gives the same image, and it is only rendered the first time."""
+    if image_cache is None:
+        with span("comfyui"):
+            image = await generate_image_with_comfyui(prompt, user_id, workflow)
+        with span("storage", "upload"):
+            return await get_image_url_from_comfyui(image and image["url"])
+
+    fingerprint = workflows.get(workflow).fingerprint
+    seeds = deterministic_seeds(prompt, fingerprint)
+    key = image_cache_key(fingerprint, prompt, seeds)
+    image_url = await image_cache.get(key)
+    if image_url:
+        return image_url
+    with span("comfyui"):
+        image = await generate_image_with_comfyui(prompt, user_id, workflow, seeds)
+    if not image:
+        return None
+    with span("storage", "upload"):
+        image_url = await get_image_url_from_comfyui(image["url"], image_cache.object_key(key))
+    await image_cache.put(key, image_url, image.get("render_seconds", 0.0))
+    return image_url
 
-    #set the seed for our KSampler node
-    workflow["10"]["inputs"]["noise_seed"] = random.randint(1, 49999)
-    workflow["11"]["inputs"]["noise_seed"] = random.randint(50000, 99999)
+# Image requests run as background jobs; the image is pushed to the user when it is ready.
+# main.py attaches the job store and the LINE push callback at startup.
+image_jobs = ImageJobRunner(render_image)
 
-    payload = {"prompt": workflow}
-    if COMFYUI_CLIENT_ID:
-        payload["client_id"] = COMFYUI_CLIENT_ID
-    try:
-        response = requests.post(f"{COMFYUI_API_URL}/prompt", json=payload)
-        response.raise_for_status()
-        data = response.json()
-        prompt_id = data.get("prompt_id")
-        return prompt_id
-    except requests.exceptions.RequestException as e:
-        return f"ComfyUI API request failed: {e}"
 
-def get_image_url_from_comfyui(prompt_id):
-    """Poll the ComfyUI API to get the generated image URL."""
-    if not prompt_id:
-        return None
-    history_url = f"{COMFYUI_API_URL}/history/{prompt_id}"
-    for _ in range(30):
-        try:
-            response = requests.get(history_url)
-            response.raise_for_status()
-            data = response.json()
-            if prompt_id in data:
-                outputs = data[prompt_id]["outputs"]
-                for node_output in outputs.values():
-                    for image in node_output["images"]:
-                        filename = image["filename"]
-                        subfolder = image["subfolder"]
-                        image_url = f"{COMFYUI_API_URL}/view?filename={filename}&subfolder={subfolder}&type=output"
-                        #return image_url
-                        s3_bucket = MINIO_BUCKET
-                        s3_key = f"{uuid.uuid4()}.png"  # Use unique key for each upload
-                        custom_s3_endpoint = MINIO_URL_API
-                        
-                        return upload_image_to_s3(
-                            image_url, 
-                            s3_bucket, 
-                            s3_key,
-                            s3_endpoint=custom_s3_endpoint
-                        )
-
-                break
-        except requests.exceptions.RequestException as e:
-            return f"ComfyUI History API request failed: {e}"
-        import time
-        time.sleep(2)
-    return "Image generation timed out or failed. "
-
-
-@function_tool
-async def generate_image_and_get_url(wrapper: RunContextWrapper[UserInfo], prompt: str ) -> str: 
+# Not time limited here: the ComfyUI and job layers have their own timeouts
+@tool(timeout=None)
+async def generate_image_and_get_url(wrapper: RunContextWrapper[UserInfo], prompt: str, workflow: str = "") -> str: 
     """    Generate an image based on the provided prompt and return its URL.
         Args:
             prompt: This refers to a message or instruction displayed to the user 
-            reply_token: It is a unique identifier used by Line Bot to correctly respond to user messages.
+            workflow: Name of the ComfyUI workflow to use; leave empty for the default one.
 
     """
-    print(f"[debug] reply_token: {wrapper.context.uid}")
+    logger.debug("reply_token: %s", wrapper.context.uid)
 
     image_prompt = "if you decide to use the generate_image_and_get_url(), translate the prompt to englist first. please add prompt masterpiece, best quality, ultra-detailed, 8K, RAW photo, intricate details, stunning visuals,upper-body," \
             "cinematic lighting, soft focus,(white background:1.05)realistic,photorealistic,masterpiece,best quality,newest,highres,absurdres,photo," \
             "cosplay photo,photo (medium), dslr, real life, real life insert, real world location, photo background." 
     prompt += image_prompt
-    prompt_id = generate_image_with_comfyui(prompt)
+    try:
+        workflows.get(workflow or None)
+    except WorkflowError as e:
+        return str(e)
+    if image_jobs.started and wrapper.context.user_id:
+        try:
+            await image_jobs.submit(wrapper.context.user_id, prompt, workflow or None)
+        except ImageJobLimitError:
+            return "The user already has images being generated. Ask them to wait for those to arrive before requesting another one."
+        return "Image generation has started. The image will be sent to the user as a separate message when it is ready " \
+            "(usually within a minute). Tell the user it is being generated; do not include any image URL."
 
-    if isinstance(prompt_id, str) and prompt_id.startswith("ComfyUI API request error"):
-        return prompt_id
-    image_url = get_image_url_from_comfyui(prompt_id)
+    try:
+        image_url = await render_image(prompt, wrapper.context.user_id or None, workflow or None)
+    except ComfyUITimeout:
+        return "Image generation timed out or failed. "
+    except Exception as e:
+        return f"ComfyUI API request failed: {e}"
+    if not image_url:
+        return "Image generation timed out or failed. "
     return image_url
 
 
-@function_tool
+@tool
 async def get_weather(city: str):
     """Get weather information for a city using OpenWeatherMap API"""
-    print(f"[debug] getting weather for {city}")
-
-    # Base URLs for current and forecast data
-    base_url_current = "https://api.openweathermap.org/data/2.5/weather"
-    base_url_forecast = "https://api.openweathermap.org/data/2.5/forecast"
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            # Prepare parameters
-            params = {
-                'q': city,
-                'appid': OPENWEATHERMAP_API_KEY,
-                'units': 'metric',  # Metric units (Celsius)
-            }
-            
-            # Fetch current weather
-            async with session.get(base_url_current, params=params) as response:
-                if response.status == 200:
-                    current_weather_data = await response.json()
-                    current_weather = (
-                        f"Current weather in {city}: "
-                        f"{current_weather_data['weather'][0]['description']}, "
-                        f"Temperature: {current_weather_data['main']['temp']}°C"
-                    )
-                else:
-                    return f"Error fetching current weather: {response.status}"
-
-            # Fetch 5-day forecast
-            async with session.get(base_url_forecast, params=params) as response:
-                if response.status == 200:
-                    forecast_data = await response.json()
-                    
-                    # Process today's time-specific weather
-                    today_weather = []
-                    today_date = datetime.now().date()
-                    
-                    for item in forecast_data['list']:
-                        dt = datetime.strptime(item['dt_txt'], "%Y-%m-%d %H:%M:%S")
-                        
-                        # Check if this is today's weather
-                        if dt.date() == today_date:
-                            time_of_day = "Morning" if 6 <= dt.hour < 12 else \
-                                         "Afternoon" if 12 <= dt.hour < 18 else \
-                                         "Evening"
-                            
-                            today_weather.append({
-                                'time': f"{dt.strftime('%H:%M')}",
-                                'description': item['weather'][0]['description'],
-                                'temperature': item['main']['temp']
-                            })
-                    
-                    # Format today's time-specific weather
-                    today_summary = "Today's Weather by Time:\n" + "\n".join(
-                        f"{w['time']}: {w['description']}, {w['temperature']}°C"
-                        for w in today_weather
-                    )
-                    
-
-                    # Process 5-day forecast for high/low temps and weather
-                    daily_temps = {}
-                    for item in forecast_data['list']:
-                        dt = datetime.strptime(item['dt_txt'], "%Y-%m-%d %H:%M:%S")
-                        date_str = dt.strftime("%Y-%m-%d")
-                        temp = item['main']['temp']
-                        weather_desc = item['weather'][0]['description']
-
-                        if date_str not in daily_temps:
-                            daily_temps[date_str] = {
-                                'temps': [temp],
-                                'weather': weather_desc  # Store the first weather description for the day
-                            }
-                        else:
-                            daily_temps[date_str]['temps'].append(temp)
-                    
-                    # Sort dates and take first 5
-                    sorted_dates = sorted(daily_temps.keys())
-                    forecast_days = []
-                    for date in sorted_dates[:5]:
-                        data = daily_temps[date]
-                        max_temp = max(data['temps'])
-                        min_temp = min(data['temps'])
-                        forecast_days.append({
-                            'date': date,
-                            'high': max_temp,
-                            'low': min_temp,
-                            'weather': data['weather']
-                        })
-                    
-                    # Format the forecast summary with high/low info and weather
-                    forecast_summary = "5-day forecast:\n" + "\n".join(
-                        f"{day['date']}: High {day['high']}°C, Low {day['low']}°C, Weather: {day['weather']}"
-                        for day in forecast_days
-                    )
-                else:
-                    return f"Error fetching 5-day forecast: {response.status}"
-            
-            # Combine results with new time-specific weather
-            result = current_weather + "\n\n" + today_summary + "\n\n" + forecast_summary
-            print(f"[debug] got weather info for {city}")
-            return result
-        
-        except Exception as e:
-            return f"Error retrieving weather data: {str(e)}"
+    logger.debug("getting weather for %s", city)
+    try:
+        result = await weather.report(city)
+    except WeatherError as e:
+        return str(e)
+    except Exception as e:
+        return f"Error retrieving weather data: {str(e)}"
+    logger.debug("got weather info for %s", city)
+    return result
     
-@function_tool
+@tool
 def translate_to_english(text: str):
     """Translate text to English"""
-    print(f"[debug] translating to English: {text}")
+    logger.debug("translating to English: %s", text)
     # This is a placeholder for actual translation logic.
     # You might use an external service or library here.
     return f"Translating to English: {text}"
 
-@function_tool
+@tool
 def translate_to_chinese(text: str):
     """Translate text to Traditional Chinese"""
-    print(f"[debug] translating: {text}")
+    logger.debug("translating: %s", text)
     # This is a placeholder for actual translation logic.
     # You might use an external service or library here.    
     return f"Translating to Chinese: {text}"
 
-@function_tool
+@tool
 def translate_to_Japanese(text: str):
     """Translate text to Japanese"""
-    print(f"[debug] translating to Japanese: {text}")
+    logger.debug("translating to Japanese: %s", text)
     # This is a placeholder for actual translation logic.
     # You might use an external service or library here.    
     return f"Translating to Japanese: {text}"
 
-@function_tool
+@tool
 def translate_to_Korean(text: str):
     """Translate text to Korean"""
-    print(f"[debug] translating to Korean: {text}")
+    logger.debug("translating to Korean: %s", text)
     # This is a placeholder for actual translation logic.
     # You might use an external service or library here.    
     return f"Translating to Korean: {text}"    
\ No newline at end of file
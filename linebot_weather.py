@@ -0,0 +1,137 @@
+#linebot_weather.py
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import aiohttp
+from linebot_cache import TTLCache, normalize_question
+from linebot_metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# OpenWeatherMap refreshes its data about every 10 minutes, so asking more often returns the same numbers
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL") or "600")  # seconds
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE") or "256")
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT") or "10")
+
+OPENWEATHERMAP_API_URL = (os.getenv("OPENWEATHERMAP_API_URL") or "https://api.openweathermap.org").rstrip("/")
+CURRENT_WEATHER_URL = f"{OPENWEATHERMAP_API_URL}/data/2.5/weather"
+FORECAST_URL = f"{OPENWEATHERMAP_API_URL}/data/2.5/forecast"
+
+
+class WeatherError(RuntimeError):
+    """OpenWeatherMap answered with an error; the message is shown to the model as is."""
+
+
+def format_weather(city, current, forecast, now=None):
+    """Current weather, today's 3-hourly forecast and a 5-day high/low summary as text.
+
+    Forecast entries are grouped by date in the city's own timezone, in one pass
+    over their `dt` timestamps.
+    """
+    tz = timezone(timedelta(seconds=forecast.get("city", {}).get("timezone", current.get("timezone", 0))))
+    today = (now or datetime.now(tz)).astimezone(tz).date()
+    today_weather = []
+    daily = {}  # date -> [high, low, first description]; entries arrive in time order
+    for item in forecast["list"]:
+        local = datetime.fromtimestamp(item["dt"], tz)
+        temp = item["main"]["temp"]
+        description = item["weather"][0]["description"]
+        if local.date() == today:
+            today_weather.append(f"{local:%H:%M}: {description}, {temp}°C")
+        day = daily.get(local.date())
+        if day is None:
+            daily[local.date()] = [temp, temp, description]
+        else:
+            day[0] = max(day[0], temp)
+            day[1] = min(day[1], temp)
+
+    current_weather = (
+        f"Current weather in {city}: "
+        f"{current['weather'][0]['description']}, "
+        f"Temperature: {current['main']['temp']}°C"
+    )
+    today_summary = "Today's Weather by Time:\n" + "\n".join(today_weather)
+    forecast_summary = "5-day forecast:\n" + "\n".join(
+        f"{date:%Y-%m-%d}: High {high}°C, Low {low}°C, Weather: {description}"
+        for date, (high, low, description) in islice(daily.items(), 5)
+    )
+    return current_weather + "\n\n" + today_summary + "\n\n" + forecast_summary
+
+
+class WeatherClient:
+    """OpenWeatherMap current weather + 5-day forecast over one shared aiohttp session.
+
+    Both endpoints are fetched concurrently. Responses are cached per normalised
+    city name for `ttl` seconds, and concurrent lookups of the same city share one
+    fetch. Errors are not cached.
+    """
+
+    def __init__(self, api_key, ttl=WEATHER_CACHE_TTL, cache_size=WEATHER_CACHE_SIZE, timeout=WEATHER_TIMEOUT,
+                 session=None):
+        self.api_key = api_key
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)  # city -> (current, forecast)
+        self._session = session
+        self._owns_session = session is None
+        self._pending = {}  # city -> task fetching it
+        self.fetch_time = LatencyRecorder()
+        self.failures = 0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def report(self, city):
+        """Weather report text for city; raises WeatherError when OpenWeatherMap refuses."""
+        key = normalize_question(city) or city.strip()
+        data = self.cache.get(key)
+        if data is None:
+            task = self._pending.get(key)
+            if task is None:
+                task = asyncio.create_task(self._fetch(city))
+                self._pending[key] = task
+                task.add_done_callback(lambda _: self._pending.pop(key, None))
+            data = await asyncio.shield(task)
+            self.cache.set(key, data)
+        return format_weather(city, *data)
+
+    async def _fetch(self, city):
+        params = {
+            "q": city,
+            "appid": self.api_key,
+            "units": "metric",  # Metric units (Celsius)
+        }
+        started = time.monotonic()
+        try:
+            return await asyncio.gather(
+                self._get_json(CURRENT_WEATHER_URL, params, "current weather"),
+                self._get_json(FORECAST_URL, params, "5-day forecast"),
+            )
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.fetch_time.record(time.monotonic() - started)
+
+    async def _get_json(self, url, params, what):
+        async with self._get_session().get(url, params=params, timeout=self.timeout) as response:
+            if response.status != 200:
+                raise WeatherError(f"Error fetching {what}: {response.status}")
+            return await response.json()
+
+    def stats(self):
+        return {
+            "cache": self.cache.stats(),
+            "failures": self.failures,
+            "fetch": self.fetch_time.stats(),
+        }
@@ -0,0 +1,179 @@
+#linebot_workflow.py
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Workflow template configuration
+COMFYUI_WORKFLOW_PATH = os.getenv("COMFYUI_WORKFLOW_PATH") or "data/COMFYUI_WORKFLOW.json"
+COMFYUI_WORKFLOWS = os.getenv("COMFYUI_WORKFLOWS") or ""  # extra named workflows: "name=path,name=path"
+COMFYUI_WORKFLOW_RELOAD_INTERVAL = float(os.getenv("COMFYUI_WORKFLOW_RELOAD_INTERVAL") or "5")  # seconds
+DEFAULT_WORKFLOW = "default"
+
+# Request parameter -> the (node id, input name) pairs it is written to
+DEFAULT_BINDINGS = {
+    "prompt": [("6", "text")],  # positive CLIPTextEncode
+    "seed": [("10", "noise_seed")],  # base KSampler
+    "refiner_seed": [("11", "noise_seed")],  # refiner KSampler
+    "width": [("5", "width")],  # EmptyLatentImage
+    "height": [("5", "height")],
+}
+# A template missing any of these is rejected; the others are only offered when present
+REQUIRED_PARAMETERS = ("prompt", "seed", "refiner_seed")
+
+
+class WorkflowError(ValueError):
+    """A workflow template is missing, malformed or lacks a node it needs."""
+
+
+class WorkflowTemplate:
+    """A ComfyUI API-format workflow, parsed and validated once.
+
+    `render(**params)` returns a request payload that shares every node with the
+    template except the ones a parameter is written to; those nodes and their
+    `inputs` are copied first. The template itself is never modified, so payloads
+    must be treated as read-only beyond the injected values.
+    """
+
+    def __init__(self, name, workflow, bindings=DEFAULT_BINDINGS, required=REQUIRED_PARAMETERS,
+                 path=None, mtime=None):
+        if not isinstance(workflow, dict) or not workflow:
+            raise WorkflowError(f"Workflow {name}: expected a non-empty JSON object of nodes")
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.workflow = workflow
+        # Identifies the template's content, e.g. for caching what it renders
+        self.fingerprint = hashlib.sha256(json.dumps(workflow, sort_keys=True).encode()).hexdigest()
+        self.bindings = {}
+        for parameter, targets in bindings.items():
+            missing = [
+                f"{node_id}.inputs.{input_name}" for node_id, input_name in targets
+                if input_name not in ((workflow.get(node_id) or {}).get("inputs") or {})
+            ]
+            if not missing:
+                self.bindings[parameter] = tuple(targets)
+            elif parameter in required:
+                raise WorkflowError(f"Workflow {name}: {parameter} needs {', '.join(missing)}")
+            else:
+                logger.info(f"Workflow {name} does not support {parameter} (no {', '.join(missing)})")
+
+    @classmethod
+    def load(cls, name, path, **kwargs):
+        """Read and validate a template from a JSON file."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with open(path, "r", encoding="utf-8") as f:
+                workflow = json.load(f)
+        except FileNotFoundError:
+            raise WorkflowError(f"Workflow file not found: {os.path.abspath(path)}") from None
+        except (OSError, ValueError) as e:
+            raise WorkflowError(f"Failed to load workflow {name} from {path}: {e}") from e
+        return cls(name, workflow, path=path, mtime=mtime, **kwargs)
+
+    @property
+    def parameters(self):
+        return tuple(self.bindings)
+
+    def render(self, **params):
+        """Payload for one request, e.g. render(prompt="a cat", seed=1, refiner_seed=2)."""
+        unknown = [parameter for parameter in params if parameter not in self.bindings]
+        if unknown:
+            raise WorkflowError(f"Workflow {self.name} does not support {', '.join(unknown)}")
+        payload = dict(self.workflow)
+        copied = set()
+        for parameter, value in params.items():
+            for node_id, input_name in self.bindings[parameter]:
+                if node_id not in copied:
+                    node = payload[node_id]
+                    payload[node_id] = dict(node, inputs=dict(node["inputs"]))
+                    copied.add(node_id)
+                payload[node_id]["inputs"][input_name] = value
+        return payload
+
+
+class WorkflowLibrary:
+    """Named workflow templates, each reloaded when its file changes.
+
+    File modification times are checked at most every `reload_interval` seconds.
+    A file that fails to load or validate is logged and the previous version of the
+    template stays in use.
+    """
+
+    def __init__(self, paths, reload_interval=COMFYUI_WORKFLOW_RELOAD_INTERVAL, **template_kwargs):
+        self.paths = dict(paths)  # name -> path
+        self.reload_interval = reload_interval
+        self._template_kwargs = template_kwargs
+        self._templates = {}
+        self._checked_at = {}
+        self.reloads = 0
+        self.reload_failures = 0
+
+    @classmethod
+    def from_env(cls):
+        """The COMFYUI_WORKFLOW_PATH template as "default" plus the COMFYUI_WORKFLOWS entries."""
+        paths = {DEFAULT_WORKFLOW: COMFYUI_WORKFLOW_PATH}
+        for entry in COMFYUI_WORKFLOWS.split(","):
+            name, sep, path = entry.partition("=")
+            if sep and name.strip() and path.strip():
+                paths[name.strip()] = path.strip()
+        return cls(paths)
+
+    @property
+    def names(self):
+        return tuple(self.paths)
+
+    def load(self):
+        """Load every template now; returns {name: error} for those that failed."""
+        errors = {}
+        for name in self.paths:
+            try:
+                self._load(name)
+            except WorkflowError as e:
+                logger.error(str(e))
+                errors[name] = str(e)
+        return errors
+
+    def _load(self, name):
+        template = WorkflowTemplate.load(name, self.paths[name], **self._template_kwargs)
+        self._templates[name] = template
+        self._checked_at[name] = time.monotonic()
+        logger.info(f"Loaded workflow {name} from {os.path.abspath(template.path)} ({', '.join(template.parameters)})")
+        return template
+
+    def get(self, name=None):
+        """The current template called name (the default one for None)."""
+        name = name or DEFAULT_WORKFLOW
+        if name not in self.paths:
+            raise WorkflowError(f"Unknown workflow {name}; available: {', '.join(self.paths)}")
+        template = self._templates.get(name)
+        if template is None:
+            return self._load(name)
+        if time.monotonic() - self._checked_at[name] >= self.reload_interval:
+            self._checked_at[name] = time.monotonic()
+            template = self._reload_if_changed(name, template)
+        return template
+
+    def _reload_if_changed(self, name, template):
+        try:
+            if os.stat(template.path).st_mtime_ns == template.mtime:
+                return template
+            template = self._load(name)
+            self.reloads += 1
+        except (OSError, WorkflowError) as e:
+            self.reload_failures += 1
+            logger.error(f"Reloading workflow {name} failed, keeping the previous version: {e}")
+        return template
+
+    def render(self, name=None, **params):
+        return self.get(name).render(**params)
+
+    def stats(self):
+        return {
+            "loaded": len(self._templates),
+            "reloads": self.reloads,
+            "reload_failures": self.reload_failures,
+        }
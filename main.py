@@ -1,10 +1,14 @@
 import os
-import json
+import asyncio
+import inspect
+import logging
+import time
 import aiohttp
-import redis
-import tiktoken
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import Request, FastAPI, HTTPException
-from linebot_agent import generate_text_with_agent
+from fastapi.responses import PlainTextResponse
+from linebot_agent import generate_text_with_agent, summarize_conversation, check_config as check_agent_config
+from linebot_agent import start_agent, stop_agent, agent_stats, llm, GOOGLE_MAPS_MCP, AGENT_ERROR_MESSAGE
 from linebot.models import (
     MessageEvent, TextSendMessage, ImageSendMessage
 )
@@ -15,54 +19,244 @@ from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient
 from linebot import (
     AsyncLineBotApi, WebhookParser
 )
-from linebot_tools import MINIO_URL_API
-import re  # New import for URL pattern matching
+from linebot_tools import comfyui, image_jobs, workflows, storage, image_cache, web_search, web_scraper, weather, tool_executor, tool_stats
+from linebot_storage import MINIO_URL_API
+from linebot_queue import EventQueue
+from linebot_reply import StreamingReply, reply_stats
+from linebot_cache import ResponseCache, RESPONSE_CACHE_ENABLED
+from linebot_metrics import register_stats, collect_stats, render_metrics, span, request_trace
+from linebot_store import create_conversation_store
+from linebot_jobs import create_image_job_store, FAILED
+from linebot_imagecache import create_image_cache_index
+from linebot_dedup import WebhookDeduplicator, create_event_claims, WEBHOOK_DEDUP_ENABLED
+from linebot_history import get_tokenizer, preload_tokenizer, count_tokens, truncate_to_tokens, trim_to_budget, build_prompt
+from linebot_history import ConversationSummarizer, LINE_CHAT_SUMMARY_ENABLED, TOKENIZER_PRELOAD
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
 
 # LINE Bot configuration
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET', None)
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', None)
-LINE_CHAT_HISTORY_LENGTH = os.getenv("LINE_CHAT_HISTORY_LENGTH") or "41"
-
-# REDIS SERVER configuration
-REDIS_HOST_ADDRESS = os.getenv("REDIS_HOST_ADDRESS") or ""
-REDIS_HOST_PORT = os.getenv("REDIS_HOST_PORT") or ""
-REDIS_HOST_PASS = os.getenv("REDIS_HOST_PASS") or ""
-
-# Validate environment variables
-
-if not LINE_CHANNEL_SECRET :
-    raise ValueError(
-        "Please set LINE_CHANNEL_SECRET via env var or code."
-    )
-if not LINE_CHANNEL_ACCESS_TOKEN :
-    raise ValueError(
-        "Please set LINE_CHANNEL_ACCESS_TOKEN via env var or code."
-    )
-
-if not REDIS_HOST_ADDRESS or not REDIS_HOST_PORT :
-    raise ValueError(
-        "Please set REDIS_HOST_ADDRESS, REDIS_HOST_PORT via env var or code."
-    )
-
-# Initialize the Redis connection pool
-redis_pool = redis.ConnectionPool(
-    host=os.getenv("REDIS_HOST", REDIS_HOST_ADDRESS),
-    port=int(os.getenv("REDIS_PORT", REDIS_HOST_PORT)),
-    db=int(os.getenv("REDIS_DB", "0")),
-    password=os.getenv("REDIS_PASSWORD", REDIS_HOST_PASS),
-)
-redis_client = redis.Redis(connection_pool=redis_pool)
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT") or "https://api.line.me"  # e.g. a local stand-in for load tests
+
+# Webhook event queue configuration
+LINE_EVENT_WORKERS = int(os.getenv("LINE_EVENT_WORKERS") or "8")
+LINE_EVENT_QUEUE_SIZE = int(os.getenv("LINE_EVENT_QUEUE_SIZE") or "1000")
+LINE_EVENT_DRAIN_TIMEOUT = float(os.getenv("LINE_EVENT_DRAIN_TIMEOUT") or "30")
+
+MAX_TOKENS = 4096  # Longest user message / reply in tokens, adjust this value as needed
+
+SYSTEM_PROMPT = "You are a helpful assistant that responds in Traditional Chinese (zh-TW) or english. Provide informative and helpful responses. if you descide to use th eget_weather () function, please translate the city name to english. Please refer to the conversation history to provide a coherent and natural response."
+
+
+def check_config():
+    """Validate environment variables; called at startup, so main can be imported without them."""
+    if not LINE_CHANNEL_SECRET :
+        raise ValueError(
+            "Please set LINE_CHANNEL_SECRET via env var or code."
+        )
+    if not LINE_CHANNEL_ACCESS_TOKEN :
+        raise ValueError(
+            "Please set LINE_CHANNEL_ACCESS_TOKEN via env var or code."
+        )
+    check_agent_config()
+
+
+# Optional cache of answers to repeated questions, in front of the agent
+def is_cacheable_response(response):
+    return not response.startswith(AGENT_ERROR_MESSAGE) and not (MINIO_URL_API and MINIO_URL_API in response)
+
+
+class Resources:
+    """Everything the app opens: the LINE client, stores, queues and background warm-ups.
+
+    `start()` builds them inside the lifespan and registers how each one is shut
+    down; `close()` runs those steps in reverse order, logging a failing step
+    instead of skipping the rest. Nothing is opened at import, so main can be
+    imported without a running event loop, Redis or credentials.
+
+    Slow preparation (tokenizer, LLM client, S3 bucket, MCP servers) runs in the
+    background; `ready` turns true once what the first reply needs is loaded.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.line_bot_api = None
+        self.parser = None
+        self.conversation_store = None
+        self.summarizer = None
+        self.response_cache = None
+        self.generate_reply = generate_text_with_agent
+        self.dedup = None
+        self.event_queue = None
+        self._stack = None
+        self._warm_ups = []
+        self._needed = []  # warm-ups `ready` waits for
+
+    def _on_close(self, close, *args, **kwargs):
+        async def run():
+            try:
+                result = close(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Shutdown step {getattr(close, '__qualname__', close)} failed: {e!r}")
+        self._stack.push_async_callback(run)
+
+    def _warm_up(self, coro, name, needed=True):
+        """Run coro in the background; the app serves meanwhile."""
+        task = asyncio.create_task(coro, name=name)
+        task.add_done_callback(_log_warm_up_failure)
+        self._warm_ups.append(task)
+        if needed:
+            self._needed.append(task)
+
+    @property
+    def ready(self):
+        return self.event_queue is not None and all(task.done() for task in self._needed)
+
+    async def _cancel_warm_ups(self):
+        for task in self._warm_ups:
+            task.cancel()
+        await asyncio.gather(*self._warm_ups, return_exceptions=True)
+        self._warm_ups = []
+        self._needed = []
+
+    async def start(self):
+        self._stack = AsyncExitStack()
+        try:
+            await self._start()
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _start(self):
+        # Conversation history store (Redis unless CONVERSATION_STORE=memory); connects on first use
+        self.conversation_store = create_conversation_store()
+        self._on_close(self.conversation_store.close)
+        self.session = aiohttp.ClientSession()
+        self._on_close(self.session.close)
+        self.line_bot_api = AsyncLineBotApi(LINE_CHANNEL_ACCESS_TOKEN, AiohttpAsyncHttpClient(self.session),
+                                            endpoint=LINE_API_ENDPOINT)
+        self.parser = WebhookParser(LINE_CHANNEL_SECRET)
+
+        # The tools' clients open their sessions on first use
+        self._on_close(storage.close)
+        self._on_close(tool_executor.shutdown, wait=False, cancel_futures=True)
+        self._on_close(weather.close)
+        self._on_close(web_scraper.close)
+        self._on_close(web_search.close)
+        self._on_close(comfyui.close)
+        # S3 client and bucket policy; a failure here is retried on the first upload
+        self._warm_up(_start_storage(), "start-storage")
+        if TOKENIZER_PRELOAD == "startup":
+            await asyncio.to_thread(get_tokenizer)
+        elif TOKENIZER_PRELOAD == "background":
+            self._warm_up(preload_tokenizer(), "preload-tokenizer")
+        # Parse and validate the ComfyUI workflow templates once; failures are logged
+        workflows.load()
+
+        if image_cache:
+            image_cache.start(create_image_cache_index(self.conversation_store))
+            self._on_close(image_cache.close)
+        # Also restarts image jobs an earlier worker did not finish
+        await image_jobs.start(create_image_job_store(self.conversation_store), deliver_image_job)
+        # Unfinished image jobs stay in Redis and are resumed by the next worker
+        self._on_close(image_jobs.close, LINE_EVENT_DRAIN_TIMEOUT)
+        # MCP servers connect in the background; replies go without map lookups until then
+        self._on_close(stop_agent)
+        self._warm_up(start_agent(), "start-agent", needed=False)
+        self._warm_up(asyncio.to_thread(llm.prepare), "prepare-llm")
+
+        # Optional rolling summary of the turns that no longer fit the prompt window
+        if LINE_CHAT_SUMMARY_ENABLED:
+            self.summarizer = ConversationSummarizer(self.conversation_store, summarize_conversation)
+            self._on_close(self.summarizer.close, LINE_EVENT_DRAIN_TIMEOUT)
+        if RESPONSE_CACHE_ENABLED:
+            self.response_cache = ResponseCache()
+            self.generate_reply = self.response_cache.wrap(generate_text_with_agent,
+                                                           should_cache=is_cacheable_response)
+        # Drops LINE redeliveries of events already being handled, here or on another replica
+        if WEBHOOK_DEDUP_ENABLED:
+            self.dedup = WebhookDeduplicator()
+            self.dedup.start(create_event_claims(self.conversation_store))
+
+        self.event_queue = EventQueue(process_event, workers=LINE_EVENT_WORKERS, maxsize=LINE_EVENT_QUEUE_SIZE)
+        self.event_queue.start()
+        # Let the workers finish what LINE has already been told is accepted
+        self._on_close(self.event_queue.drain, LINE_EVENT_DRAIN_TIMEOUT)
+        self._on_close(self._cancel_warm_ups)
+        self._register_stats()
+
+    async def close(self):
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack = None
+
+    def _register_stats(self):
+        register_stats("event_queue", self.event_queue.stats)
+        register_stats("mcp", GOOGLE_MAPS_MCP.stats)
+        register_stats("llm", agent_stats)
+        register_stats("llm_backends", llm.stats)
+        register_stats("line_reply", reply_stats)
+        register_stats("comfyui", comfyui.stats)
+        register_stats("image_jobs", image_jobs.stats)
+        register_stats("workflows", workflows.stats)
+        register_stats("storage", storage.stats)
+        register_stats("web_search", web_search.stats)
+        register_stats("web_scraper", web_scraper.stats)
+        register_stats("weather", weather.stats)
+        register_stats("tools", tool_stats)
+        if self.summarizer:
+            register_stats("summarizer", self.summarizer.stats)
+        if self.response_cache:
+            register_stats("response_cache", self.response_cache.stats)
+        if image_cache:
+            register_stats("image_cache", image_cache.stats)
+        if self.dedup:
+            register_stats("webhook_dedup", self.dedup.stats)
+
+
+async def _start_storage():
+    try:
+        await storage.start()
+    except Exception as e:
+        # Retried on the first upload
+        logger.error(f"Setting up image storage failed: {e}")
+
+
+def _log_warm_up_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Warm-up {task.get_name()} failed: {task.exception()!r}")
+
+
+resources = Resources()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging.basicConfig(level=LOG_LEVEL)
+    check_config()
+    started = time.monotonic()
+    await resources.start()
+    logger.info(f"Ready to serve after {time.monotonic() - started:.2f}s of startup")
+    try:
+        yield
+    finally:
+        await resources.close()
 
-# Initialize the FastAPI app for LINEBot
-app = FastAPI()
-session = aiohttp.ClientSession()
-async_http_client = AiohttpAsyncHttpClient(session)
-line_bot_api = AsyncLineBotApi(LINE_CHANNEL_ACCESS_TOKEN, async_http_client)
-parser = WebhookParser(LINE_CHANNEL_SECRET)
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/webhook")
 async def handle_callback(request: Request):
+    with span("webhook"):
+        return await _handle_callback(request)
+
+
+async def _handle_callback(request: Request):
     signature = request.headers['X-Line-Signature']
 
     # get request body as text
@@ -70,121 +264,129 @@ async def handle_callback(request: Request):
     body = body.decode()
 
     try:
-        events = parser.parse(body, signature)
+        events = resources.parser.parse(body, signature)
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    for event in events:
-        if not isinstance(event, MessageEvent):
-            continue
-
-        user_id = event.source.user_id
-        # print(f"[debug] Get user_ide: {user_id}")
-        msg = event.message.text.strip()
-        # Processing "clear" commands
-        if msg == "清除" or msg == "clear" or msg == "reset" or msg == "Reset" or msg == "RESET" or msg == "CLEAR" or msg == "Clear" or msg == "/reset":
-            #print(f"[debug] User requested to clear chat history") 
-            redis_client.delete(get_conversation_key(user_id))
-            await line_bot_api.reply_message(
+    events = [event for event in events if isinstance(event, MessageEvent)]
+    # A slow answer makes LINE deliver the same events again; only the first delivery is processed
+    if resources.dedup and events:
+        with span("redis", "dedup"):
+            events = await resources.dedup.claim(events)
+
+    # Acknowledge right away; the workers generate and send the replies
+    batch = [(event.source.user_id, event) for event in events]
+    if batch and not resources.event_queue.put_batch(batch):
+        # Let LINE's retry of this delivery through
+        if resources.dedup:
+            await resources.dedup.release(events)
+        raise HTTPException(status_code=503, detail="Event queue is full")
+
+    return 'OK'
+
+
+@app.get("/ready")
+async def ready():
+    """200 once startup warm-ups are done, 503 before; point load balancers and health checks here."""
+    if not resources.ready:
+        raise HTTPException(status_code=503, detail="Starting")
+    return {"ready": True}
+
+
+@app.get("/stats")
+async def stats():
+    return collect_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage latency histograms, in-flight gauges, error counters and /stats numbers for Prometheus."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+async def process_event(event: MessageEvent):
+    """Generate and send the reply for a single message event."""
+    try:
+        async with request_trace(f"event {event.reply_token}"):
+            with span("event"):
+                await _process_event(event)
+    finally:
+        if resources.dedup:
+            await resources.dedup.done(event)
+
+
+async def _process_event(event: MessageEvent):
+    user_id = event.source.user_id
+    # print(f"[debug] Get user_ide: {user_id}")
+    msg = event.message.text.strip()
+    # Processing "clear" commands
+    if msg == "清除" or msg == "clear" or msg == "reset" or msg == "Reset" or msg == "RESET" or msg == "CLEAR" or msg == "Clear" or msg == "/reset":
+        #print(f"[debug] User requested to clear chat history") 
+        with span("redis", "clear"):
+            await resources.conversation_store.clear(user_id)
+        with span("line_reply"):
+            await resources.line_bot_api.reply_message(
                 event.reply_token,
                 TextSendMessage(text="Clear conversation history!")
             )
-            continue
-
-        # Get the conversation history (initialize if it does not exist)
-        history_str = redis_client.get(get_conversation_key(user_id))
-        #print(f"[debug] Get chat history from redis database: {history_str}")
-        if not history_str:
-            initial_history = [{"role": "system", "content": "You are a helpful assistant that responds in Traditional Chinese (zh-TW) or english. Provide informative and helpful responses. if you descide to use th eget_weather () function, please translate the city name to english. Please refer to the conversation history to provide a coherent and natural response."}]
-            redis_client.setex(get_conversation_key(user_id), 86400, json.dumps(initial_history))  # Automatically delete after 1 day
-            #print(f"[debug] No chat history found, initializing with system prompt")
-            history = initial_history
-        else:
-            history = json.loads(history_str)
-            #print(f"[debug-true] Get chat history from redis database: {history_str}")
-
-        # Limit to max XX messages if needed
-        if len(history) > int(LINE_CHAT_HISTORY_LENGTH):
-            history = history[-int(LINE_CHAT_HISTORY_LENGTH):]
-
-        # Initialize tokenizer
-        tokenizer = tiktoken.get_encoding("cl100k_base")
-        MAX_TOKENS = 4096  # Adjust this value as needed
-
-        # Check user message token count
-        user_msg_tokens = len(tokenizer.encode(msg))
-        if user_msg_tokens > MAX_TOKENS:
-            await line_bot_api.reply_message(
+        return
+
+    # Get the conversation history (the store keeps at most LINE_CHAT_HISTORY_LENGTH messages)
+    with span("redis", "load"):
+        history, summary = await resources.conversation_store.load(user_id)
+    #print(f"[debug] Get chat history from redis database: {history}")
+
+    # Check user message token count
+    user_msg_tokens = count_tokens(msg)
+    if user_msg_tokens > MAX_TOKENS:
+        with span("line_reply"):
+            await resources.line_bot_api.reply_message(
                 event.reply_token,
                 TextSendMessage(text=f"Prompt too long ({user_msg_tokens} tokens > {MAX_TOKENS} tokens). Please simplify the prompt.")
             )
-            return "OK"
-
-
-        # Add user message to history
-        history.append({"role": "user", "content": msg})
-        # history.append({"role": "user", "content": f'reply_token='+event.reply_token})
-        print(f"[debug] main.py reply_token: {event.reply_token}")
-        if len(history) > int(LINE_CHAT_HISTORY_LENGTH):
-            history = history[-int(LINE_CHAT_HISTORY_LENGTH):]
-
-        # Add user messages to history
-        # Generate response
-        response = await generate_text_with_agent(history, event.reply_token)
-
-        # Check response token count
-        response_tokens = len(tokenizer.encode(response))
-        if response_tokens > MAX_TOKENS:
-            # Truncate to MAX_TOKENS tokens
-            truncated_response = tokenizer.decode(
-                tokenizer.encode(response)[:MAX_TOKENS]
-            )
-            response = truncated_response
+        return
 
-        reply_msg = TextSendMessage(text=response)
 
-        # Update history (set TTL)
-        history.append({"role": "assistant", "content": response})
-        if len(history) > int(LINE_CHAT_HISTORY_LENGTH):
-            history = history[-int(LINE_CHAT_HISTORY_LENGTH):]
+    # Add user message to history, keeping only the newest messages that fit the token budget
+    user_message = {"role": "user", "content": msg, "tokens": user_msg_tokens}
+    if resources.summarizer:
+        # Older messages are summarized in the background while this reply is generated
+        overflow, window = resources.summarizer.split(history)
+        resources.summarizer.schedule(user_id, summary, overflow)
+    else:
+        window, summary = trim_to_budget(history), None
+    # The system prompt is not stored per user, it is put in front of every prompt
+    messages = build_prompt(SYSTEM_PROMPT, window, user_message, summary)
+    logger.debug("main.py reply_token: %s", event.reply_token)
 
-        redis_client.setex(get_conversation_key(user_id), 86400, json.dumps(history))  # Automatically delete after 1 day
+    # Generate response; slow answers are started early with a partial reply or loading animation
+    reply = StreamingReply(resources.line_bot_api, resources.session, user_id, event.reply_token, received_at=event.timestamp / 1000)
+    with span("agent"):
+        response = await reply.run(resources.generate_reply(messages, event.reply_token, on_text=reply.on_text, user_id=user_id))
 
-        # Check for MinIO URLs in the response and send them
-        pattern_str = fr'{MINIO_URL_API}/.+?\.png'
-        pattern = re.compile(pattern_str)
-        matches = re.findall(pattern, response)
-        # print(f"matches image_url = '{matches}' ")
+    # Truncate to MAX_TOKENS tokens
+    response, response_tokens = truncate_to_tokens(response, MAX_TOKENS)
 
-        if matches:
-            await send_minio_image(event.reply_token, matches[0])
-            return 'OK'  # Early exit after sending the image
-        else:
-            await line_bot_api.reply_message(event.reply_token, reply_msg)
-            
-    return 'OK'
+    # Update history: only this turn's messages are written (and the TTL refreshed)
+    # Token counts are stored with each entry so later turns never re-encode them
+    with span("redis", "append"):
+        await resources.conversation_store.append(user_id, [
+            user_message,
+            {"role": "assistant", "content": response, "tokens": response_tokens},
+        ])
 
+    # Pushed instead of replied when the reply token was already used or is too old
+    # Generated images are not part of the reply, deliver_image_job pushes them later
+    with span("line_reply"):
+        await reply.finish(response)
 
-# Using Redis to store conversation history
-def get_conversation_key(user_id):
-    return f"conversation:{user_id}"
 
-async def send_minio_image(reply_token: str, image_url):
-    """
-    Send an image to the user using the provided reply token and image URL.
-    
-    Args:
-        reply_token: Token from Line event to reply to
-        image_url: URL of the image to send
-    """
-    message = ImageSendMessage(
-        original_content_url=image_url,
-        preview_image_url=image_url
-    )
-    
-    # Use aiohttp for asynchronous HTTP requests
-    async with aiohttp.ClientSession() as session:
-        await line_bot_api.reply_message(
-            reply_token=reply_token,
-            messages=message
-        )
\ No newline at end of file
+async def deliver_image_job(job):
+    """Push a finished image job's picture (or why there is none) to its user."""
+    if job["status"] == FAILED:
+        messages = [TextSendMessage(text=f"Sorry, the image could not be generated: {job.get('error')}")]
+    else:
+        image_url = job["image_url"]
+        messages = [ImageSendMessage(original_content_url=image_url, preview_image_url=image_url)]
+    with span("line_push"):
+        await resources.line_bot_api.push_message(job["user_id"], messages)
@@ -0,0 +1,8 @@
+#conftest.py
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The app's modules live at the repository root; the local stand-ins in benchmarks/
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
@@ -0,0 +1,74 @@
+#test_cache.py
+import asyncio
+
+import pytest
+
+from linebot_cache import ResponseCache
+
+
+CITY_PAIRS = [
+    ("What's the Kyoto forecast?", "What's the Tokyo forecast?"),
+    ("what the weather will be like in Busan", "what the weather will be like in Osaka"),
+    ("台北天氣如何", "台中天氣如何"),
+    ("What is the weather in New York", "What is the weather in New Delhi"),
+]
+
+
+@pytest.mark.parametrize("first, second", CITY_PAIRS)
+def test_different_cities_never_share_an_entry(first, second):
+    cache = ResponseCache(similarity=0.5)
+    cache.put(first, "answer for the first city")
+    assert cache.get(second) is None
+    assert cache.get(first) == "answer for the first city"
+
+
+def test_same_city_reworded_is_a_similar_hit():
+    cache = ResponseCache()
+    cache.put("How's the weather in Tokyo?", "sunny")
+    assert cache.get("how is the weather in tokyo") == "sunny"
+    assert cache.similar_hits == 1
+
+
+def test_numbers_must_match():
+    cache = ResponseCache(similarity=0.5)
+    cache.put("weather in Tokyo on the 12th", "rain")
+    assert cache.get("weather in Tokyo on the 13th") is None
+
+
+@pytest.mark.parametrize("question", ["and tomorrow?", "那明天的天氣呢", "what about Osaka?", "hi", "draw a cat"])
+def test_follow_ups_short_and_image_turns_are_not_cached(question):
+    cache = ResponseCache()
+    cache.put(question, "depends on the user's history")
+    assert len(cache._entries) == 0
+    assert cache.get(question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "what is my name", "Do you remember my name?", "我叫什麼名字", "what did I just ask you",
+    "What did we talk about earlier?", "我剛才問了什麼",
+])
+def test_questions_about_the_user_are_not_cached(question):
+    cache = ResponseCache()
+    cache.put(question, "Your name is Alice.")
+    assert len(cache._entries) == 0
+    assert cache.get(question) is None
+
+
+def test_wrap_does_not_serve_follow_ups_across_users():
+    cache = ResponseCache()
+    calls = []
+
+    async def generate(history, reply_token, **kwargs):
+        calls.append(reply_token)
+        return f"answer for {reply_token}"
+
+    cached = cache.wrap(generate)
+
+    async def run():
+        follow_up = {"role": "user", "content": "and tomorrow?"}
+        first = await cached([{"role": "user", "content": "weather in Tokyo"}, follow_up], "user-a")
+        second = await cached([{"role": "user", "content": "weather in Osaka"}, follow_up], "user-b")
+        return first, second
+
+    assert asyncio.run(run()) == ("answer for user-a", "answer for user-b")
+    assert calls == ["user-a", "user-b"]
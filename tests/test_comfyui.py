@@ -0,0 +1,205 @@
+#test_comfyui.py
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from fake_comfyui_server import FakeComfyUI, serve
+import aiohttp
+
+from linebot_comfyui import ComfyUIClient, ComfyUIError, ComfyUIScheduler, ComfyUITimeout
+
+PORT = 8420
+DEAD_URL = "http://127.0.0.1:8429"  # nothing listens here
+STEP_DELAY = 0.05
+
+
+def workflow(text):
+    return {"6": {"inputs": {"text": text}}, "10": {"inputs": {"noise_seed": 1}}, "11": {"inputs": {"noise_seed": 2}}}
+
+
+def with_fake(scenario, **kwargs):
+    """Run scenario(client, fake) against a fake ComfyUI server."""
+    async def run():
+        fake, runner = await serve(port=PORT, steps=kwargs.pop("steps", 3), step_delay=STEP_DELAY, **kwargs)
+        try:
+            async with ComfyUIClient(f"http://127.0.0.1:{PORT}", timeout=10, reconnect_delay=0.05) as client:
+                await scenario(client, fake)
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_generate_returns_viewable_images():
+    async def scenario(client, fake):
+        images = await client.generate(workflow("a cat"))
+        assert len(images) == 1 and images[0]["render_seconds"] > 0
+        async with client._get_session().get(images[0]["url"]) as response:
+            assert (await response.read()).startswith(b"\x89PNG")
+        assert client.completed == 1
+
+    with_fake(scenario)
+
+
+def test_node_error_raises_comfyui_error():
+    async def scenario(client, fake):
+        with pytest.raises(ComfyUIError, match="fake sampler failure"):
+            await client.generate(workflow("FAIL please"))
+        assert client.failed == 1
+
+    with_fake(scenario)
+
+
+def test_timeout_interrupts_the_running_prompt():
+    async def scenario(client, fake):
+        with pytest.raises(ComfyUITimeout):
+            await client.generate(workflow("slow"), timeout=STEP_DELAY * 1.5)
+        await asyncio.sleep(STEP_DELAY * 2)
+        assert fake.interrupts == 1
+        assert client.timeouts == 1
+
+    with_fake(scenario, steps=10)
+
+
+def test_cancelled_queued_prompt_is_removed_from_the_queue():
+    async def scenario(client, fake):
+        running = asyncio.create_task(client.generate(workflow("first")))
+        queued = asyncio.create_task(client.generate(workflow("second")))
+        await asyncio.sleep(STEP_DELAY)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert fake.deleted == 1
+        assert len(await running) == 1
+
+    with_fake(scenario)
+
+
+def test_dropped_progress_stream_is_reconnected():
+    async def scenario(client, fake):
+        assert len(await client.generate(workflow("reconnect"))) == 1
+        assert client.ws_reconnects == 1
+
+    with_fake(scenario, drop_ws_at_step=2)
+
+
+class ForgetfulComfyUI(FakeComfyUI):
+    """Finishes prompts but has no history for them (e.g. it was cleared meanwhile)."""
+
+    async def get_history(self, request):
+        return web.json_response({})
+
+
+def test_finished_prompt_without_history_raises_comfyui_error():
+    async def scenario():
+        runner = web.AppRunner(ForgetfulComfyUI(steps=2, step_delay=0.01).app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", PORT).start()
+        try:
+            async with ComfyUIClient(f"http://127.0.0.1:{PORT}", timeout=10) as client:
+                with pytest.raises(ComfyUIError, match="no history"):
+                    await client.generate(workflow("a cat"))
+                assert client.failed == 1
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_fails_over_from_an_unreachable_server():
+    async def scenario():
+        fake, runner = await serve(port=PORT, steps=2, step_delay=0.01)
+        scheduler = ComfyUIScheduler([DEAD_URL, f"http://127.0.0.1:{PORT}"], queue_refresh=3600)
+        # Skip the queue check so the dead server looks as good as the live one and is picked first
+        scheduler._refreshed_at = time.monotonic()
+        try:
+            images = await scheduler.generate(workflow("a cat"), user_id="user")
+            assert len(images) == 1
+            assert scheduler.failovers == 1
+            assert fake.prompts == 1
+        finally:
+            await scheduler.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_does_not_resubmit_a_prompt_after_the_server_went_away():
+    async def scenario():
+        dying = FakeComfyUI(steps=20, step_delay=STEP_DELAY)
+        dying_runner = web.AppRunner(dying.app(), shutdown_timeout=0.1)  # don't wait for the open stream
+        await dying_runner.setup()
+        await web.TCPSite(dying_runner, "127.0.0.1", PORT).start()
+        healthy, healthy_runner = await serve(port=PORT + 1, steps=2, step_delay=0.01)
+        scheduler = ComfyUIScheduler([f"http://127.0.0.1:{PORT}", f"http://127.0.0.1:{PORT + 1}"],
+                                     queue_refresh=3600, reconnect_delay=0.01)
+        scheduler._refreshed_at = time.monotonic()
+        try:
+            task = asyncio.create_task(scheduler.generate(workflow("a cat"), user_id="user"))
+            while dying.prompts == 0:
+                await asyncio.sleep(0.01)
+            await dying_runner.cleanup()  # after the prompt was accepted
+            with pytest.raises(aiohttp.ClientConnectorError):
+                await task
+            # Sending it elsewhere would render it twice
+            assert healthy.prompts == 0 and scheduler.failovers == 0
+        finally:
+            await scheduler.close()
+            await healthy_runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+class BrokenHistoryComfyUI(FakeComfyUI):
+    async def get_history(self, request):
+        return web.Response(status=500)
+
+
+def test_prompt_is_abandoned_when_its_progress_cannot_be_read():
+    async def scenario():
+        fake = BrokenHistoryComfyUI(steps=20, step_delay=STEP_DELAY, drop_ws_at_step=1)
+        runner = web.AppRunner(fake.app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", PORT).start()
+        try:
+            async with ComfyUIClient(f"http://127.0.0.1:{PORT}", timeout=10) as client:
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await client.generate(workflow("a cat"))
+                assert client.failed == 1
+            await asyncio.sleep(STEP_DELAY * 2)
+            assert fake.interrupts == 1
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_raises_when_no_server_is_reachable():
+    async def scenario():
+        scheduler = ComfyUIScheduler([DEAD_URL, "http://127.0.0.1:8428"])
+        try:
+            with pytest.raises(ComfyUIError, match="No ComfyUI server reachable"):
+                await scheduler.generate(workflow("a cat"), user_id="user")
+        finally:
+            await scheduler.close()
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_shares_one_render_between_identical_prompts():
+    async def scenario():
+        fake, runner = await serve(port=PORT, steps=2, step_delay=0.01)
+        scheduler = ComfyUIScheduler([f"http://127.0.0.1:{PORT}"])
+        try:
+            results = await asyncio.gather(*(
+                scheduler.generate(workflow("a red bicycle"), key="a red bicycle", user_id=f"user-{i}")
+                for i in range(3)
+            ))
+            assert fake.prompts == 1 and scheduler.coalesced == 2
+            assert len({result[0]["filename"] for result in results}) == 1
+        finally:
+            await scheduler.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
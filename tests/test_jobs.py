@@ -0,0 +1,160 @@
+#test_jobs.py
+import asyncio
+
+import pytest
+
+from linebot_jobs import ImageJobLimitError, ImageJobRunner, RedisImageJobStore, get_image_job_lock_key
+
+fakeredis = pytest.importorskip("fakeredis")
+
+KEY = get_image_job_lock_key("job")
+
+
+def test_renew_and_release_only_touch_the_owners_lock():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        store = RedisImageJobStore(redis)
+        assert await store.claim("job", "worker-a", 30)
+        assert await store.renew("job", "worker-a", 60)
+        # worker-a's lease ran out and worker-b took the job
+        await redis.delete(KEY)
+        assert await store.claim("job", "worker-b", 30)
+        assert not await store.renew("job", "worker-a", 600)
+        await store.release("job", "worker-a")
+        assert await redis.get(KEY) == b"worker-b"
+        assert 0 < await redis.ttl(KEY) <= 30
+        await store.release("job", "worker-b")
+        assert await redis.get(KEY) is None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("action", ["renew", "release"])
+def test_lock_taken_over_after_the_holder_check_is_left_alone(action):
+    server = fakeredis.FakeServer()
+    redis = fakeredis.FakeAsyncRedis(server=server)
+    other = fakeredis.FakeAsyncRedis(server=server)
+    pipeline = redis.pipeline
+
+    def racing_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        get = pipe.get
+
+        async def get_then_lose_the_lease(key):
+            holder = await get(key)
+            # Between worker-a's check and its write the lease expires and worker-b claims the job
+            await other.set(key, "worker-b", ex=30)
+            return holder
+
+        pipe.get = get_then_lose_the_lease
+        return pipe
+
+    async def scenario():
+        store = RedisImageJobStore(redis)
+        assert await store.claim("job", "worker-a", 30)
+        redis.pipeline = racing_pipeline
+        if action == "renew":
+            assert not await store.renew("job", "worker-a", 600)
+        else:
+            await store.release("job", "worker-a")
+        assert await other.get(KEY) == b"worker-b"
+        assert 0 < await other.ttl(KEY) <= 30
+
+    asyncio.run(scenario())
+
+
+def shared_stores(count):
+    """Stores of `count` workers on one Redis."""
+    server = fakeredis.FakeServer()
+    return [RedisImageJobStore(fakeredis.FakeAsyncRedis(server=server)) for _ in range(count)]
+
+
+class Renders:
+    """A render callable that blocks until released and records how many run at once."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.running = 0
+        self.most = 0
+        self.cancelled = 0
+
+    async def __call__(self, prompt, user_id, workflow):
+        self.running += 1
+        self.most = max(self.most, self.running)
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.running -= 1
+        return f"http://images/{prompt}.png"
+
+
+async def start_runners(stores, renders, delivered, **kwargs):
+    runners = [ImageJobRunner(renders, slot_poll=0.01, **kwargs) for _ in stores]
+
+    async def deliver(job):
+        delivered.append(job["prompt"])
+
+    for runner, store in zip(runners, stores):
+        await runner.start(store, deliver)
+    return runners
+
+
+def test_per_user_limit_holds_across_workers():
+    async def scenario():
+        renders, delivered = Renders(), []
+        first, second = await start_runners(shared_stores(2), renders, delivered, per_user=2)
+        await first.submit("user", "a")
+        await first.submit("user", "b")
+        with pytest.raises(ImageJobLimitError):
+            await second.submit("user", "c")
+        await second.submit("someone else", "d")
+        renders.release.set()
+        for runner in (first, second):
+            await runner.close(timeout=5)
+        assert sorted(delivered) == ["a", "b", "d"]
+        # Delivered jobs no longer count against the user
+        await second.submit("user", "e")
+        await second.close(timeout=5)
+
+    asyncio.run(scenario())
+
+
+def test_render_concurrency_holds_across_workers():
+    async def scenario():
+        renders, delivered = Renders(), []
+        runners = await start_runners(shared_stores(3), renders, delivered, concurrency=1)
+        for i, runner in enumerate(runners):
+            await runner.submit(f"user-{i}", f"image-{i}")
+        await asyncio.sleep(0.1)
+        assert renders.running == 1
+        renders.release.set()
+        for runner in runners:
+            await runner.close(timeout=5)
+        assert renders.most == 1
+        assert sorted(delivered) == ["image-0", "image-1", "image-2"]
+
+    asyncio.run(scenario())
+
+
+def test_job_is_cancelled_when_its_claim_is_lost():
+    async def scenario():
+        renders, delivered = Renders(), []
+        [store] = shared_stores(1)
+        [runner] = await start_runners([store], renders, delivered, lease=1)
+        job = await runner.submit("user", "a")
+        await asyncio.sleep(0.05)
+        # The lease lapsed (e.g. a long pause) and another worker claimed the job
+        await store.redis.set(get_image_job_lock_key(job["id"]), "worker-b", ex=60)
+        await asyncio.sleep(0.5)  # the next renewal, a third of the lease later
+        assert renders.cancelled == 1
+        assert runner.claims_lost == 1 and runner.stats()["running"] == 0
+        assert delivered == []
+        # The job is still active for its new owner, and its render slot was freed
+        assert [active["id"] for active in await store.active()] == [job["id"]]
+        assert await store.acquire_slot("other", 1, 60)
+        await runner.close()
+
+    asyncio.run(scenario())
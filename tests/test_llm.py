@@ -0,0 +1,199 @@
+#test_llm.py
+import asyncio
+import time
+
+import openai
+import pytest
+from aiohttp import web
+
+from fake_services import FakeChatCompletions
+from linebot_llm import LLMPool
+
+PORTS = (8450, 8451)
+URLS = [f"http://127.0.0.1:{port}/v1" for port in PORTS]
+DEAD_URL = "http://127.0.0.1:8459/v1"  # nothing listens here
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class FakeLLM(FakeChatCompletions):
+    """Answers after `latency`, or with an error `status` instead."""
+
+    def __init__(self, latency=0.01, status=200):
+        super().__init__(latency)
+        self.status = status
+
+    async def completions(self, request):
+        if self.status != 200:
+            self.requests += 1
+            return web.json_response({"error": {"message": f"fake {self.status}"}}, status=self.status)
+        return await super().completions(request)
+
+
+async def start_app(app, port):
+    runner = web.AppRunner(app, shutdown_timeout=0.1)  # don't wait for requests the test gave up on
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def with_servers(scenario, *servers):
+    """Run scenario(pool_factory) with the fake servers listening on PORTS."""
+    async def run():
+        runners = [await start_app(server.app(), port) for server, port in zip(servers, PORTS)]
+        pools = []
+
+        def pool(urls, **kwargs):
+            pools.append(LLMPool(urls, "test", "fake", **kwargs))
+            return pools[-1]
+
+        try:
+            await scenario(pool)
+        finally:
+            for created in pools:
+                await created.close()
+            for runner in runners:
+                await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def assert_slots_free(pool):
+    for backend in pool.backends:
+        assert backend.in_flight == 0
+        assert not backend._slots.locked()
+
+
+def test_connection_error_fails_over():
+    live = FakeLLM()
+
+    async def scenario(pool):
+        llm = pool([DEAD_URL, URLS[0]])
+        completion = await llm.complete(messages=MESSAGES)
+        assert completion.choices[0].message.content
+        assert llm.failovers == 1 and live.requests == 1
+        dead = llm.backends[0]
+        assert dead.failures == 1 and not dead.healthy
+        # The failed server is avoided while it cools down
+        await llm.complete(messages=MESSAGES)
+        assert llm.failovers == 1 and live.requests == 2
+        assert_slots_free(llm)
+
+    with_servers(scenario, live)
+
+
+def test_server_error_fails_over():
+    broken, live = FakeLLM(status=500), FakeLLM()
+
+    async def scenario(pool):
+        llm = pool(URLS)
+        await llm.complete(messages=MESSAGES)
+        assert (broken.requests, live.requests) == (1, 1)
+        assert llm.failovers == 1
+        assert_slots_free(llm)
+
+    with_servers(scenario, broken, live)
+
+
+def test_client_error_does_not_fail_over():
+    rejecting, live = FakeLLM(status=400), FakeLLM()
+
+    async def scenario(pool):
+        llm = pool(URLS)
+        with pytest.raises(openai.BadRequestError):
+            await llm.complete(messages=MESSAGES)
+        # Another server would reject the same request
+        assert (rejecting.requests, live.requests) == (1, 0)
+        assert llm.failovers == 0 and llm.backends[0].healthy
+        assert_slots_free(llm)
+
+    with_servers(scenario, rejecting, live)
+
+
+def test_hedge_wins_and_the_slow_request_is_cancelled():
+    slow, fast = FakeLLM(latency=5), FakeLLM(latency=0.01)
+
+    async def scenario(pool):
+        llm = pool(URLS, hedge=True, hedge_min_samples=3)
+        for _ in range(3):
+            llm.backends[0].latency.record(0.05)  # the first server usually answers in 50 ms
+        started = time.monotonic()
+        await llm.complete(messages=MESSAGES)
+        assert time.monotonic() - started < 2
+        assert (slow.requests, fast.requests) == (1, 1)
+        assert llm.hedged == 1 and llm.hedge_wins == 1
+        await asyncio.sleep(0.05)  # the cancelled request releases its slot in a done callback
+        assert_slots_free(llm)
+
+    with_servers(scenario, slow, fast)
+
+
+def test_cancelled_request_returns_its_slot():
+    server = FakeLLM(latency=5)
+
+    async def scenario(pool):
+        llm = pool(URLS[:1], concurrency=1, queue_timeout=0.5)
+        request = asyncio.create_task(llm.complete(messages=MESSAGES))
+        await asyncio.sleep(0.1)
+        assert llm.backends[0].in_flight == 1
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        await asyncio.sleep(0.05)
+        assert_slots_free(llm)
+        # The only slot can be taken again
+        server.latency = 0.01
+        await llm.complete(messages=MESSAGES)
+
+    with_servers(scenario, server)
+
+
+class StubStreamModel:
+    """Stands in for a backend's agents model: yields `events`, then raises `error` if set."""
+
+    def __init__(self, events, error=None):
+        self.events = events
+        self.error = error
+        self.streams = 0
+
+    async def stream_response(self, *args, **kwargs):
+        self.streams += 1
+        for event in self.events:
+            yield event
+        if self.error is not None:
+            raise self.error
+
+
+def stream_pool(first, second):
+    llm = LLMPool(["http://127.0.0.1:9/v1", "http://127.0.0.1:10/v1"], "test", "fake")
+    llm.backends[0]._model, llm.backends[1]._model = first, second
+    return llm
+
+
+def test_stream_fails_over_before_its_first_event():
+    first = StubStreamModel([], openai.APIConnectionError(request=None))
+    second = StubStreamModel(["a", "b"])
+    llm = stream_pool(first, second)
+
+    async def scenario():
+        return [event async for event in llm.stream_response()]
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert (first.streams, second.streams) == (1, 1) and llm.failovers == 1
+    assert_slots_free(llm)
+
+
+def test_stream_does_not_fail_over_after_its_first_event():
+    first = StubStreamModel(["a"], openai.APIConnectionError(request=None))
+    second = StubStreamModel(["a", "b"])
+    llm = stream_pool(first, second)
+    received = []
+
+    async def scenario():
+        async for event in llm.stream_response():
+            received.append(event)
+
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(scenario())
+    # Starting over elsewhere would repeat what the user already saw
+    assert received == ["a"]
+    assert second.streams == 0 and llm.failovers == 0
+    assert_slots_free(llm)
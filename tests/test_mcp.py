@@ -0,0 +1,74 @@
+#test_mcp.py
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("mcp")
+
+from agents.mcp import MCPServerStdio  # noqa: E402
+from linebot_mcp import MCPServerPool  # noqa: E402
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "stub_mcp_server.py")
+
+
+def stub_pool(size, delay, crash_after=0, **kwargs):
+    env = dict(os.environ, STUB_MCP_DELAY=str(delay), STUB_MCP_CRASH_AFTER=str(crash_after))
+    return MCPServerPool(
+        lambda i: MCPServerStdio(
+            name=f"stub-{i}",
+            params={"command": sys.executable, "args": [STUB], "env": env},
+            cache_tools_list=True,
+        ),
+        size=size,
+        name="stub-maps",
+        **kwargs,
+    )
+
+
+async def geocode(pool, calls):
+    async def one(i):
+        try:
+            await pool.call_tool("maps_geocode", {"address": f"Taipei {i}"})
+            return True
+        except Exception:
+            return False
+
+    return sum(await asyncio.gather(*(one(i) for i in range(calls))))
+
+
+def test_calls_run_concurrently_on_the_pool():
+    async def scenario():
+        pool = stub_pool(2, 0.3)
+        try:
+            await pool.connect(wait_timeout=30)
+            assert pool.connected
+            started = time.monotonic()
+            assert await geocode(pool, 4) == 4
+            # Two children, two rounds of 0.3s; one child would need four
+            assert time.monotonic() - started < 1.1
+        finally:
+            await pool.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_crashed_children_are_restarted():
+    async def scenario():
+        # Each child exits after its third call; the supervisors reconnect them
+        pool = stub_pool(2, 0.05, crash_after=3, health_interval=0.5, retry_delay=0.2)
+        try:
+            await pool.connect(wait_timeout=30)
+            await geocode(pool, 6)
+            deadline = time.monotonic() + 20
+            while pool.stats()["restarts"] < 2 or pool.stats()["connected"] < 2:
+                assert time.monotonic() < deadline, f"children were not restarted: {pool.stats()}"
+                await asyncio.sleep(0.2)
+            # Calls work again after the restarts
+            assert await geocode(pool, 2) == 2
+        finally:
+            await pool.cleanup()
+
+    asyncio.run(scenario())
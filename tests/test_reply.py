@@ -0,0 +1,55 @@
+#test_reply.py
+import asyncio
+
+from linebot_reply import StreamingReply
+
+FIRST = "first part of a long answer, long enough to be sent on its own before the rest is ready"
+
+
+class FakeLineApi:
+    endpoint = "http://127.0.0.1:9"
+    headers = {}
+
+    def __init__(self, fail_reply=False):
+        self.fail_reply = fail_reply
+        self.replies = []
+        self.pushes = []
+
+    async def reply_message(self, reply_token, messages):
+        if self.fail_reply:
+            raise ConnectionError("LINE is down")
+        self.replies.append([message.text for message in messages])
+
+    async def push_message(self, user_id, messages):
+        self.pushes.append([message.text for message in messages])
+
+
+def answer_slowly(reply):
+    async def generate():
+        reply.on_text(FIRST + "\n")
+        await asyncio.sleep(0.05)
+        return FIRST + "\nsecond part"
+    return generate()
+
+
+def test_partial_reply_is_not_repeated():
+    api = FakeLineApi()
+    reply = StreamingReply(api, None, "user", "token", partial_after=0.01, min_partial_chars=10)
+
+    async def scenario():
+        await reply.finish(await reply.run(answer_slowly(reply)))
+
+    asyncio.run(scenario())
+    assert api.replies == [[FIRST]]
+    assert api.pushes == [["second part"]]
+
+
+def test_failed_partial_reply_is_sent_again_in_full():
+    api = FakeLineApi(fail_reply=True)
+    reply = StreamingReply(api, None, "user", "token", partial_after=0.01, min_partial_chars=10)
+
+    async def scenario():
+        await reply.finish(await reply.run(answer_slowly(reply)))
+
+    asyncio.run(scenario())
+    assert api.pushes == [[FIRST + "\nsecond part"]]
@@ -0,0 +1,11 @@
+#test_search.py
+from linebot_search import normalize_query
+
+
+def test_symbols_keep_queries_apart():
+    keys = {normalize_query(query) for query in ("C++ tutorial", "C# tutorial", "C tutorial")}
+    assert len(keys) == 3
+
+
+def test_case_and_whitespace_are_ignored():
+    assert normalize_query("  Python   Asyncio\tTutorial ") == normalize_query("python asyncio tutorial")
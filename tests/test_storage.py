@@ -0,0 +1,115 @@
+#test_storage.py
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+from fake_comfyui_server import serve
+from linebot_storage import ImageStorage, public_read_policy
+
+boto3 = pytest.importorskip("boto3")
+pytest.importorskip("moto.server")
+
+S3_PORT = 8430
+COMFYUI_PORT = 8431
+ENDPOINT = f"http://127.0.0.1:{S3_PORT}"
+CREDENTIALS = {"aws_access_key_id": "test", "aws_secret_access_key": "test", "region_name": "us-east-1"}
+PART_SIZE = 5 * 2 ** 20  # S3's smallest multipart part
+
+
+@pytest.fixture(scope="module")
+def s3():
+    # moto keeps objects in memory, so it runs in its own process to keep it out of the memory checks
+    server = subprocess.Popen([sys.executable, "-m", "moto.server", "-p", str(S3_PORT)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", S3_PORT), timeout=1).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "moto server did not start"
+                time.sleep(0.1)
+        yield boto3.client("s3", endpoint_url=ENDPOINT, **CREDENTIALS)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def with_comfyui(scenario, view_size=0):
+    async def run():
+        fake, runner = await serve(port=COMFYUI_PORT, view_size=view_size)
+        try:
+            await scenario(f"http://127.0.0.1:{COMFYUI_PORT}/view?filename=x.png&subfolder=&type=output")
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_start_creates_a_publicly_readable_bucket(s3):
+    async def scenario():
+        storage = ImageStorage(ENDPOINT, "created", "test", "test")
+        await storage.start()
+        await storage.start()  # once is enough
+        assert storage.ready
+        await storage.close()
+
+    asyncio.run(scenario())
+    policy = json.loads(s3.get_bucket_policy(Bucket="created")["Policy"])
+    assert policy == public_read_policy("created")
+
+
+def test_large_image_is_streamed_in_parts(s3):
+    size = 10 * PART_SIZE + 12345
+
+    async def scenario(url):
+        storage = ImageStorage(ENDPOINT, "streamed", "test", "test", part_size=PART_SIZE)
+        await storage.start()
+        tracemalloc.start()
+        try:
+            public_url = await storage.upload_from_url(url, "big.png")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        await storage.close()
+        assert public_url == f"{ENDPOINT}/streamed/big.png"
+        assert storage.bytes_uploaded == size
+        # Parts are sent as they arrive: memory is bounded by a few parts, not the image size
+        assert peak < 5 * PART_SIZE
+
+    with_comfyui(scenario, view_size=size)
+    head = s3.head_object(Bucket="streamed", Key="big.png")
+    assert head["ContentLength"] == size
+    assert head["ContentType"] == "image/png"
+    assert head["ETag"].strip('"').endswith("-11")  # a multipart upload of eleven parts
+
+
+def test_failed_download_is_counted_and_raised(s3):
+    async def scenario(url):
+        storage = ImageStorage(ENDPOINT, "failed", "test", "test")
+        with pytest.raises(Exception):
+            await storage.upload_from_url(url.replace("/view", "/missing"), "missing.png")
+        assert storage.upload_failures == 1 and storage.uploads == 0
+        await storage.close()
+
+    with_comfyui(scenario)
+
+
+def test_delete_removes_objects(s3):
+    async def scenario(url):
+        storage = ImageStorage(ENDPOINT, "deleted", "test", "test")
+        await storage.upload_from_url(url, "a.png")
+        await storage.upload_from_url(url, "b.png")
+        await storage.delete(["a.png", "b.png"])
+        assert storage.deletes == 2
+        await storage.close()
+
+    with_comfyui(scenario)
+    assert s3.list_objects_v2(Bucket="deleted").get("KeyCount") == 0
@@ -0,0 +1,40 @@
+#test_tools.py
+import asyncio
+import time
+
+import pytest
+
+from linebot_tools import limited_tool, tool_stats
+
+
+def test_slow_tool_times_out():
+    async def slow_lookup():
+        await asyncio.sleep(5)
+
+    run = limited_tool(slow_lookup, timeout=0.1)
+    assert "did not finish within 0.1 seconds" in asyncio.run(run())
+    assert tool_stats()["slow_lookup"]["timeouts"] == 1
+    assert tool_stats()["slow_lookup"]["errors"] == 0
+
+
+def test_timeout_inside_the_tool_is_an_error():
+    async def flaky_lookup():
+        raise TimeoutError("upstream read timed out")
+
+    run = limited_tool(flaky_lookup, timeout=5)
+    with pytest.raises(TimeoutError, match="upstream"):
+        asyncio.run(run())
+    assert tool_stats()["flaky_lookup"]["timeouts"] == 0
+    assert tool_stats()["flaky_lookup"]["errors"] == 1
+
+
+def test_timeout_inside_a_sync_tool_is_an_error():
+    def blocking_lookup():
+        time.sleep(0.01)
+        raise TimeoutError("socket timed out")
+
+    run = limited_tool(blocking_lookup, timeout=5)
+    with pytest.raises(TimeoutError, match="socket"):
+        asyncio.run(run())
+    assert tool_stats()["blocking_lookup"]["timeouts"] == 0
+    assert tool_stats()["blocking_lookup"]["errors"] == 1